@@ -0,0 +1,210 @@
+"""
+Admission control for the API.
+
+Each worker caps the number of requests it processes at once. Requests over
+the cap are rejected immediately with 503 and Retry-After rather than queued,
+so an overloaded worker sheds a fraction of its traffic instead of letting
+latency grow for every request. Health probes bypass the cap, so an
+overloaded worker is never mistaken for a dead one.
+
+Batch requests, uploads and network streams take as long as their input or
+the database walk they need, however idle the worker, so they count against
+the cap but their response times are kept out of the latency gradient.
+
+In adaptive mode the cap follows the latency gradient: while the short-term
+response time stays near its long-term baseline the cap grows, and when
+requests start queueing and the short-term response time rises, it shrinks.
+"""
+
+import json
+import logging
+import math
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from api.config import API_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Paths that are always admitted
+PRIORITY_PATHS = ("/healthz", "/readyz")
+
+# Path prefixes whose response times do not reflect the load, besides every
+# request other than GET or HEAD
+UNTIMED_PATHS = tuple(
+    f"{API_PREFIX}/geoip/{path}" for path in ("network/", "asn/", "country/")
+)
+
+
+class ConcurrencyLimiter:
+    """
+    Tracks in-flight requests against an adaptive or fixed limit.
+
+    The limiter is only used from the event loop, so it needs no locking.
+    """
+
+    def __init__(
+        self,
+        mode: str = "adaptive",
+        initial_limit: int = 64,
+        min_limit: int = 4,
+        max_limit: int = 512,
+        smoothing: float = 0.2,
+        tolerance: float = 1.5,
+    ):
+        """
+        Initialize the limiter.
+
+        Args:
+            mode: "adaptive" to follow the latency gradient, "fixed" to keep
+                the initial limit
+            initial_limit: Starting (or, in fixed mode, permanent) limit
+            min_limit: Lowest limit adaptive mode may shrink to
+            max_limit: Highest limit adaptive mode may grow to
+            smoothing: Weight given to each new limit estimate
+            tolerance: How far the short-term response time may rise above
+                the baseline before the limit shrinks
+        """
+        if mode not in ("adaptive", "fixed"):
+            raise ValueError(f"Invalid admission control mode: {mode}")
+        self.mode = mode
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self._limit = float(initial_limit)
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._short_rtt: Optional[float] = None
+        self._long_rtt: Optional[float] = None
+
+    @property
+    def limit(self) -> int:
+        """Current maximum number of in-flight requests."""
+        return int(self._limit)
+
+    def try_acquire(self) -> bool:
+        """Admit a request if the worker is below its limit."""
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self, rtt: Optional[float] = None) -> None:
+        """
+        Mark an admitted request as finished.
+
+        Args:
+            rtt: Response time of the request in seconds, if measured
+        """
+        self.in_flight -= 1
+        if rtt is not None and self.mode == "adaptive":
+            self._update(rtt)
+
+    def _update(self, rtt: float) -> None:
+        if self._short_rtt is None or self._long_rtt is None:
+            self._short_rtt = self._long_rtt = rtt
+            return
+        self._short_rtt += (rtt - self._short_rtt) * 0.1
+        self._long_rtt += (rtt - self._long_rtt) * 0.01
+        # After a sustained overload, let the baseline recover quickly
+        if self._long_rtt > 2 * self._short_rtt:
+            self._long_rtt *= 0.95
+
+        gradient = max(
+            0.5, min(1.0, self.tolerance * self._long_rtt / max(self._short_rtt, 1e-9))
+        )
+        estimate = self._limit * gradient + math.sqrt(self._limit)
+        # Only grow while the limit is actually in use
+        if estimate > self._limit and self.in_flight < self._limit / 2:
+            return
+        limit = self._limit * (1 - self.smoothing) + estimate * self.smoothing
+        self._limit = max(self.min_limit, min(self.max_limit, limit))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the limit, in-flight count, counters and response times."""
+        return {
+            "mode": self.mode,
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "short_rtt_ms": _milliseconds(self._short_rtt),
+            "long_rtt_ms": _milliseconds(self._long_rtt),
+        }
+
+
+def _milliseconds(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware rejecting requests while the limiter is saturated."""
+
+    def __init__(
+        self,
+        app: Any,
+        limiter: ConcurrencyLimiter,
+        retry_after: int = 1,
+        priority_paths: Iterable[str] = PRIORITY_PATHS,
+        untimed_paths: Iterable[str] = UNTIMED_PATHS,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.priority_paths = frozenset(priority_paths)
+        self.untimed_paths = tuple(untimed_paths)
+        self._rejection = json.dumps(
+            {"detail": "Server is overloaded, retry later"}
+        ).encode()
+        self._rejection_headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(self._rejection)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.priority_paths:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiter
+        if not limiter.try_acquire():
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": self._rejection_headers,
+                }
+            )
+            await send({"type": "http.response.body", "body": self._rejection})
+            return
+
+        rtt: Optional[float] = None
+        if scope["method"] not in ("GET", "HEAD") or scope["path"].startswith(
+            self.untimed_paths
+        ):
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                limiter.release(rtt)
+            return
+
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            nonlocal rtt
+            # Time to the response headers, so long streamed bodies do not
+            # count as slow responses
+            if rtt is None and message["type"] == "http.response.start":
+                rtt = time.perf_counter() - start
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            limiter.release(rtt)
@@ -0,0 +1,372 @@
+"""
+Precompressed static assets and the pre-rendered index page.
+
+Every static file is given a content-hashed URL, which is served with a
+year-long immutable Cache-Control, and compressed variants of every file worth
+compressing are prepared ahead of time. The index page is rendered once, with
+its asset links rewritten to the hashed URLs. All of it is held in memory, so
+serving the demo page costs a dictionary lookup instead of file reads,
+template rendering and compression.
+
+Build it ahead of deployment, with brotli where available:
+
+    python -m api.assets
+
+Without a build, the assets are prepared at startup with gzip only, on the
+thread pool.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from api.config import ASSET_BUILD_DIR, STATIC_CACHE_MAX_AGE, STATIC_DIR, TEMPLATES_DIR
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Links to static files in the index page
+STATIC_LINK_PATTERN = re.compile(r'((?:href|src)=")/static/([^"]+)"')
+
+# Content types not worth compressing
+COMPRESSED_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp", "font/woff")
+
+# Preference order of the encodings served
+ENCODINGS = ("br", "gzip")
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+
+class Asset(NamedTuple):
+    """A static response, with its body in every prepared encoding."""
+
+    content_type: str
+    etag: str
+    cache_control: str
+    # Bodies by content coding, always including "identity"
+    bodies: Dict[str, bytes]
+
+
+class AssetBundle(NamedTuple):
+    """The static assets by URL path below /static, and the index page."""
+
+    assets: Dict[str, Asset]
+    page: Asset
+
+
+def hashed_name(path: str, content: bytes) -> str:
+    """Insert a hash of the content into a file name: css/styles.1a2b3c4d5e.css"""
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    stem, dot, suffix = path.rpartition(".")
+    return (
+        f"{stem}.{digest}.{suffix}" if dot and "/" not in suffix else f"{path}.{digest}"
+    )
+
+
+def compress(
+    content: bytes, content_type: str, brotli_quality: int
+) -> Dict[str, bytes]:
+    """
+    Prepare the encodings of a body that are worth serving.
+
+    Args:
+        content: The uncompressed body
+        content_type: Its media type
+        brotli_quality: Brotli quality from 0 to 11, or -1 to skip brotli
+
+    Returns:
+        Bodies by content coding, including "identity"
+    """
+    bodies = {"identity": content}
+    if content_type.startswith(COMPRESSED_TYPES) or len(content) < 256:
+        return bodies
+
+    variants = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli_quality >= 0:
+        try:
+            import brotli
+        except ImportError:
+            logger.info("brotli is not installed, skipping brotli variants")
+        else:
+            variants["br"] = brotli.compress(content, quality=brotli_quality)
+    for coding, body in variants.items():
+        # Variants barely smaller than the original only cost decompression
+        if len(body) < len(content) * 0.9:
+            bodies[coding] = body
+    return bodies
+
+
+def build_assets(
+    static_dir: Path = STATIC_DIR,
+    templates_dir: Path = TEMPLATES_DIR,
+    brotli_quality: int = 11,
+) -> AssetBundle:
+    """
+    Hash, compress and render the static files and the index page.
+
+    Args:
+        static_dir: Directory of the static files
+        templates_dir: Directory holding index.html
+        brotli_quality: Brotli quality from 0 to 11, or -1 to skip brotli
+
+    Returns:
+        The prepared assets
+    """
+    assets: Dict[str, Asset] = {}
+    hashed: Dict[str, str] = {}
+    for file in sorted(p for p in static_dir.rglob("*") if p.is_file()):
+        path = file.relative_to(static_dir).as_posix()
+        content = file.read_bytes()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        bodies = compress(content, content_type, brotli_quality)
+        etag = '"' + hashlib.sha256(content).hexdigest()[:16] + '"'
+        hashed[path] = hashed_name(path, content)
+        assets[hashed[path]] = Asset(content_type, etag, IMMUTABLE, bodies)
+        # The original URL stays available, e.g. for links from other sites
+        assets[path] = Asset(
+            content_type, etag, f"public, max-age={STATIC_CACHE_MAX_AGE}", bodies
+        )
+
+    page = render_index(templates_dir, hashed)
+    index = Asset(
+        "text/html; charset=utf-8",
+        '"' + hashlib.sha256(page).hexdigest()[:16] + '"',
+        # Revalidated on every visit so a deployment's new asset URLs are seen
+        "no-cache",
+        compress(page, "text/html", brotli_quality),
+    )
+    return AssetBundle(assets, index)
+
+
+def render_index(templates_dir: Path, hashed: Dict[str, str]) -> bytes:
+    """Render the index page with its static links pointing at hashed URLs."""
+    from jinja2 import Environment, FileSystemLoader
+
+    environment = Environment(loader=FileSystemLoader(str(templates_dir)))
+    page = environment.get_template("index.html").render()
+
+    def link(match: "re.Match[str]") -> str:
+        path = hashed.get(match.group(2), match.group(2))
+        return f'{match.group(1)}/static/{path}"'
+
+    return STATIC_LINK_PATTERN.sub(link, page).encode()
+
+
+def write_bundle(bundle: AssetBundle, build_dir: Path) -> None:
+    """Write a bundle, with one file per body and a manifest."""
+    manifest = {}
+    # Hashed and original URLs share their bodies, which are written once
+    written: Dict[int, str] = {}
+    entries: List[Tuple[str, Asset]] = [*bundle.assets.items(), ("", bundle.page)]
+    for path, asset in entries:
+        name = written.setdefault(id(asset.bodies), path or "index.html")
+        if name == (path or "index.html"):
+            for coding, body in asset.bodies.items():
+                target = build_dir / (name + EXTENSIONS.get(coding, ""))
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_bytes(body)
+        manifest[path] = {
+            "file": name,
+            "content_type": asset.content_type,
+            "etag": asset.etag,
+            "cache_control": asset.cache_control,
+            "encodings": sorted(asset.bodies),
+        }
+    (build_dir / "manifest.json").write_text(json.dumps(manifest, indent=1))
+
+
+def read_bundle(build_dir: Path) -> AssetBundle:
+    """
+    Read a bundle written by write_bundle.
+
+    Raises:
+        OSError: If the bundle cannot be read
+        ValueError: If the manifest is invalid
+    """
+    manifest = json.loads((build_dir / "manifest.json").read_text())
+    assets: Dict[str, Asset] = {}
+    files: Dict[str, Dict[str, bytes]] = {}
+    for path, entry in manifest.items():
+        name = entry["file"]
+        if name not in files:
+            files[name] = {
+                coding: (build_dir / (name + EXTENSIONS.get(coding, ""))).read_bytes()
+                for coding in entry["encodings"]
+            }
+        bodies = files[name]
+        assets[path] = Asset(
+            entry["content_type"], entry["etag"], entry["cache_control"], bodies
+        )
+    index = assets.pop("")
+    return AssetBundle(assets, index)
+
+
+def load_bundle(build_dir: Path = ASSET_BUILD_DIR) -> AssetBundle:
+    """Read the built bundle, or prepare one in memory if there is none."""
+    if (build_dir / "manifest.json").exists():
+        try:
+            bundle = read_bundle(build_dir)
+            logger.info(f"Loaded {len(bundle.assets)} static assets from {build_dir}")
+            return bundle
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to read static assets from {build_dir}: {e}")
+    logger.info("Preparing static assets, run `python -m api.assets` to prebuild")
+    return build_assets(brotli_quality=-1)
+
+
+def negotiate(
+    asset: Asset, accept_encoding: str, if_none_match: Optional[str]
+) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """
+    Choose the response for a request.
+
+    Args:
+        asset: The requested asset
+        accept_encoding: The Accept-Encoding request header
+        if_none_match: The If-None-Match request header, if any
+
+    Returns:
+        Tuple of (status, headers, body)
+    """
+    headers = [
+        (b"etag", asset.etag.encode()),
+        (b"cache-control", asset.cache_control.encode()),
+        (b"vary", b"Accept-Encoding"),
+    ]
+    if if_none_match is not None and (
+        if_none_match.strip() == "*" or asset.etag in if_none_match
+    ):
+        return 304, headers, b""
+
+    accepted = accepted_encodings(accept_encoding)
+    body = asset.bodies["identity"]
+    for coding in ENCODINGS:
+        if coding in accepted and coding in asset.bodies:
+            body = asset.bodies[coding]
+            headers.append((b"content-encoding", coding.encode()))
+            break
+    headers.append((b"content-type", asset.content_type.encode()))
+    headers.append((b"content-length", str(len(body)).encode()))
+    return 200, headers, body
+
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    """
+    Parse an Accept-Encoding header into the codings it accepts.
+
+    Codings with a q-value of 0, in any notation such as "q=0.000", are
+    refused, as are codings with an invalid q-value.
+    """
+    accepted = set()
+    for token in accept_encoding.lower().split(","):
+        coding, *params = token.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip())
+    return accepted
+
+
+class StaticAssets:
+    """
+    Serves the prepared static assets, loading them on the first request
+    unless prepare was awaited at startup.
+    """
+
+    def __init__(self, build_dir: Path = ASSET_BUILD_DIR):
+        self.build_dir = build_dir
+        self._bundle: Optional[AssetBundle] = None
+        self._lock = threading.Lock()
+
+    @property
+    def bundle(self) -> AssetBundle:
+        """The prepared assets, loaded or built in the calling thread."""
+        if self._bundle is None:
+            with self._lock:
+                if self._bundle is None:
+                    self._bundle = load_bundle(self.build_dir)
+        return self._bundle
+
+    async def prepare(self) -> AssetBundle:
+        """
+        The prepared assets, loaded or built on the thread pool the first time,
+        as compressing and rendering them would block the event loop.
+        """
+        if self._bundle is None:
+            return await run_in_threadpool(lambda: self.bundle)
+        return self._bundle
+
+    async def __call__(self, scope, receive, send):
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path) :]
+
+        bundle = await self.prepare()
+        asset = bundle.assets.get(path.lstrip("/"))
+        if scope["method"] not in ("GET", "HEAD"):
+            status, headers, body = 405, [(b"allow", b"GET, HEAD")], b""
+        elif asset is None:
+            status, headers, body = (
+                404,
+                [(b"content-type", b"text/plain")],
+                b"Not Found",
+            )
+        else:
+            request_headers = dict(scope["headers"])
+            status, headers, body = negotiate(
+                asset,
+                request_headers.get(b"accept-encoding", b"").decode("latin-1"),
+                _header(request_headers, b"if-none-match"),
+            )
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b"" if scope["method"] == "HEAD" else body,
+            }
+        )
+
+
+def _header(headers: Dict[bytes, bytes], name: bytes) -> Optional[str]:
+    value = headers.get(name)
+    return None if value is None else value.decode("latin-1")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the static assets")
+    parser.add_argument(
+        "--output", default=str(ASSET_BUILD_DIR), help="Directory to write them to"
+    )
+    parser.add_argument(
+        "--brotli-quality", type=int, default=11, help="0 to 11, or -1 to skip brotli"
+    )
+    args = parser.parse_args()
+
+    bundle = build_assets(brotli_quality=args.brotli_quality)
+    write_bundle(bundle, Path(args.output))
+    size = sum(len(a.bodies["identity"]) for a in bundle.assets.values()) // 2
+    print(
+        f"Built {len(bundle.assets) // 2} static assets ({size} bytes) in {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+"""
+Result cache shared between API workers.
+
+Results are cached per network rather than per address: every address of an
+IPv4 /24 or IPv6 /48 shares one entry, as long as the database has a single
+result for the whole block. Entries record the epoch they were looked up in,
+so entries from a previous database build or set of overrides are never
+served, unless a diff between the two builds, or the changes between the two
+sets of overrides, show the block's results are unchanged.
+
+Backends:
+    local: an in-process LRU, private to each worker
+    shm: a fixed-size table in a named shared-memory segment, shared by all
+        workers on one host and kept across worker restarts
+    redis: any server speaking the Redis protocol (GET/SET), shared by all
+        workers on all hosts
+"""
+
+import hashlib
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from geoip_api import GeoIPLookup, GeoResult, ParsedIP, parse_ip
+from geoip_api.core.diff import DatabaseDiff
+from geoip_api.core.result import make_result
+from geoip_api.core.special import special_range
+from geoip_api.exceptions import InvalidIPError
+
+logger = logging.getLogger(__name__)
+
+# Size of the block every cache entry covers
+IPV4_CACHE_PREFIX = 24
+IPV6_CACHE_PREFIX = 48
+
+
+class CacheBackend:
+    """Interface for key-value stores that hold serialized results."""
+
+    name = "base"
+    # Whether get and set wait on the network, and so must stay off the event loop
+    blocking = False
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the value for a key, or None on a miss."""
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes) -> None:
+        """Store a value. Backends may drop values they cannot hold."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release any resources held by the backend."""
+
+
+class LocalCacheBackend(CacheBackend):
+    """An in-process LRU cache."""
+
+    name = "local"
+
+    def __init__(self, max_entries: int = 65536):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SharedMemoryCacheBackend(CacheBackend):
+    """
+    A direct-mapped cache table in a named shared-memory segment.
+
+    Each key hashes to one slot, and a new entry simply replaces whatever
+    the slot held before. Slots carry a checksum of their payload, so a read
+    racing a write from another process is detected and treated as a miss
+    instead of returning a torn value. The segment is deliberately not
+    removed when a worker exits, so a restarted worker finds it still warm.
+    """
+
+    name = "shm"
+
+    # key hash, payload checksum, payload length
+    _HEADER = struct.Struct("<QIH")
+
+    def __init__(self, segment_name: str, slots: int = 65536, slot_size: int = 256):
+        from multiprocessing import shared_memory
+
+        self.slot_size = slot_size
+        self._payload_size = slot_size - self._HEADER.size
+        size = slots * slot_size
+        try:
+            self._shm = _open_shared_memory(shared_memory, segment_name, size, True)
+            logger.info(f"Created shared cache segment {segment_name}")
+        except FileExistsError:
+            self._shm = _open_shared_memory(shared_memory, segment_name, 0, False)
+            logger.info(f"Attached to shared cache segment {segment_name}")
+        self.slots = self._shm.size // slot_size
+        self._buf = self._shm.buf
+
+    def _slot(self, key: str) -> Tuple[int, int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "little") or 1
+        return key_hash, (key_hash % self.slots) * self.slot_size
+
+    def get(self, key: str) -> Optional[bytes]:
+        key_hash, offset = self._slot(key)
+        stored_hash, checksum, length = self._HEADER.unpack_from(self._buf, offset)
+        if stored_hash != key_hash or length > self._payload_size:
+            return None
+        start = offset + self._HEADER.size
+        value = bytes(self._buf[start : start + length])
+        if zlib.crc32(value) != checksum:
+            return None
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self._payload_size:
+            return
+        key_hash, offset = self._slot(key)
+        start = offset + self._HEADER.size
+        # Invalidate the slot first so readers never pair the new key with
+        # the old payload
+        self._HEADER.pack_into(self._buf, offset, 0, 0, 0)
+        self._buf[start : start + len(value)] = value
+        self._HEADER.pack_into(
+            self._buf, offset, key_hash, zlib.crc32(value), len(value)
+        )
+
+    def close(self) -> None:
+        self._buf = None
+        self._shm.close()
+
+
+def _open_shared_memory(shared_memory: Any, name: str, size: int, create: bool):
+    """Open a segment that outlives this process."""
+    try:
+        # Python 3.13+ can skip the resource tracker directly
+        return shared_memory.SharedMemory(
+            name=name, create=create, size=size, track=False
+        )
+    except TypeError:
+        pass
+
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    # Otherwise the resource tracker unlinks the segment when this process
+    # exits, which would empty the cache on every worker restart
+    from multiprocessing import resource_tracker
+
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class KeyValueCacheBackend(CacheBackend):
+    """
+    A client for key-value servers speaking the Redis protocol.
+
+    Only GET and SET are used, so Redis, Valkey, KeyDB and similar servers all
+    work. Any server error is logged and treated as a miss: the cache must
+    never fail a lookup. After an error, the server is left alone for a
+    backoff period during which every call is a miss, so an unreachable server
+    does not cost each request a connection attempt.
+    """
+
+    name = "redis"
+    blocking = True
+
+    def __init__(
+        self, url: str, ttl: int = 3600, timeout: float = 0.1, backoff: float = 1.0
+    ):
+        parsed = urlparse(url if "://" in url else f"redis://{url}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.backoff = backoff
+        # One connection per thread, as requests run in a thread pool
+        self._local = threading.local()
+        # Monotonic time before which the server is not contacted
+        self._retry_at = 0.0
+
+    def _connection(self) -> Tuple[socket.socket, Any]:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+            if self.db:
+                self._command(conn, b"SELECT", str(self.db).encode())
+        return conn
+
+    def _command(self, conn: Tuple[socket.socket, Any], *args: bytes) -> Any:
+        sock, reader = conn
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        sock.sendall(b"".join(parts))
+        return _read_reply(reader)
+
+    def _call(self, *args: bytes) -> Any:
+        if time.monotonic() < self._retry_at:
+            return None
+        try:
+            return self._command(self._connection(), *args)
+        except (OSError, ValueError) as e:
+            logger.warning(
+                f"Cache server {self.host}:{self.port} error: {e}, "
+                f"retrying in {self.backoff}s"
+            )
+            self._retry_at = time.monotonic() + self.backoff
+            self._reset()
+            return None
+
+    def _reset(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._call(b"GET", key.encode())
+        return value if isinstance(value, bytes) else None
+
+    def set(self, key: str, value: bytes) -> None:
+        self._call(b"SET", key.encode(), value, b"EX", str(self.ttl).encode())
+
+    def close(self) -> None:
+        self._reset()
+
+
+def _read_reply(reader: Any) -> Any:
+    """Read one reply in the Redis serialization protocol."""
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ValueError("Connection closed")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        raise ValueError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        count = int(payload)
+        return None if count < 0 else [_read_reply(reader) for _ in range(count)]
+    raise ValueError(f"Unexpected reply: {line!r}")
+
+
+class ResultCache:
+    """
+    Caches lookup results per network, tagged with the database epoch.
+    """
+
+    def __init__(self, backend: CacheBackend, diff: Optional[DatabaseDiff] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            backend: Store holding the serialized results
+            diff: Diff from the previous database build to the current one.
+                Entries of the previous build are kept for every block the
+                diff shows unchanged, instead of being looked up again.
+        """
+        self.backend = backend
+        self.diff = diff
+        self.hits = 0
+        self.misses = 0
+        self.carried_over = 0
+
+    @staticmethod
+    def cache_network(address: ParsedIP) -> Tuple[str, int]:
+        """
+        Return the block whose results share one cache entry.
+
+        Returns:
+            Tuple of (block key, block prefix length)
+        """
+        if address.version == 4:
+            prefix_len, host_bits = IPV4_CACHE_PREFIX, 32 - IPV4_CACHE_PREFIX
+        else:
+            prefix_len, host_bits = IPV6_CACHE_PREFIX, 128 - IPV6_CACHE_PREFIX
+        return f"{address.version}:{address.value >> host_bits:x}", prefix_len
+
+    def lookup(
+        self, geoip_lookup: GeoIPLookup, ip_address: Union[str, ParsedIP]
+    ) -> GeoResult:
+        """
+        Look up an IP address, serving it from the cache when possible.
+
+        Args:
+            geoip_lookup: Lookup service used on a cache miss
+            ip_address: IP address to look up, as a string or a ParsedIP
+
+        Raises:
+            ValueError: If the IP address is invalid
+            InvalidIPError: If the IP address is invalid
+            LookupError: If the lookup fails
+        """
+        address = (
+            ip_address if isinstance(ip_address, ParsedIP) else parse_ip(ip_address)
+        )
+        # Special-purpose ranges can be smaller than a block, so their addresses
+        # never share an entry with their neighbours. They need no search anyway.
+        if geoip_lookup.special_ranges and special_range(address) is not None:
+            return geoip_lookup.lookup(address, as_dict=False)
+
+        block, block_prefix = self.cache_network(address)
+        key = f"geoip:{block}"
+        epoch = geoip_lookup.epoch
+
+        cached = self.backend.get(key)
+        if cached is not None:
+            try:
+                cached_epoch, result = _decode_entry(cached)
+            except (ValueError, TypeError) as e:
+                # Truncated or written by something else: replaced below
+                logger.warning(f"Invalid result cache entry {key}: {e}")
+                cached = None
+        if cached is not None:
+            if cached_epoch == epoch:
+                self.hits += 1
+                return result
+            if self._unchanged(
+                geoip_lookup, cached_epoch, epoch, address, block_prefix
+            ):
+                # Re-tag the entry so it also survives the next update
+                self.backend.set(key, _encode_entry(epoch, result))
+                self.hits += 1
+                self.carried_over += 1
+                return result
+
+        self.misses += 1
+        result, network = geoip_lookup.lookup_with_network(address)
+        # Only cache results that hold for the whole block
+        if network.prefixlen <= block_prefix:
+            self.backend.set(key, _encode_entry(epoch, result))
+        return result
+
+    def _unchanged(
+        self,
+        geoip_lookup: GeoIPLookup,
+        cached_epoch: str,
+        epoch: str,
+        address: ParsedIP,
+        block_prefix: int,
+    ) -> bool:
+        """
+        Whether a block is unchanged since the cached epoch.
+
+        The databases and the overrides are compared separately: by the diff
+        between the database builds, and by the changes of the last override
+        reload.
+        """
+        host_bits = (32 if address.version == 4 else 128) - block_prefix
+        first = address.value >> host_bits << host_bits
+        last = first | ((1 << host_bits) - 1)
+
+        cached_database, cached_overrides = _split_epoch(cached_epoch)
+        database, overrides = _split_epoch(epoch)
+        if cached_database != database:
+            diff = self.diff
+            if (
+                diff is None
+                or diff.old_epoch != cached_database
+                or diff.new_epoch != database
+                or diff.changed_set.overlaps(address.version, first, last)
+            ):
+                return False
+        if cached_overrides != overrides:
+            changes = geoip_lookup.override_changes
+            if (
+                changes is None
+                or changes.old_digest != cached_overrides
+                or changes.new_digest != overrides
+                or changes.changed.overlaps(address.version, first, last)
+            ):
+                return False
+        return True
+
+    def lookup_many(
+        self, geoip_lookup: GeoIPLookup, ip_addresses: Iterable[Union[str, ParsedIP]]
+    ) -> List[Optional[GeoResult]]:
+        """
+        Look up many IP addresses through the cache.
+
+        Returns:
+            One result per address, None where the address is invalid
+        """
+        results: List[Optional[GeoResult]] = []
+        for ip_address in ip_addresses:
+            try:
+                results.append(self.lookup(geoip_lookup, ip_address))
+            except (ValueError, InvalidIPError):
+                results.append(None)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the backend name and hit counters of this worker."""
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "carried_over": self.carried_over,
+        }
+
+
+def _split_epoch(epoch: str) -> Tuple[str, str]:
+    """Split a GeoIPLookup.epoch into its database and override digest parts."""
+    city, _, rest = epoch.partition("-")
+    asn, _, overrides = rest.partition("-")
+    return f"{city}-{asn}" if rest else city, overrides
+
+
+def _encode_entry(epoch: str, result: GeoResult) -> bytes:
+    fields = json.dumps(list(result), separators=(",", ":"))
+    return f"{epoch}\n{fields}".encode()
+
+
+def _decode_entry(value: bytes) -> Tuple[str, GeoResult]:
+    epoch, _, fields = value.partition(b"\n")
+    result = make_result(dict(zip(GeoResult._fields, json.loads(fields))))
+    return epoch.decode(), result
+
+
+def create_backend(kind: str, **options: Any) -> Optional[CacheBackend]:
+    """
+    Create a cache backend by name.
+
+    Args:
+        kind: "none", "local", "shm" or "redis"
+        options: url, ttl, timeout, backoff, shm_name and shm_slots, as
+            relevant to the backend
+
+    Returns:
+        The backend, or None if caching is disabled
+
+    Raises:
+        ValueError: If the backend name is unknown
+    """
+    if kind == "none":
+        return None
+    if kind == "local":
+        return LocalCacheBackend()
+    if kind == "shm":
+        return SharedMemoryCacheBackend(options["shm_name"], options["shm_slots"])
+    if kind == "redis":
+        return KeyValueCacheBackend(
+            options["url"],
+            ttl=options["ttl"],
+            timeout=options["timeout"],
+            backoff=options["backoff"],
+        )
+    raise ValueError(f"Unknown result cache backend: {kind}")
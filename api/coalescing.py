@@ -0,0 +1,149 @@
+"""
+Coalescing of concurrent lookups in the async request path.
+
+Concurrent requests for the same IP address share one in-flight lookup
+(single-flight). With batching enabled, different addresses requested in the
+same event-loop tick are also looked up together in one pass on the thread
+pool, instead of one thread pool round trip each.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Union
+
+from starlette.concurrency import run_in_threadpool
+
+from geoip_api import GeoResult, ParsedIP
+from geoip_api.exceptions import InvalidIPError
+
+logger = logging.getLogger(__name__)
+
+# Looks up a batch of addresses, returning None for invalid ones
+BatchLookup = Callable[[List[ParsedIP]], List[Optional[GeoResult]]]
+
+
+class LookupCoalescer:
+    """
+    Shares in-flight lookups between concurrent requests.
+    """
+
+    def __init__(self, batching: bool = False, max_batch_size: int = 256):
+        """
+        Initialize the coalescer.
+
+        Args:
+            batching: Whether to merge different addresses requested in the
+                same event-loop tick into one batch
+            max_batch_size: Maximum number of addresses per batch
+        """
+        self.batching = batching
+        self.max_batch_size = max_batch_size
+        # Keyed by packed address, so different spellings of one address
+        # share a lookup too
+        self._in_flight: Dict[bytes, "asyncio.Future[GeoResult]"] = {}
+        self._pending: List[ParsedIP] = []
+        self._flush_scheduled = False
+        self.lookups = 0
+        self.coalesced = 0
+        self.batches = 0
+
+    async def lookup(self, lookup_batch: BatchLookup, address: ParsedIP) -> GeoResult:
+        """
+        Look up an IP address, joining an identical lookup already in flight.
+
+        Args:
+            lookup_batch: Function performing the actual lookups
+            address: Parsed IP address to look up
+
+        Returns:
+            The lookup result
+
+        Raises:
+            InvalidIPError: If the IP address is invalid
+            LookupError: If the lookup fails
+        """
+        self.lookups += 1
+        future = self._in_flight.get(address.packed)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = self._in_flight[address.packed] = loop.create_future()
+            # Failures are re-raised to every waiter, never left unretrieved
+            future.add_done_callback(_consume_exception)
+            if self.batching:
+                self._pending.append(address)
+                if len(self._pending) >= self.max_batch_size:
+                    self._flush(lookup_batch)
+                elif not self._flush_scheduled:
+                    self._flush_scheduled = True
+                    loop.call_soon(self._flush, lookup_batch)
+            else:
+                loop.create_task(self._run(lookup_batch, [address]))
+
+        # A cancelled request must not cancel the lookup other requests share
+        return await asyncio.shield(future)
+
+    def _flush(self, lookup_batch: BatchLookup) -> None:
+        """Start a lookup for every address queued in this tick."""
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        asyncio.get_running_loop().create_task(self._run(lookup_batch, batch))
+
+    async def _run(self, lookup_batch: BatchLookup, addresses: List[ParsedIP]) -> None:
+        """Look up a batch on the thread pool and resolve its futures."""
+        self.batches += 1
+        outcomes: List[Union[Optional[GeoResult], Exception]]
+        try:
+            outcomes = list(await run_in_threadpool(lookup_batch, addresses))
+        except Exception as e:
+            if len(addresses) == 1:
+                outcomes = [e]
+            else:
+                # Find out which lookups fail, so the others still get answers
+                logger.warning(f"Batch lookup failed, retrying one by one: {e}")
+                outcomes = await run_in_threadpool(
+                    _lookup_each, lookup_batch, addresses
+                )
+
+        for address, outcome in zip(addresses, outcomes):
+            future = self._in_flight.pop(address.packed)
+            if future.done():
+                continue
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            elif outcome is None:
+                future.set_exception(
+                    InvalidIPError(f"Invalid IP address: {address.text}")
+                )
+            else:
+                future.set_result(outcome)
+
+    def stats(self) -> Dict[str, int]:
+        """Return counters of lookups, coalesced lookups and batches run."""
+        return {
+            "lookups": self.lookups,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "in_flight": len(self._in_flight),
+        }
+
+
+def _lookup_each(
+    lookup_batch: BatchLookup, addresses: List[ParsedIP]
+) -> List[Union[Optional[GeoResult], Exception]]:
+    """Look up addresses one at a time, returning the error of each failure."""
+    outcomes: List[Union[Optional[GeoResult], Exception]] = []
+    for address in addresses:
+        try:
+            outcomes.append(lookup_batch([address])[0])
+        except Exception as e:
+            outcomes.append(e)
+    return outcomes
+
+
+def _consume_exception(future: "asyncio.Future[GeoResult]") -> None:
+    if not future.cancelled():
+        future.exception()
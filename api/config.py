@@ -14,11 +14,27 @@ and network information for IP addresses using the MaxMind GeoLite2 databases.
 API_VERSION = "1.1.0"
 API_PREFIX = "/api/v1"
 
+# Demo page: static files, templates and the prebuilt assets served from memory
+STATIC_DIR = Path(__file__).parent / "static"
+TEMPLATES_DIR = Path(__file__).parent / "templates"
+ASSET_BUILD_DIR = Path(
+    os.environ.get("ASSET_BUILD_DIR", str(Path(__file__).parent / "build"))
+)
+# Cache lifetime of static files requested by their original, unhashed URL
+STATIC_CACHE_MAX_AGE = int(os.environ.get("STATIC_CACHE_MAX_AGE", "3600"))  # seconds
+
 # Database settings
 DB_DIR = Path(__file__).parent / "db"
 CITY_DB_PATH = os.environ.get("GEOIP_CITY_DB_PATH", str(DB_DIR / "GeoLite2-City.mmdb"))
 ASN_DB_PATH = os.environ.get("GEOIP_ASN_DB_PATH", str(DB_DIR / "GeoLite2-ASN.mmdb"))
 
+# Local overrides: JSON file of result fields by network, applied over the
+# databases and reloaded when it changes, checked every OVERRIDES_RELOAD_INTERVAL
+OVERRIDES_PATH = os.environ.get("GEOIP_OVERRIDES_PATH")
+OVERRIDES_RELOAD_INTERVAL = float(
+    os.environ.get("OVERRIDES_RELOAD_INTERVAL", "5")
+)  # seconds, 0 to disable
+
 # Database download URLs
 ASN_DB_URL = "https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-ASN.mmdb"
 CITY_DB_URL = "https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-City.mmdb"
@@ -26,3 +42,70 @@ CITY_DB_URL = "https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-City
 # Limits and caching
 RATE_LIMIT = int(os.environ.get("RATE_LIMIT", "100"))  # requests per minute
 CACHE_TTL = int(os.environ.get("CACHE_TTL", "3600"))  # seconds
+
+# Startup behaviour
+# The databases are always prepared in the background at startup
+# "eager": requests arriving before they are ready wait for them
+# "fast": requests arriving before they are ready are answered with 503
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "eager").lower()
+STARTUP_RETRY_AFTER = int(os.environ.get("STARTUP_RETRY_AFTER", "5"))  # seconds
+
+# Warm-up
+# "none", "madvise" (kernel read-ahead) or "read" (sequential read)
+WARMUP_MODE = os.environ.get("WARMUP_MODE", "none").lower()
+# Optional file with one IP address per line to look up once at startup
+WARMUP_SAMPLE_FILE = os.environ.get("WARMUP_SAMPLE_FILE")
+
+# Result cache shared between workers: "none", "local", "shm" or "redis"
+RESULT_CACHE = os.environ.get("RESULT_CACHE", "none").lower()
+RESULT_CACHE_URL = os.environ.get("RESULT_CACHE_URL", "redis://localhost:6379/0")
+# Seconds to wait for the cache server, and to leave it alone after an error
+RESULT_CACHE_TIMEOUT = float(os.environ.get("RESULT_CACHE_TIMEOUT", "0.1"))
+RESULT_CACHE_BACKOFF = float(os.environ.get("RESULT_CACHE_BACKOFF", "1"))
+RESULT_CACHE_SHM_NAME = os.environ.get("RESULT_CACHE_SHM_NAME", "geoip_api_cache")
+RESULT_CACHE_SHM_SLOTS = int(os.environ.get("RESULT_CACHE_SHM_SLOTS", "65536"))
+# Diff from the previous database build, written by `python -m geoip_api.diff`,
+# which keeps cached results of the blocks the update left unchanged
+RESULT_CACHE_DIFF = os.environ.get("RESULT_CACHE_DIFF")
+
+# Coalescing of concurrent lookups: "off", "single" (identical addresses share
+# one lookup) or "batch" (also merge addresses arriving in the same tick)
+LOOKUP_COALESCING = os.environ.get("LOOKUP_COALESCING", "off").lower()
+
+# Proxies whose X-Forwarded-For and Forwarded headers are believed, as a comma
+# separated list of networks. "loopback" covers the loopback ranges, and
+# "private" the private-use, loopback and link-local ranges.
+TRUSTED_PROXIES = os.environ.get("TRUSTED_PROXIES", "loopback")
+# Forwarding header the trusted proxies write: "forwarded", "x-forwarded-for",
+# or "auto" (X-Forwarded-For if present, else Forwarded)
+TRUSTED_PROXY_HEADER = os.environ.get("TRUSTED_PROXY_HEADER", "auto").lower()
+
+# Admission control: "off", "fixed" (at most ADMISSION_LIMIT requests in
+# flight per worker) or "adaptive" (limit follows the latency gradient,
+# between ADMISSION_MIN_LIMIT and ADMISSION_MAX_LIMIT)
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "off").lower()
+ADMISSION_LIMIT = int(os.environ.get("ADMISSION_LIMIT", "64"))
+ADMISSION_MIN_LIMIT = int(os.environ.get("ADMISSION_MIN_LIMIT", "4"))
+ADMISSION_MAX_LIMIT = int(os.environ.get("ADMISSION_MAX_LIMIT", "512"))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))  # seconds
+
+# Pre-serialized JSON responses for /{ip_address}: "off", "lazy" (each distinct
+# result is serialized on first use) or "eager" (all results are serialized
+# when the databases are loaded, which takes time and memory)
+MATERIALIZED_JSON_MODES = ("off", "lazy", "eager")
+MATERIALIZED_JSON = os.environ.get("MATERIALIZED_JSON", "off").lower()
+
+# WebSocket lookups: most addresses per batch request, and most requests
+# buffered per connection before the server stops reading
+WEBSOCKET_MAX_BATCH = int(os.environ.get("WEBSOCKET_MAX_BATCH", "100"))
+WEBSOCKET_MAX_PENDING = int(os.environ.get("WEBSOCKET_MAX_PENDING", "64"))
+
+# Batch lookups over HTTP: most addresses per POST /geoip/lookup request
+LOOKUP_BATCH_MAX = int(os.environ.get("LOOKUP_BATCH_MAX", "100"))
+
+# Network enumeration: shortest prefix /geoip/network/{cidr} accepts, per IP
+# version, so one request cannot walk most of the address space. IPv6 blocks
+# inside the IPv4-mapped, IPv4-compatible and 6to4 ranges are held to the IPv4
+# limit, as they enumerate IPv4 networks. 0 allows any block.
+NETWORK_MIN_PREFIX_V4 = int(os.environ.get("NETWORK_MIN_PREFIX_V4", "8"))
+NETWORK_MIN_PREFIX_V6 = int(os.environ.get("NETWORK_MIN_PREFIX_V6", "32"))
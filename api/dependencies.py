@@ -4,16 +4,62 @@ FastAPI dependencies for the GeoIP API.
 
 import logging
 import os
-from functools import lru_cache
+import threading
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Optional
 
-import requests
 from fastapi import Depends, HTTPException, status
+from starlette.concurrency import run_in_threadpool
 
-from api.config import ASN_DB_PATH, ASN_DB_URL, CITY_DB_PATH, CITY_DB_URL, DB_DIR
-from geoip_api import GeoIPLookup
+from api.admission import ConcurrencyLimiter
+from api.cache import ResultCache, create_backend
+from api.coalescing import LookupCoalescer
+from api.config import (
+    ADMISSION_CONTROL,
+    ADMISSION_LIMIT,
+    ADMISSION_MAX_LIMIT,
+    ADMISSION_MIN_LIMIT,
+    ASN_DB_PATH,
+    ASN_DB_URL,
+    CACHE_TTL,
+    CITY_DB_PATH,
+    CITY_DB_URL,
+    DB_DIR,
+    LOOKUP_COALESCING,
+    MATERIALIZED_JSON,
+    OVERRIDES_PATH,
+    OVERRIDES_RELOAD_INTERVAL,
+    RESULT_CACHE,
+    RESULT_CACHE_BACKOFF,
+    RESULT_CACHE_DIFF,
+    RESULT_CACHE_SHM_NAME,
+    RESULT_CACHE_SHM_SLOTS,
+    RESULT_CACHE_TIMEOUT,
+    RESULT_CACHE_URL,
+    STARTUP_MODE,
+    STARTUP_RETRY_AFTER,
+    TRUSTED_PROXIES,
+    WARMUP_MODE,
+    WARMUP_SAMPLE_FILE,
+)
+from api.proxies import compile_trusted_proxies
+from geoip_api import GeoIPLookup, GeoResult, ParsedIP, parse_ip
+from geoip_api.core.address import NetworkSet
+from geoip_api.core.diff import DatabaseDiff
+from geoip_api.utils.currency import get_currency_for_country
 
 logger = logging.getLogger(__name__)
 
+# Set once the databases are present and the shared lookup can serve requests
+databases_ready = threading.Event()
+
+# Held while the databases are checked and loaded, so a request in eager mode
+# waits for the background preparation instead of repeating it concurrently
+_prepare_lock = threading.Lock()
+
+# Outcome of the startup preparation, reported by the readiness probe
+startup_state: Dict[str, Optional[Any]] = {"error": None, "warmup": None}
+
 
 @lru_cache()
 def ensure_databases():
@@ -30,6 +76,9 @@ def ensure_databases():
     # Download databases if they don't exist
     if not os.path.exists(CITY_DB_PATH):
         logger.info(f"City database not found at {CITY_DB_PATH}, downloading...")
+        # Imported here as it is only needed when a database is missing
+        import requests
+
         try:
             response = requests.get(
                 CITY_DB_URL, stream=True, timeout=60, allow_redirects=True
@@ -48,6 +97,9 @@ def ensure_databases():
 
     if not os.path.exists(ASN_DB_PATH):
         logger.info(f"ASN database not found at {ASN_DB_PATH}, downloading...")
+        # Imported here as it is only needed when a database is missing
+        import requests
+
         try:
             response = requests.get(
                 ASN_DB_URL, stream=True, timeout=60, allow_redirects=True
@@ -68,15 +120,284 @@ def ensure_databases():
     return True
 
 
-def get_geoip_lookup(databases_ready: bool = Depends(ensure_databases)):
+@lru_cache()
+def get_shared_lookup() -> GeoIPLookup:
+    """
+    Get the GeoIPLookup instance shared by all requests.
+
+    The databases and any indexes built over them are loaded once per process.
+    """
+    return GeoIPLookup(
+        city_db_path=CITY_DB_PATH,
+        asn_db_path=ASN_DB_PATH,
+        materialize_json=MATERIALIZED_JSON == "eager",
+        overrides_path=OVERRIDES_PATH,
+    )
+
+
+def prepare_databases() -> None:
+    """
+    Make sure the databases are present and load everything a lookup needs.
+
+    This runs in a background thread at startup, so the readiness probe turns
+    ready without waiting for a lookup. In fast startup mode requests are
+    answered with 503 meanwhile; in eager mode they wait for it.
+    """
+    try:
+        with _prepare_lock:
+            ensure_databases()
+            lookup = get_shared_lookup()
+            lookup.load()
+        # Loads the pycountry data used for currency lookups
+        get_currency_for_country("US")
+        if warmup_enabled():
+            startup_state["warmup"] = lookup.warm_up(
+                WARMUP_MODE, _read_sample_ips(WARMUP_SAMPLE_FILE)
+            )
+    except Exception as e:
+        logger.error(f"Failed to prepare GeoIP databases: {e}")
+        startup_state["error"] = str(e)
+        return
+
+    databases_ready.set()
+    logger.info("GeoIP databases are ready")
+
+
+def warmup_enabled() -> bool:
+    """Whether a warm-up phase is configured."""
+    return WARMUP_MODE != "none" or bool(WARMUP_SAMPLE_FILE)
+
+
+def is_ready() -> bool:
+    """Whether lookups can be served at steady-state latency."""
+    if not databases_ready.is_set():
+        return False
+    return not warmup_enabled() or startup_state["warmup"] is not None
+
+
+def _read_sample_ips(path: Optional[str]) -> List[str]:
+    """Read the warm-up sample, one IP address per line."""
+    if not path:
+        return []
+    try:
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+    except OSError as e:
+        logger.warning(f"Failed to read warm-up sample {path}: {e}")
+        return []
+
+
+def start_background_preparation() -> threading.Thread:
+    """Prepare the databases in a daemon thread."""
+    thread = threading.Thread(
+        target=prepare_databases, name="geoip-startup", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def watch_overrides(stop: threading.Event) -> None:
+    """Reload the override file whenever it changes, until stopped."""
+    while not stop.wait(OVERRIDES_RELOAD_INTERVAL):
+        get_shared_lookup().reload_overrides()
+
+
+def start_override_watcher() -> Optional[threading.Event]:
+    """
+    Watch the override file in a daemon thread, if reloading is configured.
+
+    Returns:
+        Event that stops the watcher, or None if there is nothing to watch
+    """
+    if not OVERRIDES_PATH or OVERRIDES_RELOAD_INTERVAL <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(
+        target=watch_overrides, args=(stop,), name="geoip-overrides", daemon=True
+    ).start()
+    return stop
+
+
+def require_databases() -> bool:
+    """
+    Check that the databases are available as a FastAPI dependency.
+
+    Raises:
+        HTTPException: 503 while the databases are still being prepared in
+            fast startup mode
+    """
+    if databases_ready.is_set():
+        return True
+
+    if STARTUP_MODE == "fast":
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="GeoIP databases are still loading",
+            headers={"Retry-After": str(STARTUP_RETRY_AFTER)},
+        )
+
+    with _prepare_lock:
+        ensure_databases()
+        get_shared_lookup().load()
+    databases_ready.set()
+    return True
+
+
+def get_geoip_lookup(databases_ready: bool = Depends(require_databases)):
     """
     Get a GeoIPLookup instance as a FastAPI dependency.
     """
     try:
-        return GeoIPLookup(city_db_path=CITY_DB_PATH, asn_db_path=ASN_DB_PATH)
+        return get_shared_lookup()
     except Exception as e:
         logger.error(f"Failed to initialize GeoIPLookup: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to initialize GeoIP service",
         )
+
+
+@lru_cache()
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    Get the result cache configured by RESULT_CACHE, or None if disabled.
+    """
+    backend = create_backend(
+        RESULT_CACHE,
+        url=RESULT_CACHE_URL,
+        ttl=CACHE_TTL,
+        timeout=RESULT_CACHE_TIMEOUT,
+        backoff=RESULT_CACHE_BACKOFF,
+        shm_name=RESULT_CACHE_SHM_NAME,
+        shm_slots=RESULT_CACHE_SHM_SLOTS,
+    )
+    if backend is None:
+        return None
+    logger.info(f"Using {backend.name} result cache")
+
+    diff = None
+    if RESULT_CACHE_DIFF:
+        try:
+            diff = DatabaseDiff.load(RESULT_CACHE_DIFF)
+            logger.info(
+                f"Keeping cached results outside {len(diff.changed)} networks "
+                f"changed since database {diff.old_epoch}"
+            )
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read database diff {RESULT_CACHE_DIFF}: {e}")
+    return ResultCache(backend, diff)
+
+
+def result_cache_blocks() -> bool:
+    """Whether lookups through the result cache wait on network I/O."""
+    cache = get_result_cache()
+    return cache is not None and cache.backend.blocking
+
+
+def lookup_result(geoip_lookup: GeoIPLookup, address: ParsedIP) -> GeoResult:
+    """
+    Look up an IP address through the result cache, if one is configured.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return geoip_lookup.lookup(address, as_dict=False)
+    return cache.lookup(geoip_lookup, address)
+
+
+def lookup_results(
+    geoip_lookup: GeoIPLookup, addresses: List[ParsedIP]
+) -> List[Optional[GeoResult]]:
+    """
+    Look up a batch of IP addresses through the result cache, if configured.
+
+    Returns:
+        One result per address, None where the address is invalid
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return geoip_lookup.lookup_many(addresses, as_dict=False)
+    return cache.lookup_many(geoip_lookup, addresses)
+
+
+def lookup_entries(geoip_lookup: GeoIPLookup, ips: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Look up a batch of client-supplied addresses for a batch response.
+
+    Returns:
+        One response entry per address, in input order, with an "error" entry
+        for each invalid address
+    """
+    addresses: List[ParsedIP] = []
+    errors: Dict[int, str] = {}
+    for i, ip in enumerate(ips):
+        try:
+            addresses.append(parse_ip(ip))
+        except (ValueError, TypeError, AttributeError):
+            errors[i] = f"Invalid IP address: {ip}"
+
+    results = iter(lookup_results(geoip_lookup, addresses))
+    entries: List[Dict[str, Any]] = []
+    for i, ip in enumerate(ips):
+        if i in errors:
+            entries.append({"ip": ip, "error": errors[i]})
+            continue
+        result = next(results)
+        if result is None:
+            entries.append({"ip": ip, "error": f"Invalid IP address: {ip}"})
+        else:
+            entries.append(result.to_dict(ip))
+    return entries
+
+
+@lru_cache()
+def get_coalescer() -> Optional[LookupCoalescer]:
+    """
+    Get the lookup coalescer configured by LOOKUP_COALESCING, or None if off.
+    """
+    if LOOKUP_COALESCING == "off":
+        return None
+    return LookupCoalescer(batching=LOOKUP_COALESCING == "batch")
+
+
+async def lookup_result_async(
+    geoip_lookup: GeoIPLookup, address: ParsedIP
+) -> GeoResult:
+    """
+    Look up an IP address from the async request path.
+
+    With coalescing enabled, concurrent requests for the same address share
+    one lookup, run on the thread pool. Without it, lookups through a networked
+    result cache also run on the thread pool, so a slow cache server does not
+    stall the event loop.
+    """
+    coalescer = get_coalescer()
+    if coalescer is None:
+        if result_cache_blocks():
+            return await run_in_threadpool(lookup_result, geoip_lookup, address)
+        return lookup_result(geoip_lookup, address)
+    return await coalescer.lookup(partial(lookup_results, geoip_lookup), address)
+
+
+@lru_cache()
+def get_trusted_proxies() -> NetworkSet:
+    """
+    Get the trusted proxy networks configured by TRUSTED_PROXIES.
+    """
+    trusted = compile_trusted_proxies(TRUSTED_PROXIES.split(","))
+    logger.info(f"Trusting forwarding headers from {len(trusted)} networks")
+    return trusted
+
+
+@lru_cache()
+def get_limiter() -> Optional[ConcurrencyLimiter]:
+    """
+    Get the concurrency limiter configured by ADMISSION_CONTROL, or None if off.
+    """
+    if ADMISSION_CONTROL == "off":
+        return None
+    return ConcurrencyLimiter(
+        mode=ADMISSION_CONTROL,
+        initial_limit=ADMISSION_LIMIT,
+        min_limit=ADMISSION_MIN_LIMIT,
+        max_limit=ADMISSION_MAX_LIMIT,
+    )
@@ -5,25 +5,39 @@ FastAPI application for GeoIP lookups.
 import logging
 import logging.config
 from contextlib import asynccontextmanager
-from ipaddress import ip_address as IPvAnyAddress
 from typing import Optional
-import re
 
-from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-
-from api.config import API_DESCRIPTION, API_PREFIX, API_TITLE, API_VERSION
-from api.dependencies import get_geoip_lookup
+from starlette.concurrency import run_in_threadpool
+
+from api.admission import AdmissionMiddleware
+from api.assets import StaticAssets, negotiate
+from api.config import (
+    ADMISSION_RETRY_AFTER,
+    API_DESCRIPTION,
+    API_PREFIX,
+    API_TITLE,
+    API_VERSION,
+    MATERIALIZED_JSON,
+    MATERIALIZED_JSON_MODES,
+    TRUSTED_PROXY_HEADER,
+)
+from api.dependencies import (
+    get_geoip_lookup,
+    get_limiter,
+    get_trusted_proxies,
+    lookup_result_async,
+    start_background_preparation,
+    start_override_watcher,
+)
 from api.logging_config import get_logging_config
-from api.routes import geoip
-from geoip_api import GeoIPLookup
+from api.proxies import PROXY_HEADERS, forwarded_hops, resolve_client
+from api.routes import geoip, health, stream
+from geoip_api import GeoIPLookup, parse_ip
 from geoip_api.exceptions import InvalidIPError, LookupError
 
-# Configure logging
-logging.config.dictConfig(get_logging_config())
 logger = logging.getLogger("api")
 
 
@@ -43,16 +57,24 @@ class GeoIPResponse(BaseModel):
     currency: Optional[str] = None
     isp: Optional[str] = None
     asn: Optional[int] = None
+    special: Optional[str] = None
 
 
 # Lifespan context manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
+    logging.config.dictConfig(get_logging_config())
     logger.info("Starting GeoIP API service")
+    # Also in eager mode, so /readyz does not wait for the first lookup
+    start_background_preparation()
+    overrides_watcher = start_override_watcher()
+    await static_assets.prepare()
     yield
     # Shutdown logic
     logger.info("Shutting down GeoIP API service")
+    if overrides_watcher is not None:
+        overrides_watcher.set()
 
 
 # Create FastAPI application
@@ -75,14 +97,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="api/static"), name="static")
+# Shed load once the worker is saturated, outermost so rejections stay cheap
+limiter = get_limiter()
+if limiter is not None:
+    app.add_middleware(
+        AdmissionMiddleware, limiter=limiter, retry_after=ADMISSION_RETRY_AFTER
+    )
 
-# Set up templates
-templates = Jinja2Templates(directory="api/templates")
+# Fail at startup rather than on every request forwarded by a proxy
+if TRUSTED_PROXY_HEADER not in PROXY_HEADERS:
+    raise ValueError(f"Invalid TRUSTED_PROXY_HEADER: {TRUSTED_PROXY_HEADER}")
+# A typo would otherwise turn the mode on
+if MATERIALIZED_JSON not in MATERIALIZED_JSON_MODES:
+    raise ValueError(f"Invalid MATERIALIZED_JSON: {MATERIALIZED_JSON}")
+
+# Mount static files, read or prepared at startup
+static_assets = StaticAssets()
+app.mount("/static", static_assets, name="static")
 
 # Include API routes
+app.include_router(health.router)
 app.include_router(geoip.router, prefix=API_PREFIX)
+app.include_router(stream.router, prefix=API_PREFIX)
 
 
 # Simplified IP lookup (domain/ip)
@@ -95,16 +131,21 @@ async def lookup_ip_direct(
     Look up geolocation information for an IP address using a simplified URL.
     """
     try:
-        # Validate IP address format
-        IPvAnyAddress(ip_address)
+        # Parse and validate the IP address once for the whole lookup
+        address = parse_ip(ip_address)
 
-        # Perform lookup
-        result = geoip_lookup.lookup(ip_address)
+        if MATERIALIZED_JSON != "off":
+            # The body is already serialized, so skip the response model
+            body = geoip_lookup.cached_json(address)
+            if body is None:
+                # Serializing a result the first time stays off the event loop
+                body = await run_in_threadpool(geoip_lookup.lookup_json, address)
+            return Response(body, media_type="application/json")
 
-        # Add IP address to result
-        result["ip"] = ip_address
+        # Perform lookup
+        result = await lookup_result_async(geoip_lookup, address)
 
-        return result
+        return result.to_dict(ip_address)
 
     except ValueError:
         logger.warning(f"Invalid IP address format: {ip_address}")
@@ -118,6 +159,21 @@ async def lookup_ip_direct(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
+async def index_page(request: Request) -> Response:
+    """Serve the pre-rendered index page in the best accepted encoding."""
+    bundle = await static_assets.prepare()
+    status_code, headers, body = negotiate(
+        bundle.page,
+        request.headers.get("accept-encoding", ""),
+        request.headers.get("if-none-match"),
+    )
+    return Response(
+        body,
+        status_code=status_code,
+        headers={name.decode(): value.decode() for name, value in headers},
+    )
+
+
 # Simple query parameter lookup (domain/?ip=x.x.x.x)
 @app.get("/", response_model=GeoIPResponse)
 async def lookup_ip_query(
@@ -133,31 +189,34 @@ async def lookup_ip_query(
         if ip is None:
             # Use requester's IP, if IP not provided
             client = request.client
-            if client is not None:
-                ip = client.host
-            else:
+            if client is None:
                 # Handle the case where client is None
                 raise HTTPException(status_code=400, detail="Client IP not available")
-            # If IP is a Docker container IP, use X-Forwarded-For header
-            if re.match(
-                r"\b172\.(1[6-9]|[2-9]\d|1\d{2}|2[0-4]\d|25[0-5])\.\d{1,3}\.\d{1,3}\b",
-                ip,
-            ):
-                ip = request.headers.get("X-Forwarded-For")
-                # If IP is still None, return index page
-                if ip is None:
-                    return templates.TemplateResponse(request, "index.html")
-
-        # Validate IP address format
-        IPvAnyAddress(ip)
+            try:
+                peer = parse_ip(client.host)
+            except ValueError:
+                # Not an IP address, e.g. a Unix socket peer
+                peer = None
+
+            # Behind a trusted proxy, take the client from the forwarding headers
+            hops = forwarded_hops(
+                request.headers.getlist("Forwarded"),
+                request.headers.getlist("X-Forwarded-For"),
+                TRUSTED_PROXY_HEADER,
+            )
+            address = resolve_client(peer, hops, get_trusted_proxies())
+            # If the client is still unknown, return index page
+            if address is None:
+                return await index_page(request)
+            ip = address.text
+        else:
+            # Parse and validate the IP address once for the whole lookup
+            address = parse_ip(ip)
 
         # Perform lookup
-        result = geoip_lookup.lookup(ip)
-
-        # Add IP address to result
-        result["ip"] = ip
+        result = await lookup_result_async(geoip_lookup, address)
 
-        return result
+        return result.to_dict(ip)
 
     except ValueError:
         logger.warning(f"Invalid IP address format: {ip}")
@@ -0,0 +1,150 @@
+"""
+Client address resolution behind trusted proxies.
+
+Proxies append the address they received a request from to X-Forwarded-For
+(or add a "for" parameter to Forwarded), so the header reads client first and
+closest proxy last. Only hops added by trusted proxies can be believed: the
+header is read from right to left, skipping trusted proxies, and the first
+address that is not a trusted proxy is the client.
+
+A client can send either header itself, so only the header the trusted proxies
+write can be believed. Which one that is can be configured; when it is not,
+X-Forwarded-For is preferred, since a proxy that only appends X-Forwarded-For
+passes a client's Forwarded header through unchanged.
+"""
+
+import re
+from typing import Iterable, List, Optional
+
+from geoip_api import ParsedIP, parse_ip
+from geoip_api.core.address import NetworkSet
+from geoip_api.core.special import PRIVATE, SPECIAL_RANGES
+
+# "for" parameters of a Forwarded header, quoted or not
+FORWARDED_FOR_PATTERN = re.compile(r'(?i)(?:^|[;,\s])for=("[^"]*"|[^;,\s]*)')
+
+# Networks of the "loopback" keyword, and networks left out of "private"
+LOOPBACK = ("127.0.0.0/8", "::1/128")
+SHARED = ("100.64.0.0/10",)
+
+# Headers the trusted proxies can be configured to write; "auto" reads either,
+# preferring X-Forwarded-For
+PROXY_HEADERS = ("auto", "forwarded", "x-forwarded-for")
+
+
+def compile_trusted_proxies(entries: Iterable[str]) -> NetworkSet:
+    """
+    Compile the trusted proxy configuration into a network set.
+
+    Args:
+        entries: Networks in CIDR notation, "loopback" for the loopback
+            ranges, or "private" for the private-use, loopback and link-local
+            ranges. Shared address space (100.64.0.0/10) is never included,
+            as carrier-grade NAT puts unrelated customers in it.
+
+    Returns:
+        The set of trusted networks
+
+    Raises:
+        ValueError: If an entry is not a valid network
+    """
+    cidrs: List[str] = []
+    for entry in entries:
+        entry = entry.strip()
+        if not entry:
+            continue
+        if entry.lower() == "loopback":
+            cidrs.extend(LOOPBACK)
+        elif entry.lower() == "private":
+            cidrs.extend(
+                cidr
+                for cidr, _, kind in SPECIAL_RANGES
+                if kind == PRIVATE and cidr not in SHARED
+            )
+        else:
+            cidrs.append(entry)
+    return NetworkSet(cidrs)
+
+
+def parse_node(value: str) -> ParsedIP:
+    """
+    Parse one hop of a forwarding header.
+
+    Accepts plain addresses as well as "1.2.3.4:80", "[2001:db8::1]" and
+    "[2001:db8::1]:80", the forms proxies use for addresses with ports.
+
+    Raises:
+        ValueError: If the hop is not an IP address, e.g. "unknown"
+    """
+    value = value.strip().strip('"')
+    if value.startswith("["):
+        value = value[1 : value.find("]")]
+    elif value.count(":") == 1:
+        value = value.split(":", 1)[0]
+    return parse_ip(value)
+
+
+def forwarded_hops(
+    forwarded: Iterable[str], x_forwarded_for: Iterable[str], header: str = "auto"
+) -> List[str]:
+    """
+    Collect the hops of a request's forwarding headers, client first.
+
+    Repeated headers are joined in order.
+
+    Args:
+        forwarded: Values of the Forwarded headers
+        x_forwarded_for: Values of the X-Forwarded-For headers
+        header: Header written by the trusted proxies, one of PROXY_HEADERS;
+            "auto" reads Forwarded only when there is no X-Forwarded-For
+
+    Raises:
+        ValueError: If the header is not one of PROXY_HEADERS
+    """
+    if header not in PROXY_HEADERS:
+        raise ValueError(f"Invalid trusted proxy header: {header}")
+    hops: List[str] = []
+    if header != "forwarded":
+        hops = [
+            hop for value in x_forwarded_for for hop in value.split(",") if hop.strip()
+        ]
+    if hops or header == "x-forwarded-for":
+        return hops
+    return [
+        match.group(1)
+        for value in forwarded
+        for match in FORWARDED_FOR_PATTERN.finditer(value)
+    ]
+
+
+def resolve_client(
+    peer: Optional[ParsedIP], hops: List[str], trusted: NetworkSet
+) -> Optional[ParsedIP]:
+    """
+    Find the client address of a request.
+
+    Args:
+        peer: Address the request was received from, or None if the peer is
+            not an IP address (e.g. a Unix socket), which is always trusted
+        hops: Hops of the forwarding headers, client first
+        trusted: Trusted proxy networks
+
+    Returns:
+        The client address, or None if it cannot be determined: the peer is
+        a trusted proxy that forwarded no client, or a hop is not an address
+    """
+    if peer is not None and peer not in trusted:
+        return peer
+    if not hops:
+        return None
+
+    client: Optional[ParsedIP] = None
+    for hop in reversed(hops):
+        try:
+            client = parse_node(hop)
+        except ValueError:
+            return None
+        if client not in trusted:
+            return client
+    # Every hop is a trusted proxy, so the first one is the client
+    return client
@@ -2,19 +2,39 @@
 API routes for GeoIP lookups.
 """
 
+import ipaddress
+import json
 import logging
-from ipaddress import ip_address as IPvAnyAddress
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
-from api.dependencies import get_geoip_lookup
-from geoip_api import GeoIPLookup
+from api.config import (
+    LOOKUP_BATCH_MAX,
+    NETWORK_MIN_PREFIX_V4,
+    NETWORK_MIN_PREFIX_V6,
+)
+from api.dependencies import get_geoip_lookup, lookup_entries, lookup_result_async
+from geoip_api import GeoIPLookup, parse_ip
+from geoip_api.core.aggregate import Aggregator
+from geoip_api.core.tree import IPNetwork
 from geoip_api.exceptions import InvalidIPError, LookupError
 
 logger = logging.getLogger(__name__)
 
+# Addresses looked up per thread pool call while aggregating
+AGGREGATE_BATCH_SIZE = 4096
+
+# IPv6 ranges that hold the IPv4 address space, with the prefix length of each
+IPV4_ALIASES = [
+    (ipaddress.IPv6Network("::/96"), 96),
+    (ipaddress.IPv6Network("::ffff:0:0/96"), 96),
+    (ipaddress.IPv6Network("2002::/16"), 16),
+]
+
 router = APIRouter(
     prefix="/geoip",
     tags=["geoip"],
@@ -36,6 +56,13 @@ class GeoIPResponse(BaseModel):
     currency: Optional[str] = None
     isp: Optional[str] = None
     asn: Optional[int] = None
+    special: Optional[str] = None
+
+
+class BatchLookupRequest(BaseModel):
+    """Request model for batch lookups."""
+
+    ips: List[str]
 
 
 @router.get(
@@ -61,16 +88,13 @@ async def lookup_ip(
         HTTPException: If the IP address is invalid or the lookup fails
     """
     try:
-        # Validate IP address format
-        IPvAnyAddress(ip_address)
+        # Parse and validate the IP address once for the whole lookup
+        address = parse_ip(ip_address)
 
         # Perform lookup
-        result = geoip_lookup.lookup(ip_address)
+        result = await lookup_result_async(geoip_lookup, address)
 
-        # Add IP address to result
-        result["ip"] = ip_address
-
-        return result
+        return result.to_dict(ip_address)
 
     except ValueError:
         logger.warning(f"Invalid IP address format: {ip_address}")
@@ -121,3 +145,266 @@ async def lookup_ip_query(
         Geolocation information for the IP address
     """
     return await lookup_ip(ip, geoip_lookup)
+
+
+@router.post(
+    "/lookup",
+    summary="Look up geolocation information for a batch of IP addresses",
+    response_description="One result or error entry per IP address, in order",
+)
+async def lookup_batch(
+    request: BatchLookupRequest,
+    geoip_lookup: GeoIPLookup = Depends(get_geoip_lookup),
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Look up geolocation information for a batch of IP addresses.
+
+    Invalid addresses do not fail the batch; their entries carry an "error"
+    message instead of the result fields.
+
+    Args:
+        request: The IP addresses to look up, at most LOOKUP_BATCH_MAX
+
+    Returns:
+        Entries in request order under the "results" key
+
+    Raises:
+        HTTPException: If the batch is too large or the lookup fails
+    """
+    if len(request.ips) > LOOKUP_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batches are limited to {LOOKUP_BATCH_MAX} addresses",
+        )
+    try:
+        results = await run_in_threadpool(lookup_entries, geoip_lookup, request.ips)
+    except LookupError as e:
+        logger.error(f"Lookup error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to look up IP address information",
+        )
+    return {"results": results}
+
+
+@router.post(
+    "/aggregate",
+    summary="Count lookup results of many IP addresses by a set of fields",
+    response_description="Address counts per group, largest first",
+)
+async def aggregate(
+    request: Request,
+    group_by: List[str] = Query(["country"], description="Result fields to group by"),
+    top: Optional[int] = Query(None, ge=1, description="Only return the top groups"),
+    distinct: List[str] = Query(
+        [], description='Fields, or "ip", to estimate distinct counts of'
+    ),
+    geoip_lookup: GeoIPLookup = Depends(get_geoip_lookup),
+) -> Dict[str, Any]:
+    """
+    Count the lookup results of many IP addresses by a set of fields.
+
+    The addresses are sent either as a JSON body, {"ips": [...]}, or as any
+    other body with one address per line, which is aggregated while it is
+    being received. Field lists may be repeated or comma-separated query
+    parameters.
+
+    Args:
+        group_by: Result fields whose values form a group
+        top: Only return the largest groups, counting the rest under "other"
+        distinct: Fields to estimate the number of distinct values of
+
+    Returns:
+        Total and invalid address counts, the groups and distinct estimates
+
+    Raises:
+        HTTPException: If a field is unknown or the body is invalid
+    """
+    try:
+        aggregator = Aggregator(geoip_lookup, _fields(group_by), _fields(distinct))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Request body is not valid JSON",
+            )
+        ips = body.get("ips") if isinstance(body, dict) else None
+        if not isinstance(ips, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Request body needs an "ips" list',
+            )
+        for start in range(0, len(ips), AGGREGATE_BATCH_SIZE):
+            batch = ips[start : start + AGGREGATE_BATCH_SIZE]
+            await run_in_threadpool(aggregator.add, batch)
+    else:
+        partial = b""
+        lines: List[str] = []
+        async for chunk in request.stream():
+            *complete, partial = (partial + chunk).split(b"\n")
+            lines += [line.decode(errors="replace") for line in complete]
+            if len(lines) >= AGGREGATE_BATCH_SIZE:
+                await run_in_threadpool(aggregator.add, _non_blank(lines))
+                lines = []
+        lines.append(partial.decode(errors="replace"))
+        await run_in_threadpool(aggregator.add, _non_blank(lines))
+
+    return aggregator.result(top)
+
+
+def _fields(values: List[str]) -> List[str]:
+    """Flatten repeated and comma-separated field parameters."""
+    return [field for value in values for field in value.split(",") if field]
+
+
+def _non_blank(lines: List[str]) -> List[str]:
+    return [line for line in lines if line.strip()]
+
+
+@router.get(
+    "/network/{cidr:path}",
+    summary="Look up every database network inside a CIDR block",
+    response_description="One JSON result per network, newline-delimited",
+    response_class=StreamingResponse,
+)
+async def lookup_network(
+    cidr: str,
+    geoip_lookup: GeoIPLookup = Depends(get_geoip_lookup),
+) -> StreamingResponse:
+    """
+    Look up every distinct database network inside a CIDR block.
+
+    Local overrides are applied as in single lookups, splitting networks where
+    an override starts or ends.
+
+    Args:
+        cidr: The CIDR block to enumerate, e.g. 10.0.0.0/8
+
+    Returns:
+        A newline-delimited JSON stream with one result per network
+
+    Raises:
+        HTTPException: If the CIDR block is invalid or wider than allowed
+    """
+    try:
+        results = geoip_lookup.lookup_network(cidr)
+    except InvalidIPError as e:
+        logger.warning(f"Invalid network: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    min_prefix = _min_prefix(ipaddress.ip_network(cidr, strict=False))
+    if min_prefix is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Network too large: {cidr}, the shortest prefix allowed "
+            f"is /{min_prefix}",
+        )
+
+    def lines() -> Iterator[str]:
+        for result in results:
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def _min_prefix(network: IPNetwork) -> Optional[int]:
+    """Return the shortest prefix allowed if the network is too wide, else None."""
+    if network.version == 4:
+        if network.prefixlen < NETWORK_MIN_PREFIX_V4:
+            return NETWORK_MIN_PREFIX_V4
+        return None
+    if network.prefixlen < NETWORK_MIN_PREFIX_V6:
+        return NETWORK_MIN_PREFIX_V6
+    for alias, alias_prefix in IPV4_ALIASES:
+        # Blocks containing an alias walk the whole IPv4 address space
+        if network.overlaps(alias):
+            prefix = max(network.prefixlen, alias_prefix) - alias_prefix
+            if prefix < NETWORK_MIN_PREFIX_V4:
+                return alias_prefix + NETWORK_MIN_PREFIX_V4
+    return None
+
+
+def _stream_networks(networks: Iterator[str], not_found: str) -> StreamingResponse:
+    """
+    Stream networks as plain text, one CIDR per line.
+
+    Raises:
+        HTTPException: If there are no networks to stream
+    """
+    try:
+        first = next(networks)
+    except StopIteration:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found)
+
+    def lines() -> Iterator[str]:
+        yield f"{first}\n"
+        for network in networks:
+            yield f"{network}\n"
+
+    return StreamingResponse(lines(), media_type="text/plain")
+
+
+@router.get(
+    "/asn/{asn}/networks",
+    summary="List all networks announced by an ASN",
+    response_description="Networks in CIDR notation, one per line",
+    response_class=StreamingResponse,
+)
+async def asn_networks(
+    asn: int = Path(..., ge=0, description="Autonomous system number"),
+    geoip_lookup: GeoIPLookup = Depends(get_geoip_lookup),
+) -> StreamingResponse:
+    """
+    List all networks announced by an autonomous system.
+
+    Local overrides of the ASN are applied.
+
+    Args:
+        asn: The autonomous system number
+
+    Returns:
+        A plain-text stream of networks in CIDR notation
+
+    Raises:
+        HTTPException: If the ASN has no networks in the database
+    """
+    # The first call builds the reverse index, a walk over the whole database
+    networks = await run_in_threadpool(geoip_lookup.networks_for_asn, asn)
+    return _stream_networks(networks, f"No networks found for ASN {asn}")
+
+
+@router.get(
+    "/country/{country_code}/networks",
+    summary="List all networks located in a country",
+    response_description="Networks in CIDR notation, one per line",
+    response_class=StreamingResponse,
+)
+async def country_networks(
+    country_code: str = Path(
+        ..., min_length=2, max_length=2, description="ISO 3166-1 alpha-2 code"
+    ),
+    geoip_lookup: GeoIPLookup = Depends(get_geoip_lookup),
+) -> StreamingResponse:
+    """
+    List all networks located in a country.
+
+    Local overrides of the country code are applied.
+
+    Args:
+        country_code: The ISO 3166-1 alpha-2 country code
+
+    Returns:
+        A plain-text stream of networks in CIDR notation
+
+    Raises:
+        HTTPException: If the country has no networks in the database
+    """
+    networks = await run_in_threadpool(geoip_lookup.networks_for_country, country_code)
+    return _stream_networks(
+        networks, f"No networks found for country {country_code.upper()}"
+    )
@@ -0,0 +1,78 @@
+"""
+Liveness and readiness probes.
+
+Neither probe performs a lookup, so they stay cheap enough to be polled
+frequently by orchestrators.
+"""
+
+import logging
+from typing import Any, Dict
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from api.dependencies import (
+    get_coalescer,
+    get_limiter,
+    get_result_cache,
+    get_shared_lookup,
+    is_ready,
+    startup_state,
+)
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["health"])
+
+
+@router.get("/healthz", summary="Liveness probe")
+async def healthz() -> Dict[str, str]:
+    """
+    Report that the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+
+@router.get("/readyz", summary="Readiness probe")
+async def readyz() -> JSONResponse:
+    """
+    Report whether the databases are loaded and warmed up.
+
+    Returns:
+        200 when lookups can be served, 503 otherwise, with the database,
+        warm-up and cache state in the body. File paths are left out, as the
+        probe is served on the public port.
+    """
+    try:
+        status = get_shared_lookup().status()
+    except (OSError, ValueError) as e:
+        # Only an unreadable override file fails the shared lookup. The error
+        # names the file, so it is only logged.
+        logger.error(f"Lookup service unavailable: {e}")
+        return JSONResponse(
+            {"status": "error", "error": "Failed to load the override file"},
+            status_code=503,
+        )
+    for database in status["databases"].values():
+        database.pop("path", None)
+    status["overrides"].pop("path", None)
+
+    ready = is_ready()
+    body: Dict[str, Any] = {
+        "status": "ready" if ready else "starting",
+        **status,
+        "warmup": startup_state["warmup"],
+    }
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        body["caches"]["shared"] = result_cache.stats()
+    coalescer = get_coalescer()
+    if coalescer is not None:
+        body["coalescing"] = coalescer.stats()
+    limiter = get_limiter()
+    if limiter is not None:
+        body["admission"] = limiter.stats()
+    if startup_state["error"]:
+        body["status"] = "error"
+        body["error"] = startup_state["error"]
+    return JSONResponse(body, status_code=200 if ready else 503)
@@ -0,0 +1,140 @@
+"""
+WebSocket endpoint for clients sending many lookups over one connection.
+
+Each text frame holds one JSON request, either a single lookup or a small
+batch, tagged with a client-chosen correlation ID:
+
+    {"id": 1, "ip": "8.8.8.8"}
+    {"id": 2, "ips": ["8.8.8.8", "1.1.1.1"]}
+
+Each request is answered by one frame carrying the same ID:
+
+    {"id": 1, "result": {"ip": "8.8.8.8", "country": ...}}
+    {"id": 2, "results": [{"ip": "8.8.8.8", ...}, {"ip": "1.1.1.1", ...}]}
+    {"id": 3, "error": "Invalid IP address: x"}
+
+Clients may send requests without waiting for answers. At most
+WEBSOCKET_MAX_PENDING requests are buffered per connection; beyond that the
+server stops reading, which pushes back on the client through TCP flow
+control.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from api.config import WEBSOCKET_MAX_BATCH, WEBSOCKET_MAX_PENDING
+from api.dependencies import (
+    get_geoip_lookup,
+    lookup_entries,
+    require_databases,
+    result_cache_blocks,
+)
+from geoip_api import GeoIPLookup
+from geoip_api.exceptions import LookupError
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["geoip"])
+
+# Close code asking the client to reconnect later (RFC 6455 registry)
+TRY_AGAIN_LATER = 1013
+
+
+@router.websocket("/ws")
+async def lookup_stream(websocket: WebSocket) -> None:
+    """
+    Answer lookup requests sent over a WebSocket connection.
+    """
+    try:
+        # Runs like the HTTP dependency, off the event loop, as it may have to
+        # wait for the databases to be downloaded and loaded
+        geoip_lookup = get_geoip_lookup(await run_in_threadpool(require_databases))
+    except HTTPException as e:
+        await websocket.close(code=TRY_AGAIN_LATER, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    pending: "asyncio.Queue[str]" = asyncio.Queue(WEBSOCKET_MAX_PENDING)
+    tasks = {
+        asyncio.create_task(_receive(websocket, pending)),
+        asyncio.create_task(_respond(websocket, geoip_lookup, pending)),
+    }
+    # Runs until the client disconnects or sending fails
+    done, running = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in running:
+        task.cancel()
+    for task in done:
+        error = task.exception()
+        if error is not None and not isinstance(error, WebSocketDisconnect):
+            logger.warning(f"WebSocket connection failed: {error!r}")
+
+
+async def _receive(websocket: WebSocket, pending: "asyncio.Queue[str]") -> None:
+    """Queue incoming request frames until the connection closes."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        frame = message.get("text")
+        if frame is None:
+            frame = (message.get("bytes") or b"").decode("utf-8", "replace")
+        # Blocks while the queue is full, so no more frames are read
+        await pending.put(frame)
+
+
+async def _respond(
+    websocket: WebSocket, geoip_lookup: GeoIPLookup, pending: "asyncio.Queue[str]"
+) -> None:
+    """Answer queued requests in order until the connection closes."""
+    while True:
+        frame = await pending.get()
+        if result_cache_blocks():
+            response = await run_in_threadpool(handle_request, geoip_lookup, frame)
+        else:
+            response = handle_request(geoip_lookup, frame)
+        await websocket.send_text(json.dumps(response, separators=(",", ":")))
+
+
+def handle_request(geoip_lookup: GeoIPLookup, frame: str) -> Dict[str, Any]:
+    """
+    Answer one request frame.
+
+    Args:
+        geoip_lookup: Lookup service
+        frame: JSON request
+
+    Returns:
+        Response object, carrying the request ID if the request had one
+    """
+    try:
+        request = json.loads(frame)
+    except ValueError:
+        return {"error": "Request is not valid JSON"}
+    if not isinstance(request, dict):
+        return {"error": "Request must be a JSON object"}
+
+    response: Dict[str, Any] = {"id": request.get("id")}
+    try:
+        if "ip" in request:
+            entry = lookup_entries(geoip_lookup, [request["ip"]])[0]
+            if "error" in entry:
+                response["error"] = entry["error"]
+            else:
+                response["result"] = entry
+        elif isinstance(request.get("ips"), list):
+            ips = request["ips"]
+            if len(ips) > WEBSOCKET_MAX_BATCH:
+                response["error"] = f"Batches are limited to {WEBSOCKET_MAX_BATCH}"
+            else:
+                response["results"] = lookup_entries(geoip_lookup, ips)
+        else:
+            response["error"] = 'Request needs an "ip" or "ips" field'
+    except LookupError as e:
+        logger.error(f"Lookup error: {e}")
+        response["error"] = "Failed to look up IP address information"
+    return response
@@ -0,0 +1,117 @@
+"""
+Lookup throughput benchmark for the GeoIP library.
+
+Times GeoIPLookup.lookup over uniformly random IPv4 addresses, over a single
+repeated address and over a private address, times GeoIPLookup.lookup_json,
+and reports the decode cache hit rates. With --overrides, the random lookups
+are repeated with that many random override networks, compiled from a
+temporary override file.
+
+Usage:
+    python benchmarks/bench_lookup.py [--count 100000] [--city PATH] [--asn PATH]
+                                      [--overrides 10000]
+"""
+
+import argparse
+import ipaddress
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from geoip_api import GeoIPLookup
+
+
+def bench(lookup: GeoIPLookup, name: str, ips: list, as_json: bool = False) -> None:
+    """Time one pass over a list of addresses."""
+    start = time.perf_counter()
+    if as_json:
+        for ip in ips:
+            lookup.lookup_json(ip)
+    else:
+        for ip in ips:
+            lookup.lookup(ip, as_dict=False)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<16}{len(ips) / elapsed:>12,.0f} lookups/s"
+        f"{elapsed / len(ips) * 1e6:>10.1f} us/lookup"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=100000, help="Lookups per run")
+    parser.add_argument("--city", help="Path to the City database")
+    parser.add_argument("--asn", help="Path to the ASN database")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--overrides", type=int, default=0, help="Random override networks"
+    )
+    args = parser.parse_args()
+
+    # Per-lookup log lines would dominate the timings
+    logging.disable(logging.WARNING)
+
+    lookup = GeoIPLookup(city_db_path=args.city, asn_db_path=args.asn)
+    lookup.load()
+
+    rng = random.Random(args.seed)
+    random_ips = [
+        str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(args.count)
+    ]
+
+    bench(lookup, "random (cold)", random_ips)
+    bench(lookup, "random (warm)", random_ips)
+    bench(lookup, "repeated", ["8.8.8.8"] * args.count)
+    bench(lookup, "private", ["10.1.2.3"] * args.count)
+    bench(lookup, "json (warm)", random_ips, as_json=True)
+
+    for name, info in lookup.status()["caches"].items():
+        total = info["hits"] + info["misses"]
+        rate = info["hits"] / total if total else 0.0
+        print(f"{name:<16}{info['currsize']:>12,} entries{rate:>10.1%} hit rate")
+
+    if args.overrides:
+        bench_overrides(args, rng, random_ips)
+
+
+def bench_overrides(
+    args: argparse.Namespace, rng: random.Random, random_ips: list
+) -> None:
+    """Time random lookups with random override networks from /8 to /32."""
+    rules = {}
+    for _ in range(args.overrides):
+        network = ipaddress.IPv4Network(
+            (rng.getrandbits(32), rng.randint(8, 32)), strict=False
+        )
+        rules[str(network)] = {"city": "Override", "asn": rng.randint(1, 65535)}
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(rules, f)
+    try:
+        start = time.perf_counter()
+        lookup = GeoIPLookup(
+            city_db_path=args.city, asn_db_path=args.asn, overrides_path=f.name
+        )
+        print(
+            f"{'compile':<16}{len(rules):>12,} overrides"
+            f"{(time.perf_counter() - start) * 1e3:>10.1f} ms"
+        )
+    finally:
+        os.unlink(f.name)
+    lookup.load()
+
+    # Addresses inside the override networks, to time the overridden results
+    inside = [str(ipaddress.IPv4Network(cidr)[0]) for cidr in rules for _ in range(10)][
+        : args.count
+    ]
+    bench(lookup, "overrides", random_ips)
+    bench(lookup, "overrides (warm)", random_ips)
+    bench(lookup, "overridden", inside)
+    bench(lookup, "overridden json", inside, as_json=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Round-trip benchmark for the sidecar server.
+
+Starts the sidecar in a separate process and times single lookups and a
+pipelined batch lookup through SidecarClient.
+
+Usage:
+    python benchmarks/bench_sidecar.py [--count 20000] [--city PATH] [--asn PATH]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from geoip_api.sidecar import SidecarClient
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=20000, help="Lookups per run")
+    parser.add_argument("--city", help="Path to the City database")
+    parser.add_argument("--asn", help="Path to the ASN database")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "geoip.sock")
+    command = [sys.executable, "-m", "geoip_api.sidecar", "--socket", path]
+    for flag, value in (("--city", args.city), ("--asn", args.asn)):
+        if value:
+            command += [flag, value]
+    server = subprocess.Popen(command)
+    try:
+        while not os.path.exists(path):
+            if server.poll() is not None:
+                sys.exit("Sidecar failed to start")
+            time.sleep(0.05)
+
+        with SidecarClient(path) as client:
+            start = time.perf_counter()
+            for _ in range(args.count):
+                client.lookup("8.8.8.8")
+            elapsed = time.perf_counter() - start
+            print(f"{'single':<16}{elapsed / args.count * 1e6:>10.1f} us/round trip")
+
+            ips = ["8.8.8.8", "1.1.1.1"] * (args.count // 2)
+            start = time.perf_counter()
+            client.lookup_many(ips)
+            elapsed = time.perf_counter() - start
+            print(f"{'pipelined':<16}{elapsed / len(ips) * 1e6:>10.1f} us/lookup")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Cold start benchmark for the GeoIP API.
+
+Measures, in fresh interpreters, how long it takes to import the application
+and how long until the first lookup is answered, for each startup mode.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--ip 8.8.8.8]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Runs in a fresh interpreter so nothing is already imported or cached
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from api.main import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    started = time.perf_counter()
+    while True:
+        response = client.get("/api/v1/geoip/lookup/" + sys.argv[1])
+        if response.status_code != 503:
+            break
+        time.sleep(0.005)
+    answered = time.perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (answered - started) * 1000,
+    "total_ms": (answered - start) * 1000,
+}))
+"""
+
+
+def run_once(mode: str, ip: str) -> dict:
+    """Start a fresh interpreter in the given startup mode and time it."""
+    env = dict(os.environ, STARTUP_MODE=mode)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, ip],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Runs per mode")
+    parser.add_argument("--ip", default="8.8.8.8", help="IP address to look up")
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'import':>12}{'first resp':>14}{'total':>12}")
+    for mode in ("eager", "fast"):
+        runs = [run_once(mode, args.ip) for _ in range(args.runs)]
+        if any(r["status"] != 200 for r in runs):
+            print(f"{mode:<8} lookup failed, are the databases available?")
+            continue
+        row = [
+            statistics.median(r[key] for r in runs)
+            for key in runs[0]
+            if key != "status"
+        ]
+        print(f"{mode:<8}{row[0]:>10.1f}ms{row[1]:>12.1f}ms{row[2]:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,7 @@ setup(
     python_requires=">=3.9",
     install_requires=[
         "geoip2==5.1.0",
+        "maxminddb>=2.7.0",
         "requests>=2.32.3",
         "pycountry>=24.6.1",
     ],
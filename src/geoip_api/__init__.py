@@ -2,7 +2,9 @@
 GeoIP API - A Python library for GeoIP lookups.
 """
 
+from geoip_api.core.address import ParsedIP, parse_ip
 from geoip_api.core.lookup import GeoIPLookup
+from geoip_api.core.result import GeoResult
 
 __version__ = "1.0.2"
-__all__ = ["GeoIPLookup"]
+__all__ = ["GeoIPLookup", "GeoResult", "ParsedIP", "parse_ip"]
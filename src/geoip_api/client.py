@@ -0,0 +1,596 @@
+"""
+HTTP clients for a remote GeoIP API server.
+
+GeoIPClient and AsyncGeoIPClient mirror GeoIPLookup.lookup and lookup_many,
+so an application can switch between embedded and remote lookups by swapping
+the object it calls. Both clients reuse pooled keep-alive connections, retry
+failed requests with exponential backoff, can keep recent results in a local
+LRU cache, and can merge single lookups made concurrently within a short window
+into one batch request. AsyncGeoIPClient runs the same blocking requests in an
+executor rather than doing asynchronous I/O.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    overload,
+)
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from geoip_api.config import API_URL
+from geoip_api.core.address import ParsedIP, parse_ip
+from geoip_api.core.result import GeoResult, make_result
+from geoip_api.exceptions import InvalidIPError, LookupError
+
+# Responses worth retrying: server errors and load shedding
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Longest Retry-After honored, so a misbehaving server cannot stall callers
+MAX_RETRY_AFTER = 10.0
+
+
+class _ResultCache:
+    """Thread-safe LRU cache of results keyed by packed address."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._results: "OrderedDict[bytes, GeoResult]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[GeoResult]:
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+            return result
+
+    def put(self, key: bytes, result: GeoResult) -> None:
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+
+class _Transport:
+    """Sends lookups over a pooled session, retrying failed requests."""
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float,
+        retries: int,
+        backoff: float,
+        pool_size: int,
+    ):
+        self.base_url = base_url.rstrip("/") + "/api/v1/geoip/lookup"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, addresses: Sequence[ParsedIP]) -> List[Optional[GeoResult]]:
+        """
+        Look up addresses with one request.
+
+        Returns:
+            One result per address, None where the server rejected it
+
+        Raises:
+            LookupError: If the request still fails after all retries
+        """
+        if len(addresses) == 1:
+            # A single GET stays cacheable by any HTTP cache in between
+            path = quote(addresses[0].text, safe=":")
+            response = self._request("GET", f"{self.base_url}/{path}")
+            if response.status_code == 400:
+                return [None]
+            return [_parse_entry(_json(response))]
+
+        body = {"ips": [address.text for address in addresses]}
+        entries = _json(self._request("POST", self.base_url, body))["results"]
+        if len(entries) != len(addresses):
+            raise LookupError(f"Expected {len(addresses)} results, got {len(entries)}")
+        return [_parse_entry(entry) for entry in entries]
+
+    def _request(
+        self, method: str, url: str, body: Optional[Dict[str, Any]] = None
+    ) -> requests.Response:
+        for attempt in range(self.retries + 1):
+            retry_after: Optional[str] = None
+            try:
+                response = self.session.request(
+                    method, url, json=body, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"Request to {url} failed: {e}"
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = f"Request to {url} failed with {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt < self.retries:
+                time.sleep(self._delay(attempt, retry_after))
+        raise LookupError(error)
+
+    def _delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        """Seconds to wait before the next attempt."""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), MAX_RETRY_AFTER)
+            except ValueError:
+                pass
+        # Full jitter keeps clients that failed together from retrying together
+        return random.uniform(0, self.backoff * 2**attempt)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def _json(response: requests.Response) -> Dict[str, Any]:
+    """Decode a successful response body."""
+    if response.status_code >= 400:
+        raise LookupError(
+            f"Request to {response.url} failed with {response.status_code}: "
+            f"{response.text[:200]}"
+        )
+    try:
+        return response.json()
+    except ValueError as e:
+        raise LookupError(f"Invalid response from {response.url}: {e}") from e
+
+
+def _parse_entry(entry: Dict[str, Any]) -> Optional[GeoResult]:
+    """Build a result from a response entry, None for an error entry."""
+    if "error" in entry:
+        return None
+    return make_result(
+        {name: entry.get(name) for name in GeoResult._fields if name in entry}
+    )
+
+
+def _parse_address(ip_address: Union[str, ParsedIP]) -> ParsedIP:
+    if isinstance(ip_address, ParsedIP):
+        return ip_address
+    try:
+        return parse_ip(ip_address)
+    except ValueError as e:
+        raise InvalidIPError(f"Invalid IP address: {ip_address}") from e
+
+
+def _chunks(items: List[ParsedIP], size: int) -> List[List[ParsedIP]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+class _ClientBase:
+    """Settings, validation and caching shared by both clients."""
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float,
+        retries: int,
+        backoff: float,
+        cache_size: int,
+        batch_window: float,
+        max_batch_size: int,
+        pool_size: int,
+    ):
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._transport = _Transport(base_url, timeout, retries, backoff, pool_size)
+        self._cache = _ResultCache(cache_size) if cache_size > 0 else None
+
+    def _cached(self, address: ParsedIP) -> Optional[GeoResult]:
+        return None if self._cache is None else self._cache.get(address.packed)
+
+    def _fetch(self, addresses: Sequence[ParsedIP]) -> List[Optional[GeoResult]]:
+        results = self._transport.fetch(addresses)
+        if self._cache is not None:
+            for address, result in zip(addresses, results):
+                if result is not None:
+                    self._cache.put(address.packed, result)
+        return results
+
+    def _split(
+        self, ip_addresses: Iterable[Union[str, ParsedIP]]
+    ) -> Tuple[
+        List[Optional[ParsedIP]], Dict[bytes, Optional[GeoResult]], List[ParsedIP]
+    ]:
+        """
+        Parse addresses and resolve what the local cache can.
+
+        Returns:
+            Tuple of (parsed addresses, None where invalid; results by packed
+            address; distinct addresses still to fetch)
+        """
+        parsed: List[Optional[ParsedIP]] = []
+        known: Dict[bytes, Optional[GeoResult]] = {}
+        missing: List[ParsedIP] = []
+        for ip_address in ip_addresses:
+            try:
+                address = _parse_address(ip_address)
+            except InvalidIPError:
+                parsed.append(None)
+                continue
+            parsed.append(address)
+            if address.packed not in known:
+                known[address.packed] = self._cached(address)
+                if known[address.packed] is None:
+                    missing.append(address)
+        return parsed, known, missing
+
+    @staticmethod
+    def _assemble(
+        parsed: List[Optional[ParsedIP]],
+        known: Dict[bytes, Optional[GeoResult]],
+        as_dict: bool,
+    ) -> List[Any]:
+        results = [
+            None if address is None else known[address.packed] for address in parsed
+        ]
+        if as_dict:
+            return [None if r is None else r._asdict() for r in results]
+        return results
+
+    def clear_cache(self) -> None:
+        """Clear the local result cache."""
+        if self._cache is not None:
+            self._cache.clear()
+
+
+class GeoIPClient(_ClientBase):
+    """
+    Looks up IP addresses through a remote GeoIP API server.
+
+    The client is safe to share between threads, and should be: concurrent
+    lookups from several threads are what get merged into batch requests.
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_URL,
+        timeout: float = 5.0,
+        retries: int = 3,
+        backoff: float = 0.1,
+        cache_size: int = 0,
+        batch_window: float = 0.0,
+        max_batch_size: int = 100,
+        pool_size: int = 10,
+    ):
+        """
+        Initialize the client.
+
+        Args:
+            base_url: URL of the GeoIP API server
+            timeout: Timeout of each request in seconds
+            retries: Retries of a request failing with a connection error or a
+                retryable status, before giving up
+            backoff: Base of the exponential backoff between retries, in
+                seconds. A Retry-After header from the server takes precedence.
+            cache_size: Results kept in the local LRU cache, 0 to disable it
+            batch_window: Seconds a single lookup waits for concurrent lookups
+                to join its batch request. The default 0 sends every lookup on
+                its own, so no lookup pays for the wait when there is nothing to
+                merge it with.
+            max_batch_size: Most addresses per batch request, at most the
+                server's LOOKUP_BATCH_MAX
+            pool_size: Most connections kept open to the server
+        """
+        super().__init__(
+            base_url,
+            timeout,
+            retries,
+            backoff,
+            cache_size,
+            batch_window,
+            max_batch_size,
+            pool_size,
+        )
+        self._lock = threading.Lock()
+        # Batch collecting concurrent lookups, by packed address
+        self._batch: Optional[Dict[bytes, Tuple[ParsedIP, Future]]] = None
+
+    @overload
+    def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: Literal[True] = ...
+    ) -> Dict[str, Any]: ...
+
+    @overload
+    def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: Literal[False]
+    ) -> GeoResult: ...
+
+    def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: bool = True
+    ) -> Union[Dict[str, Any], GeoResult]:
+        """
+        Look up geolocation information for an IP address.
+
+        Args:
+            ip_address: IP address to look up, as a string or a ParsedIP
+            as_dict: Return a dictionary (the default) or a typed GeoResult
+
+        Returns:
+            Dictionary or GeoResult containing geolocation information
+
+        Raises:
+            InvalidIPError: If the IP address is invalid
+            LookupError: If the server cannot be reached or fails
+        """
+        address = _parse_address(ip_address)
+        result = self._cached(address)
+        if result is None:
+            if self.batch_window > 0:
+                result = self._join_batch(address)
+            else:
+                result = self._fetch([address])[0]
+        if result is None:
+            raise InvalidIPError(f"Invalid IP address: {ip_address}")
+        return result._asdict() if as_dict else result
+
+    @overload
+    def lookup_many(
+        self,
+        ip_addresses: Iterable[Union[str, ParsedIP]],
+        as_dict: Literal[True] = ...,
+    ) -> List[Optional[Dict[str, Any]]]: ...
+
+    @overload
+    def lookup_many(
+        self, ip_addresses: Iterable[Union[str, ParsedIP]], as_dict: Literal[False]
+    ) -> List[Optional[GeoResult]]: ...
+
+    def lookup_many(
+        self, ip_addresses: Iterable[Union[str, ParsedIP]], as_dict: bool = True
+    ) -> Union[List[Optional[Dict[str, Any]]], List[Optional[GeoResult]]]:
+        """
+        Look up many IP addresses with as few requests as possible.
+
+        Returns:
+            One result per address, in input order, None where the address
+            is invalid
+
+        Raises:
+            LookupError: If the server cannot be reached or fails
+        """
+        parsed, known, missing = self._split(ip_addresses)
+        for chunk in _chunks(missing, self.max_batch_size):
+            for address, result in zip(chunk, self._fetch(chunk)):
+                known[address.packed] = result
+        return self._assemble(parsed, known, as_dict)
+
+    def _join_batch(self, address: ParsedIP) -> Optional[GeoResult]:
+        """
+        Add a lookup to the open batch and wait for its result.
+
+        The lookup opening a batch waits batch_window for others to join and
+        then sends it, unless the batch filled up and was sent earlier.
+        """
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if batch is None:
+                batch = self._batch = {}
+            if address.packed not in batch:
+                batch[address.packed] = (address, Future())
+            future = batch[address.packed][1]
+            full = len(batch) >= self.max_batch_size
+            if full:
+                self._batch = None
+
+        if full:
+            self._send_batch(batch)
+        elif leader:
+            wait([future], timeout=self.batch_window)
+            with self._lock:
+                expired = self._batch is batch
+                if expired:
+                    self._batch = None
+            if expired:
+                self._send_batch(batch)
+        return future.result()
+
+    def _send_batch(self, batch: Dict[bytes, Tuple[ParsedIP, Future]]) -> None:
+        entries = list(batch.values())
+        try:
+            results = self._fetch([address for address, _ in entries])
+        except Exception as e:
+            for _, future in entries:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(entries, results):
+            future.set_result(result)
+
+    def close(self) -> None:
+        """Close the pooled connections."""
+        self._transport.close()
+
+    def __enter__(self) -> "GeoIPClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class AsyncGeoIPClient(_ClientBase):
+    """
+    Looks up IP addresses through a remote GeoIP API server from asyncio code.
+
+    This is not an asynchronous HTTP client: each request is a blocking
+    requests call run on the event loop's default executor, over the same
+    pooled session as GeoIPClient. It keeps the event loop free, but every
+    request in flight holds an executor thread, so concurrency is bounded by
+    the executor's size. With batch_window set, concurrent lookups share batch
+    requests and so hold fewer threads. A client belongs to the event loop it
+    is first used on.
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_URL,
+        timeout: float = 5.0,
+        retries: int = 3,
+        backoff: float = 0.1,
+        cache_size: int = 0,
+        batch_window: float = 0.0,
+        max_batch_size: int = 100,
+        pool_size: int = 10,
+    ):
+        """
+        Initialize the client.
+
+        Takes the same arguments as GeoIPClient.
+        """
+        super().__init__(
+            base_url,
+            timeout,
+            retries,
+            backoff,
+            cache_size,
+            batch_window,
+            max_batch_size,
+            pool_size,
+        )
+        self._batch: Optional[Dict[bytes, Tuple[ParsedIP, "asyncio.Future[Any]"]]] = (
+            None
+        )
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Batch requests in flight, referenced so they are not garbage collected
+        self._sending: Set["asyncio.Task[None]"] = set()
+
+    @overload
+    async def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: Literal[True] = ...
+    ) -> Dict[str, Any]: ...
+
+    @overload
+    async def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: Literal[False]
+    ) -> GeoResult: ...
+
+    async def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: bool = True
+    ) -> Union[Dict[str, Any], GeoResult]:
+        """
+        Look up geolocation information for an IP address.
+
+        See GeoIPClient.lookup.
+        """
+        address = _parse_address(ip_address)
+        result = self._cached(address)
+        if result is None:
+            if self.batch_window > 0:
+                result = await asyncio.shield(self._join_batch(address))
+            else:
+                result = (await self._fetch_async([address]))[0]
+        if result is None:
+            raise InvalidIPError(f"Invalid IP address: {ip_address}")
+        return result._asdict() if as_dict else result
+
+    @overload
+    async def lookup_many(
+        self,
+        ip_addresses: Iterable[Union[str, ParsedIP]],
+        as_dict: Literal[True] = ...,
+    ) -> List[Optional[Dict[str, Any]]]: ...
+
+    @overload
+    async def lookup_many(
+        self, ip_addresses: Iterable[Union[str, ParsedIP]], as_dict: Literal[False]
+    ) -> List[Optional[GeoResult]]: ...
+
+    async def lookup_many(
+        self, ip_addresses: Iterable[Union[str, ParsedIP]], as_dict: bool = True
+    ) -> Union[List[Optional[Dict[str, Any]]], List[Optional[GeoResult]]]:
+        """
+        Look up many IP addresses, sending their batch requests concurrently.
+
+        See GeoIPClient.lookup_many.
+        """
+        parsed, known, missing = self._split(ip_addresses)
+        chunks = _chunks(missing, self.max_batch_size)
+        fetched = await asyncio.gather(*(self._fetch_async(c) for c in chunks))
+        for chunk, results in zip(chunks, fetched):
+            for address, result in zip(chunk, results):
+                known[address.packed] = result
+        return self._assemble(parsed, known, as_dict)
+
+    async def _fetch_async(
+        self, addresses: Sequence[ParsedIP]
+    ) -> List[Optional[GeoResult]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._fetch, addresses)
+
+    def _join_batch(self, address: ParsedIP) -> "asyncio.Future[Any]":
+        """Add a lookup to the open batch, sent when full or after the window."""
+        loop = asyncio.get_running_loop()
+        if self._batch is None:
+            self._batch = {}
+            self._timer = loop.call_later(self.batch_window, self._flush)
+        entry = self._batch.get(address.packed)
+        if entry is None:
+            entry = self._batch[address.packed] = (address, loop.create_future())
+        if len(self._batch) >= self.max_batch_size:
+            self._flush()
+        return entry[1]
+
+    def _flush(self) -> None:
+        batch, self._batch = self._batch, None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if batch:
+            task = asyncio.ensure_future(self._send_batch(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send_batch(
+        self, batch: Dict[bytes, Tuple[ParsedIP, "asyncio.Future[Any]"]]
+    ) -> None:
+        entries = list(batch.values())
+        try:
+            results = await self._fetch_async([address for address, _ in entries])
+        except Exception as e:
+            for _, future in entries:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(entries, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self) -> None:
+        """Close the pooled connections."""
+        self._transport.close()
+
+    async def __aenter__(self) -> "AsyncGeoIPClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
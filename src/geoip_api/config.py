@@ -19,3 +19,14 @@ CITY_DB_URL = "https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-City
 
 # Download settings
 DOWNLOAD_TIMEOUT = 60  # seconds
+
+# Lookup engine settings
+DECODE_CACHE_SIZE = int(
+    os.environ.get("GEOIP_DECODE_CACHE_SIZE", "32768")
+)  # decoded records per cache
+
+# Sidecar server
+SIDECAR_SOCKET_PATH = os.environ.get("GEOIP_SIDECAR_SOCKET", "/tmp/geoip-api.sock")
+
+# Remote API used by geoip_api.client
+API_URL = os.environ.get("GEOIP_API_URL", "http://localhost:8000")
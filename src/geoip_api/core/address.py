@@ -0,0 +1,123 @@
+"""
+Pre-parsed IP addresses.
+"""
+
+import ipaddress
+import socket
+from bisect import bisect_right
+from typing import Dict, Iterable, Iterator, List, NamedTuple
+
+from geoip_api.core.tree import IPNetwork
+
+
+class ParsedIP(NamedTuple):
+    """
+    An IP address parsed once and passed through the whole lookup path.
+
+    Lookup methods accept a ParsedIP wherever they accept an address string
+    and skip validating it again.
+    """
+
+    text: str
+    version: int
+    packed: bytes
+    value: int
+
+
+def parse_ip(text: str) -> ParsedIP:
+    """
+    Parse an IP address string.
+
+    Dotted IPv4 addresses, by far the most common input, are parsed with the
+    strict inet_pton of the C library, which accepts the same strings as the
+    ipaddress module. Everything else goes through the ipaddress module.
+
+    Args:
+        text: IPv4 or IPv6 address
+
+    Returns:
+        The parsed address, keeping the original text
+
+    Raises:
+        ValueError: If the text is not a valid IP address
+    """
+    if ":" not in text:
+        try:
+            packed = socket.inet_pton(socket.AF_INET, text)
+        except (OSError, ValueError):
+            pass
+        else:
+            return ParsedIP(text, 4, packed, int.from_bytes(packed, "big"))
+
+    address = ipaddress.ip_address(text)
+    return ParsedIP(text, address.version, address.packed, int(address))
+
+
+def range_networks(version: int, first: int, last: int) -> Iterator[IPNetwork]:
+    """
+    Cover a range of addresses with the fewest networks, in address order.
+
+    Args:
+        version: IP version of the range
+        first: First address of the range as an integer
+        last: Last address of the range as an integer
+    """
+    if version == 4:
+        return ipaddress.summarize_address_range(
+            ipaddress.IPv4Address(first), ipaddress.IPv4Address(last)
+        )
+    return ipaddress.summarize_address_range(
+        ipaddress.IPv6Address(first), ipaddress.IPv6Address(last)
+    )
+
+
+class NetworkSet:
+    """
+    A set of IP networks with fast membership tests for parsed addresses.
+
+    The networks are merged into sorted, non-overlapping integer ranges per IP
+    version, so a membership test is a single bisection.
+    """
+
+    def __init__(self, cidrs: Iterable[str]):
+        """
+        Compile a set of networks.
+
+        Args:
+            cidrs: Networks in CIDR notation; plain addresses are single hosts
+
+        Raises:
+            ValueError: If a network is invalid
+        """
+        networks: Dict[int, List[IPNetwork]] = {4: [], 6: []}
+        for cidr in cidrs:
+            network = ipaddress.ip_network(cidr.strip(), strict=False)
+            networks[network.version].append(network)
+
+        self._firsts: Dict[int, List[int]] = {}
+        self._lasts: Dict[int, List[int]] = {}
+        for version, nets in networks.items():
+            merged = list(ipaddress.collapse_addresses(nets))  # type: ignore[type-var]
+            self._firsts[version] = [int(n.network_address) for n in merged]
+            self._lasts[version] = [int(n.broadcast_address) for n in merged]
+
+    def __contains__(self, address: object) -> bool:
+        if not isinstance(address, ParsedIP):
+            return False
+        i = bisect_right(self._firsts[address.version], address.value) - 1
+        return i >= 0 and address.value <= self._lasts[address.version][i]
+
+    def overlaps(self, version: int, first: int, last: int) -> bool:
+        """
+        Whether any network of the set overlaps a range of addresses.
+
+        Args:
+            version: IP version of the range
+            first: First address of the range as an integer
+            last: Last address of the range as an integer
+        """
+        i = bisect_right(self._firsts[version], last) - 1
+        return i >= 0 and self._lasts[version][i] >= first
+
+    def __len__(self) -> int:
+        return sum(len(firsts) for firsts in self._firsts.values())
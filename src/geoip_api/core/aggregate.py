@@ -0,0 +1,173 @@
+"""
+Aggregation of lookup results over batches of IP addresses.
+
+Counting results by country or ASN where the lookups happen avoids shipping a
+full result per address to a client that only needs the histogram.
+"""
+
+import math
+from collections import Counter
+from hashlib import blake2b
+from operator import itemgetter
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence, Union
+
+from geoip_api.core.address import ParsedIP, parse_ip
+from geoip_api.core.result import GeoResult
+
+if TYPE_CHECKING:
+    from geoip_api.core.lookup import GeoIPLookup
+
+# Fields that can be grouped by or counted distinctly, besides "ip"
+AGGREGATE_FIELDS = GeoResult._fields
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter in constant memory.
+
+    With the default precision of 14 it takes 16 KiB and the estimate is
+    typically within 1% of the true count.
+    """
+
+    def __init__(self, precision: int = 14):
+        """
+        Initialize an empty counter.
+
+        Args:
+            precision: Number of hash bits selecting a register, 4 to 16.
+                Memory is 2**precision bytes; the standard error is
+                1.04 / sqrt(2**precision).
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("Precision must be between 4 and 16")
+        self.precision = precision
+        self._registers = bytearray(1 << precision)
+        self._rest_bits = 64 - precision
+        self._rest_mask = (1 << self._rest_bits) - 1
+
+    def add(self, value: bytes) -> None:
+        """Count a value."""
+        h = int.from_bytes(blake2b(value, digest_size=8).digest(), "big")
+        index = h >> self._rest_bits
+        # Position of the leftmost 1 bit in the remaining bits
+        rank = self._rest_bits - (h & self._rest_mask).bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def count(self) -> int:
+        """Estimate the number of distinct values counted."""
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class Aggregator:
+    """
+    Counts lookup results by a set of fields, one batch at a time.
+
+    Only the group counts and distinct counters are kept, so arbitrarily many
+    addresses can be added in batches with constant memory per group.
+    """
+
+    def __init__(
+        self,
+        geoip_lookup: "GeoIPLookup",
+        group_by: Sequence[str] = ("country",),
+        distinct: Sequence[str] = (),
+    ):
+        """
+        Initialize the aggregation.
+
+        Args:
+            geoip_lookup: Lookup service answering the batches
+            group_by: Result fields whose values form a group
+            distinct: Fields, or "ip" for the addresses themselves, to count
+                approximate distinct values of
+
+        Raises:
+            ValueError: If a field is unknown
+        """
+        for field in group_by:
+            if field not in AGGREGATE_FIELDS:
+                raise ValueError(f"Unknown group-by field: {field}")
+        for field in distinct:
+            if field != "ip" and field not in AGGREGATE_FIELDS:
+                raise ValueError(f"Unknown distinct field: {field}")
+        self.geoip_lookup = geoip_lookup
+        self.group_by = list(group_by)
+        self.distinct = list(distinct)
+        self.total = 0
+        self.invalid = 0
+        self._groups: Counter = Counter()
+        self._counters = {field: HyperLogLog() for field in self.distinct}
+        self._group_key = _getter([AGGREGATE_FIELDS.index(f) for f in group_by])
+
+    def add(self, ip_addresses: Iterable[Union[str, ParsedIP]]) -> None:
+        """Look up a batch of addresses and count their results."""
+        addresses: List[ParsedIP] = []
+        for ip_address in ip_addresses:
+            self.total += 1
+            if isinstance(ip_address, ParsedIP):
+                addresses.append(ip_address)
+                continue
+            try:
+                addresses.append(parse_ip(ip_address.strip()))
+            except (ValueError, AttributeError):
+                self.invalid += 1
+
+        results = self.geoip_lookup.lookup_many(addresses, as_dict=False)
+        valid = [r for r in results if r is not None]
+        self.invalid += len(results) - len(valid)
+        self._groups.update(map(self._group_key, valid))
+
+        for field, counter in self._counters.items():
+            if field == "ip":
+                for address in addresses:
+                    counter.add(address.packed)
+            else:
+                index = AGGREGATE_FIELDS.index(field)
+                # Results repeat heavily, so hash each distinct value once
+                for value in {r[index] for r in valid}:
+                    if value is not None:
+                        counter.add(str(value).encode())
+
+    def result(self, top: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Summarize the counts so far.
+
+        Args:
+            top: Only return the largest groups, with the remaining addresses
+                counted under "other"
+
+        Returns:
+            Dictionary with the "total" and "invalid" address counts, the
+            "groups" in descending order of count, and the approximate
+            "distinct" counts
+        """
+        ranked = self._groups.most_common(top)
+        groups = [{**dict(zip(self.group_by, key)), "count": n} for key, n in ranked]
+        summary: Dict[str, Any] = {
+            "total": self.total,
+            "invalid": self.invalid,
+            "groups": groups,
+        }
+        if top is not None:
+            summary["other"] = sum(self._groups.values()) - sum(n for _, n in ranked)
+        if self._counters:
+            summary["distinct"] = {f: c.count() for f, c in self._counters.items()}
+        return summary
+
+
+def _getter(indexes: List[int]) -> Any:
+    """Build a function returning the values at indexes as a tuple."""
+    if not indexes:
+        return lambda result: ()
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda result: (result[index],)
+    return itemgetter(*indexes)
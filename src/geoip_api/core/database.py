@@ -7,8 +7,6 @@ import os
 import shutil
 from pathlib import Path
 
-import requests
-
 from geoip_api.config import (
     ASN_DB_URL,
     CITY_DB_URL,
@@ -43,6 +41,9 @@ def download_database(url, target_path):
     Raises:
         DatabaseError: If download fails
     """
+    # Imported here as it is only needed when a database is missing
+    import requests
+
     logger.info(f"Downloading database from {url} to {target_path}")
     ensure_db_dir(target_path)
 
@@ -0,0 +1,168 @@
+"""
+Differences between two builds of the databases.
+
+The search trees of both builds are walked together, so every network is
+compared once, with the joined City and ASN results of each build memoized by
+their record offsets. The networks whose result changed let caches drop only
+the entries they hold for those networks when a new build is deployed.
+"""
+
+import ipaddress
+import json
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from geoip_api.core.address import NetworkSet, ParsedIP
+from geoip_api.core.result import GeoResult
+from geoip_api.core.special import special_range
+from geoip_api.core.tree import IPNetwork, SearchTree, walk_networks
+
+ResultBuilder = Callable[[int, int], GeoResult]
+
+
+class DatabaseDiff:
+    """
+    The networks whose lookup result differs between two database builds.
+
+    Attributes:
+        old_epoch: GeoIPLookup.database_epoch of the old build
+        new_epoch: GeoIPLookup.database_epoch of the new build
+        changed: Changed networks, merged and in address order
+        stats: Summary counts of the comparison
+    """
+
+    def __init__(
+        self,
+        old_epoch: str,
+        new_epoch: str,
+        changed: Iterable[IPNetwork],
+        stats: Dict[str, Any],
+    ):
+        self.old_epoch = old_epoch
+        self.new_epoch = new_epoch
+        networks_by_version: Dict[int, List[IPNetwork]] = {4: [], 6: []}
+        for network in changed:
+            networks_by_version[network.version].append(network)
+        self.changed: List[IPNetwork] = []
+        for networks in networks_by_version.values():
+            self.changed += ipaddress.collapse_addresses(networks)  # type: ignore
+        self.stats = stats
+        self._changed_set: Optional[NetworkSet] = None
+
+    @property
+    def changed_set(self) -> NetworkSet:
+        """The changed networks compiled for fast overlap tests."""
+        if self._changed_set is None:
+            self._changed_set = NetworkSet(str(n) for n in self.changed)
+        return self._changed_set
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the diff to a JSON-serializable dictionary."""
+        return {
+            "old_epoch": self.old_epoch,
+            "new_epoch": self.new_epoch,
+            "stats": self.stats,
+            "changed": [str(n) for n in self.changed],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DatabaseDiff":
+        """
+        Rebuild a diff from the dictionary of to_dict.
+
+        Raises:
+            ValueError: If the dictionary is not a valid diff
+        """
+        try:
+            return cls(
+                data["old_epoch"],
+                data["new_epoch"],
+                [ipaddress.ip_network(cidr) for cidr in data["changed"]],
+                data.get("stats", {}),
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid database diff: {e}") from e
+
+    @classmethod
+    def load(cls, path: str) -> "DatabaseDiff":
+        """
+        Read a diff saved as JSON.
+
+        Raises:
+            OSError: If the file cannot be read
+            ValueError: If the file is not a valid diff
+        """
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def diff_trees(
+    old_trees: Tuple[SearchTree, SearchTree],
+    new_trees: Tuple[SearchTree, SearchTree],
+    old_result: ResultBuilder,
+    new_result: ResultBuilder,
+    special_ranges: bool = True,
+) -> Tuple[List[IPNetwork], Dict[str, Any]]:
+    """
+    Compare the joined results of two builds network by network.
+
+    Args:
+        old_trees: City and ASN trees of the old build
+        new_trees: City and ASN trees of the new build
+        old_result: Joins the City and ASN records of the old build
+        new_result: Joins the City and ASN records of the new build
+        special_ranges: Skip networks inside special-purpose ranges, which
+            lookups answer without the databases
+
+    Returns:
+        Tuple of (changed networks in address order, stats)
+    """
+
+    # Most networks share a handful of record pairs, so compare each once
+    @lru_cache(maxsize=65536)
+    def changed_fields(offsets: Tuple[int, int, int, int]) -> Tuple[str, ...]:
+        old = old_result(offsets[0], offsets[1])
+        new = new_result(offsets[2], offsets[3])
+        if old == new:
+            return ()
+        return tuple(f for f, a, b in zip(GeoResult._fields, old, new) if a != b)
+
+    changed: List[IPNetwork] = []
+    fields: Counter = Counter()
+    addresses = {4: 0, 6: 0}
+    compared = added = removed = 0
+    for network, offsets in walk_networks([*old_trees, *new_trees]):
+        if special_ranges and _is_special(network):
+            continue
+        compared += 1
+        diff = changed_fields(offsets)
+        if not diff:
+            continue
+        changed.append(network)
+        fields.update(diff)
+        addresses[network.version] += network.num_addresses
+        if not any(offsets[:2]):
+            added += 1
+        elif not any(offsets[2:]):
+            removed += 1
+
+    stats = {
+        "networks_compared": compared,
+        "networks_changed": len(changed),
+        "networks_added": added,
+        "networks_removed": removed,
+        "ipv4_addresses_changed": addresses[4],
+        "ipv6_addresses_changed": addresses[6],
+        "fields_changed": dict(fields.most_common()),
+    }
+    return changed, stats
+
+
+def _is_special(network: IPNetwork) -> bool:
+    """Whether a network lies entirely inside a special-purpose range."""
+    first = network.network_address
+    special = special_range(
+        ParsedIP(str(first), network.version, first.packed, int(first))
+    )
+    return special is not None and special.prefix_len <= network.prefixlen
@@ -0,0 +1,133 @@
+"""
+Reverse indexes from ASNs and countries to the networks they cover.
+"""
+
+import ipaddress
+import logging
+import threading
+from array import array
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from geoip_api.core.tree import IPNetwork, SearchTree
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixArray:
+    """
+    A compact, sorted list of network prefixes.
+
+    Networks are appended in address order by the tree walk, so the arrays stay
+    sorted without any extra work. IPv4 networks take 5 bytes each and IPv6
+    networks 17 bytes.
+    """
+
+    __slots__ = ("_v4_addrs", "_v4_lens", "_v6_addrs", "_v6_lens")
+
+    def __init__(self):
+        self._v4_addrs = array("I")
+        self._v4_lens = array("B")
+        self._v6_addrs = bytearray()
+        self._v6_lens = array("B")
+
+    def append(self, network: IPNetwork) -> None:
+        """Append a network. Networks must be appended in ascending order."""
+        if network.version == 4:
+            self._v4_addrs.append(int(network.network_address))
+            self._v4_lens.append(network.prefixlen)
+        else:
+            self._v6_addrs += network.network_address.packed
+            self._v6_lens.append(network.prefixlen)
+
+    def __len__(self) -> int:
+        return len(self._v4_lens) + len(self._v6_lens)
+
+    def __iter__(self) -> Iterator[IPNetwork]:
+        for addr, prefix_len in zip(self._v4_addrs, self._v4_lens):
+            yield ipaddress.IPv4Network((addr, prefix_len))
+        for i, prefix_len in enumerate(self._v6_lens):
+            packed = bytes(self._v6_addrs[i * 16 : i * 16 + 16])
+            yield ipaddress.IPv6Network((packed, prefix_len))
+
+
+class ReverseIndex:
+    """
+    Maps ASNs and country codes to the networks that resolve to them.
+
+    Each index is built by a single walk over the relevant database tree the
+    first time it is queried, and kept for the lifetime of the loaded
+    databases.
+    """
+
+    def __init__(self, city_tree: SearchTree, asn_tree: SearchTree):
+        """
+        Initialize the reverse index.
+
+        Args:
+            city_tree: Search tree of the City database
+            asn_tree: Search tree of the ASN database
+        """
+        self._city_tree = city_tree
+        self._asn_tree = asn_tree
+        self._by_asn: Optional[Dict[int, PrefixArray]] = None
+        self._by_country: Optional[Dict[str, PrefixArray]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def has_asn_index(self) -> bool:
+        """Whether the ASN index has been built."""
+        return self._by_asn is not None
+
+    @property
+    def has_country_index(self) -> bool:
+        """Whether the country index has been built."""
+        return self._by_country is not None
+
+    def networks_for_asn(self, asn: int) -> Optional[PrefixArray]:
+        """Return the networks announced by an ASN, or None if it is unknown."""
+        if self._by_asn is None:
+            with self._lock:
+                if self._by_asn is None:
+                    self._by_asn = _build_index(self._asn_tree, _asn_key)
+        return self._by_asn.get(asn)
+
+    def networks_for_country(self, country_code: str) -> Optional[PrefixArray]:
+        """Return the networks located in a country, or None if it is unknown."""
+        if self._by_country is None:
+            with self._lock:
+                if self._by_country is None:
+                    self._by_country = _build_index(self._city_tree, _country_key)
+        return self._by_country.get(country_code.upper())
+
+
+def _asn_key(record: Any) -> Optional[int]:
+    return record.get("autonomous_system_number")
+
+
+def _country_key(record: Any) -> Optional[str]:
+    return record.get("country", {}).get("iso_code")
+
+
+def _build_index(
+    tree: SearchTree, key_for: Callable[[Any], Any]
+) -> Dict[Any, PrefixArray]:
+    """Walk a tree once and group its networks by the key of their record."""
+    logger.info(f"Building reverse index for {tree.db_path}")
+    index: Dict[Any, PrefixArray] = {}
+    # Many networks share a record, so decode each record offset only once
+    keys: Dict[int, Any] = {}
+    count = 0
+    for network, offset in tree.networks():
+        if offset in keys:
+            key = keys[offset]
+        else:
+            key = keys[offset] = key_for(tree.decode(offset))
+        if key is None:
+            continue
+        prefixes = index.get(key)
+        if prefixes is None:
+            prefixes = index[key] = PrefixArray()
+        prefixes.append(network)
+        count += 1
+    logger.info(f"Indexed {count} networks under {len(index)} keys")
+    return index
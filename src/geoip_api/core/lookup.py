@@ -2,19 +2,114 @@
 GeoIP lookup functionality with continent support.
 """
 
+import heapq
 import ipaddress
 import logging
-from typing import Any, Dict, Optional
-
-import geoip2.database
-from geoip2.errors import AddressNotFoundError
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
 
+from geoip_api.config import DECODE_CACHE_SIZE
+from geoip_api.core.address import ParsedIP, parse_ip, range_networks
+from geoip_api.core.aggregate import Aggregator
 from geoip_api.core.database import get_database_path
+from geoip_api.core.diff import DatabaseDiff, diff_trees
+from geoip_api.core.index import ReverseIndex
+from geoip_api.core.overrides import OverrideChanges, OverrideTable
+from geoip_api.core.result import GeoResult, make_result, splice_ip
+from geoip_api.core.special import PRIVATE, RESERVED, special_range
+from geoip_api.core.tree import IPNetwork, SearchTree, walk_networks
 from geoip_api.exceptions import InvalidIPError, LookupError
 from geoip_api.utils.currency import get_currency_for_country
 
 logger = logging.getLogger(__name__)
 
+EMPTY_CITY_FIELDS: Dict[str, Any] = {
+    "code": None,
+    "country": None,
+    "continent": None,
+    "continent_code": None,
+    "city": None,
+    "lat": None,
+    "lon": None,
+    "tz": None,
+    "currency": None,
+}
+EMPTY_ASN_FIELDS: Dict[str, Any] = {"isp": None, "asn": None}
+
+SPECIAL_RESULTS: Dict[str, GeoResult] = {
+    kind: make_result({"special": kind}) for kind in (PRIVATE, RESERVED)
+}
+SPECIAL_JSON: Dict[str, bytes] = {
+    kind: result.to_json() for kind, result in SPECIAL_RESULTS.items()
+}
+
+
+def _english_name(record: Dict[str, Any]) -> Optional[str]:
+    return record.get("names", {}).get("en")
+
+
+def city_fields(record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build the city part of a lookup result from a raw City database record.
+
+    Args:
+        record: Decoded City record, or None if the address was not found
+
+    Returns:
+        Dictionary with the city, country, location and currency fields
+    """
+    if record is None:
+        return dict(EMPTY_CITY_FIELDS)
+
+    country = record.get("country", {})
+    continent = record.get("continent", {})
+    location = record.get("location", {})
+    country_code = country.get("iso_code")
+    return {
+        "code": country_code,
+        "country": _english_name(country),
+        "continent": _english_name(continent),
+        "continent_code": continent.get("code"),
+        "city": _english_name(record.get("city", {})),
+        "lat": location.get("latitude"),
+        "lon": location.get("longitude"),
+        "tz": location.get("time_zone"),
+        "currency": get_currency_for_country(country_code),
+    }
+
+
+def asn_fields(record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build the ASN part of a lookup result from a raw ASN database record.
+
+    Args:
+        record: Decoded ASN record, or None if the address was not found
+
+    Returns:
+        Dictionary with the isp and asn fields
+    """
+    if record is None:
+        return dict(EMPTY_ASN_FIELDS)
+    return {
+        "isp": record.get("autonomous_system_organization"),
+        "asn": record.get("autonomous_system_number"),
+    }
+
 
 class GeoIPLookup:
     """
@@ -29,6 +124,10 @@ class GeoIPLookup:
         city_db_path: Optional[str] = None,
         asn_db_path: Optional[str] = None,
         download_if_missing: bool = False,
+        decode_cache_size: int = DECODE_CACHE_SIZE,
+        special_ranges: bool = True,
+        materialize_json: bool = False,
+        overrides_path: Optional[str] = None,
     ):
         """
         Initialize the GeoIP lookup service.
@@ -37,6 +136,24 @@ class GeoIPLookup:
             city_db_path: Path to the GeoLite2 City database
             asn_db_path: Path to the GeoLite2 ASN database
             download_if_missing: Whether to download databases if they're missing
+            decode_cache_size: Maximum number of decoded records kept per cache.
+                Records are cached by their offset in the database, so every
+                network sharing a record is served from one decoded copy.
+            special_ranges: Answer private and reserved addresses, such as
+                10.0.0.0/8 or 2001:db8::/32, without searching the databases.
+                Disable for custom databases that hold data for them.
+            materialize_json: Serialize every distinct result to JSON when
+                the databases are loaded, so lookup_json never serializes.
+                This walks both databases and keeps one JSON object per
+                distinct pair of records in memory. Otherwise lookup_json
+                serializes each result on first use and keeps it, up to
+                decode_cache_size results.
+            overrides_path: JSON file of result fields replacing the ones in
+                the databases, by network. See load_overrides.
+
+        Raises:
+            OSError: If the override file cannot be read
+            ValueError: If the override file is invalid
         """
         self.city_db_path = city_db_path or get_database_path(
             "city", download_if_missing=download_if_missing
@@ -44,10 +161,222 @@ class GeoIPLookup:
         self.asn_db_path = asn_db_path or get_database_path(
             "asn", download_if_missing=download_if_missing
         )
+        self._city_tree: Optional[SearchTree] = None
+        self._asn_tree: Optional[SearchTree] = None
+        self._reverse_index: Optional[ReverseIndex] = None
+        self._load_lock = threading.Lock()
+        self.special_ranges = special_ranges
+        self.materialize_json = materialize_json
+        self._json_records: Dict[Tuple[int, int], bytes] = {}
+        # Results serialized on first use, up to decode_cache_size of them
+        self._json_kept: Dict[Tuple[int, int], bytes] = {}
+        self._json_kept_limit = decode_cache_size
+
+        # Record offsets are only meaningful for the loaded databases, so these
+        # caches are cleared whenever the databases are closed
+        self._city_part = lru_cache(maxsize=decode_cache_size)(self._build_city_part)
+        self._asn_part = lru_cache(maxsize=decode_cache_size)(self._build_asn_part)
+        self._result_for = lru_cache(maxsize=decode_cache_size)(self._build_result)
+        self._json_for = lru_cache(maxsize=decode_cache_size)(self._build_json)
+        # Keyed by the fields of the results and overrides, so these stay
+        # valid when either the databases or the overrides are replaced
+        self._overridden = lru_cache(maxsize=decode_cache_size)(self._build_overridden)
+        self._overridden_json = lru_cache(maxsize=decode_cache_size)(
+            self._build_overridden_json
+        )
+
+        self.overrides_path = overrides_path
+        self._overrides: Optional[OverrideTable] = None
+        # Networks affected by the last replacement of the overrides
+        self.override_changes: Optional[OverrideChanges] = None
+        if overrides_path:
+            self.load_overrides(overrides_path)
         logger.debug(
             f"Initialized GeoIPLookup with city_db={self.city_db_path}, asn_db={self.asn_db_path}"
         )
 
+    def load(self) -> None:
+        """
+        Map the database search trees.
+
+        This happens on first use if not called explicitly.
+        """
+        with self._load_lock:
+            if self._city_tree is None:
+                self._city_tree = SearchTree(self.city_db_path)
+            if self._asn_tree is None:
+                self._asn_tree = SearchTree(self.asn_db_path)
+            if self.materialize_json and not self._json_records:
+                self._json_records = self._materialize_json(
+                    self._city_tree, self._asn_tree
+                )
+
+    def load_overrides(self, path: Optional[str] = None) -> None:
+        """
+        Compile an override file and apply it to all subsequent lookups.
+
+        The file is a JSON object of result fields by network, e.g.
+        ``{"10.0.0.0/8": {"country": "Internal"}}``. Fields not given keep
+        their database values, and nested networks inherit the fields of the
+        networks enclosing them. Overrides apply to lookup, lookup_many,
+        lookup_json, lookup_with_network, aggregate, lookup_network,
+        networks_for_asn and networks_for_country, and change the epoch. They
+        do not apply to diff, which compares database builds only; the
+        networks whose override changed are kept in override_changes instead.
+
+        Lookups in progress finish with the previous overrides, so this can
+        be called at any time to replace them.
+
+        Args:
+            path: Override file, by default the one loaded before
+
+        Raises:
+            OSError: If the file cannot be read
+            ValueError: If the file is invalid
+        """
+        path = path or self.overrides_path
+        if not path:
+            raise ValueError("No override file configured")
+        overrides = OverrideTable.load(path)
+        changes = overrides.changes_since(self._overrides)
+        self.overrides_path = path
+        self._overrides = overrides
+        self.override_changes = changes
+        logger.info(f"Loaded {len(overrides)} overrides from {path}")
+
+    def reload_overrides(self) -> bool:
+        """
+        Reload the override file if it changed since it was loaded.
+
+        An invalid file is logged and the current overrides are kept.
+
+        Returns:
+            Whether new overrides were loaded
+        """
+        current = self._overrides
+        if not self.overrides_path:
+            return False
+        try:
+            stat = os.stat(self.overrides_path)
+            if current is not None and current.stamp == (
+                stat.st_mtime_ns,
+                stat.st_size,
+            ):
+                return False
+            self.load_overrides()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to reload overrides {self.overrides_path}: {e}")
+            return False
+        return True
+
+    @property
+    def reverse_index(self) -> ReverseIndex:
+        """Reverse index over the loaded databases, built lazily."""
+        if self._reverse_index is None:
+            self.load()
+            assert self._city_tree is not None and self._asn_tree is not None
+            with self._load_lock:
+                if self._reverse_index is None:
+                    self._reverse_index = ReverseIndex(self._city_tree, self._asn_tree)
+        return self._reverse_index
+
+    def warm_up(
+        self, mode: str = "madvise", sample_ips: Optional[Iterable[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Prefetch the databases and optionally replay sample lookups.
+
+        Args:
+            mode: Prefetch mode, "madvise", "read" or "none"
+            sample_ips: IP addresses to look up once to warm internal caches.
+                Invalid addresses are skipped.
+
+        Returns:
+            Dictionary with the bytes prefetched, lookups replayed and the
+            time taken in seconds
+        """
+        start = time.perf_counter()
+        self.load()
+        assert self._city_tree is not None and self._asn_tree is not None
+
+        prefetched = 0
+        if mode != "none":
+            for tree in (self._city_tree, self._asn_tree):
+                prefetched += tree.prefetch(mode)
+
+        replayed = 0
+        for ip in sample_ips or ():
+            try:
+                self.lookup(ip)
+                replayed += 1
+            except (InvalidIPError, LookupError):
+                continue
+
+        stats = {
+            "mode": mode,
+            "bytes_prefetched": prefetched,
+            "lookups_replayed": replayed,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        logger.info(f"Warm-up finished: {stats}")
+        return stats
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Report the state of the loaded databases without doing a lookup.
+
+        Returns:
+            Dictionary describing each database and the reverse index
+        """
+        databases = {}
+        for name, path, tree in (
+            ("city", self.city_db_path, self._city_tree),
+            ("asn", self.asn_db_path, self._asn_tree),
+        ):
+            databases[name] = {
+                "path": path,
+                "loaded": tree is not None,
+                "build_epoch": tree.build_epoch if tree is not None else None,
+            }
+
+        index = self._reverse_index
+        return {
+            "databases": databases,
+            "reverse_index": {
+                "asn": index is not None and index.has_asn_index,
+                "country": index is not None and index.has_country_index,
+            },
+            "caches": {
+                name: cache.cache_info()._asdict()
+                for name, cache in (
+                    ("results", self._result_for),
+                    ("city_records", self._city_part),
+                    ("asn_records", self._asn_part),
+                    ("json", self._json_for),
+                    ("overridden", self._overridden),
+                )
+            },
+            "materialized_json": len(self._json_records),
+            "overrides": {
+                "path": self.overrides_path,
+                "networks": len(self._overrides or ()),
+                "digest": self._overrides.digest if self._overrides else None,
+            },
+        }
+
+    def close(self) -> None:
+        """Release the mapped databases and any indexes built over them."""
+        with self._load_lock:
+            for tree in (self._city_tree, self._asn_tree):
+                if tree is not None:
+                    tree.close()
+            self._city_tree = None
+            self._asn_tree = None
+            self._reverse_index = None
+            self._json_records = {}
+            self._json_kept = {}
+            self._clear_caches()
+
     def validate_ip(self, ip_address: str) -> None:
         """
         Validate that the provided string is a valid IP address.
@@ -58,87 +387,613 @@ class GeoIPLookup:
         Raises:
             InvalidIPError: If the IP address is invalid
         """
+        self._parse_ip(ip_address)
+
+    def _parse_ip(self, ip_address: Union[str, ParsedIP]) -> ParsedIP:
+        if isinstance(ip_address, ParsedIP):
+            return ip_address
         try:
-            ipaddress.ip_address(ip_address)
+            return parse_ip(ip_address)
         except ValueError as e:
             logger.warning(f"Invalid IP address: {ip_address}")
             raise InvalidIPError(f"Invalid IP address: {ip_address}") from e
 
-    def lookup(self, ip_address: str) -> Dict[str, Any]:
+    @overload
+    def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: Literal[True] = ...
+    ) -> Dict[str, Any]: ...
+
+    @overload
+    def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: Literal[False]
+    ) -> GeoResult: ...
+
+    def lookup(
+        self, ip_address: Union[str, ParsedIP], as_dict: bool = True
+    ) -> Union[Dict[str, Any], GeoResult]:
         """
         Look up geolocation information for an IP address.
 
         Args:
-            ip_address: IP address to look up
+            ip_address: IP address to look up, as a string or a ParsedIP,
+                which is not validated again
+            as_dict: Return a dictionary (the default) or a typed GeoResult,
+                which is much smaller when many results are held at once
+
+        Returns:
+            Dictionary or GeoResult containing geolocation information
+
+        Raises:
+            InvalidIPError: If the IP address is invalid
+            LookupError: If the lookup fails
+        """
+        result, _ = self._lookup_address(self._parse_ip(ip_address))
+        return result._asdict() if as_dict else result
+
+    @overload
+    def lookup_many(
+        self,
+        ip_addresses: Iterable[Union[str, ParsedIP]],
+        as_dict: Literal[True] = ...,
+    ) -> List[Optional[Dict[str, Any]]]: ...
+
+    @overload
+    def lookup_many(
+        self, ip_addresses: Iterable[Union[str, ParsedIP]], as_dict: Literal[False]
+    ) -> List[Optional[GeoResult]]: ...
+
+    def lookup_many(
+        self, ip_addresses: Iterable[Union[str, ParsedIP]], as_dict: bool = True
+    ) -> Union[List[Optional[Dict[str, Any]]], List[Optional[GeoResult]]]:
+        """
+        Look up many IP addresses in one pass.
+
+        Duplicate addresses are only looked up once, and an invalid address
+        does not abort the batch.
+
+        Args:
+            ip_addresses: IP addresses to look up, as strings or ParsedIPs
+            as_dict: Return dictionaries (the default) or typed GeoResults
+
+        Returns:
+            One result per input address, in input order, None where the
+            address is invalid
+
+        Raises:
+            LookupError: If a lookup fails
+        """
+        if self._city_tree is None or self._asn_tree is None:
+            self.load()
+
+        seen: Dict[Union[str, ParsedIP], Optional[GeoResult]] = {}
+        results: List[Optional[GeoResult]] = []
+        for ip_address in ip_addresses:
+            if ip_address in seen:
+                results.append(seen[ip_address])
+                continue
+            try:
+                address = self._parse_ip(ip_address)
+            except InvalidIPError:
+                result = None
+            else:
+                result, _ = self._lookup_address(address)
+            seen[ip_address] = result
+            results.append(result)
+
+        if as_dict:
+            return [r._asdict() if r is not None else None for r in results]
+        return results
+
+    def aggregate(
+        self,
+        ip_addresses: Iterable[Union[str, ParsedIP]],
+        group_by: Sequence[str] = ("country",),
+        top: Optional[int] = None,
+        distinct: Sequence[str] = (),
+        batch_size: int = 4096,
+    ) -> Dict[str, Any]:
+        """
+        Count the results of many IP addresses by a set of fields.
+
+        Addresses are looked up in batches through lookup_many and only the
+        counts are kept, so the input can be any iterable, including a file
+        too large to hold in memory.
+
+        Args:
+            ip_addresses: IP addresses to look up
+            group_by: Result fields to group by, e.g. ("country", "asn")
+            top: Only return the largest groups, with the addresses of the
+                remaining groups counted under "other"
+            distinct: Fields to estimate the number of distinct values of,
+                with a HyperLogLog. "ip" counts distinct addresses.
+            batch_size: Addresses looked up per batch
+
+        Returns:
+            Dictionary with the "total" and "invalid" address counts, the
+            "groups" as dictionaries of the group-by fields and a "count", in
+            descending order of count, and the "distinct" estimates if any
+
+        Raises:
+            ValueError: If a field is unknown
+        """
+        aggregator = Aggregator(self, group_by, distinct)
+        batch: List[Union[str, ParsedIP]] = []
+        for ip_address in ip_addresses:
+            batch.append(ip_address)
+            if len(batch) >= batch_size:
+                aggregator.add(batch)
+                batch = []
+        if batch:
+            aggregator.add(batch)
+        return aggregator.result(top)
+
+    def lookup_with_network(
+        self, ip_address: Union[str, ParsedIP]
+    ) -> Tuple[GeoResult, IPNetwork]:
+        """
+        Look up an IP address along with the network its result applies to.
+
+        Every address in the returned network has the same result, which lets
+        callers cache results per network instead of per address.
+
+        Args:
+            ip_address: IP address to look up, as a string or a ParsedIP
+
+        Returns:
+            Tuple of (GeoResult, network)
+
+        Raises:
+            InvalidIPError: If the IP address is invalid
+            LookupError: If the lookup fails
+        """
+        address = self._parse_ip(ip_address)
+        result, prefix_len = self._lookup_address(address)
+        network: IPNetwork
+        if address.version == 4:
+            network = ipaddress.IPv4Network((address.value, prefix_len), strict=False)
+        else:
+            network = ipaddress.IPv6Network((address.value, prefix_len), strict=False)
+        return result, network
+
+    @property
+    def database_epoch(self) -> str:
+        """
+        Identifier of the loaded database builds, ignoring any overrides.
+
+        Changes whenever either database is replaced by a new build.
+        """
+        if self._city_tree is None or self._asn_tree is None:
+            self.load()
+        assert self._city_tree is not None and self._asn_tree is not None
+        return f"{self._city_tree.build_epoch}-{self._asn_tree.build_epoch}"
+
+    @property
+    def epoch(self) -> str:
+        """
+        Identifier of the results: the database epoch, followed by the digest
+        of the overrides if any are loaded.
+
+        Changes whenever either database or the overrides are replaced.
+        """
+        overrides = self._overrides
+        epoch = self.database_epoch
+        return f"{epoch}-{overrides.digest}" if overrides else epoch
+
+    def lookup_json(self, ip_address: Union[str, ParsedIP]) -> bytes:
+        """
+        Look up an IP address and return the result serialized as JSON.
+
+        The body is the JSON object of ``lookup(ip_address)`` with the "ip" key
+        first, identical to the API response. Each distinct result is only
+        serialized once, so a lookup costs the tree search plus copying in the
+        address.
+
+        Args:
+            ip_address: IP address to look up, as a string or a ParsedIP
+
+        Returns:
+            UTF-8 encoded JSON object
+
+        Raises:
+            InvalidIPError: If the IP address is invalid
+            LookupError: If the lookup fails
+        """
+        body = self._lookup_json(self._parse_ip(ip_address), serialize=True)
+        assert body is not None
+        return body
+
+    def cached_json(self, ip_address: Union[str, ParsedIP]) -> Optional[bytes]:
+        """
+        Look up an IP address as lookup_json does, if its result is serialized.
+
+        This never serializes a result, so it is cheap enough to call where
+        blocking must be brief, such as an event loop, with lookup_json as the
+        fallback elsewhere.
 
         Returns:
-            Dictionary containing geolocation information
+            UTF-8 encoded JSON object, or None if the result of the address
+            has not been serialized yet
 
         Raises:
             InvalidIPError: If the IP address is invalid
             LookupError: If the lookup fails
         """
-        self.validate_ip(ip_address)
+        return self._lookup_json(self._parse_ip(ip_address), serialize=False)
+
+    def _lookup_json(self, address: ParsedIP, serialize: bool) -> Optional[bytes]:
+        overrides = self._overrides
+        if overrides is not None:
+            override, _ = overrides.find(address)
+            if override is not None:
+                if not serialize:
+                    return None
+                result, _ = self._search(address)
+                overridden = self._overridden_json(result, override.fields)
+                return splice_ip(overridden, address.text)
+
+        if self.special_ranges:
+            special = special_range(address)
+            if special is not None:
+                return splice_ip(SPECIAL_JSON[special.kind], address.text)
 
         try:
-            logger.info(f"Looking up IP address: {ip_address}")
-            geo_details = {}
-
-            # Get city information
-            with geoip2.database.Reader(self.city_db_path) as city_reader:
-                try:
-                    city_response = city_reader.city(ip_address)
-                    country_code = city_response.country.iso_code
-                    geo_details.update(
-                        {
-                            "code": country_code,
-                            "country": city_response.country.name,
-                            "continent": city_response.continent.name,
-                            "continent_code": city_response.continent.code,
-                            "city": city_response.city.name,
-                            "lat": city_response.location.latitude,
-                            "lon": city_response.location.longitude,
-                            "tz": city_response.location.time_zone,
-                        }
-                    )
-
-                    # Add currency information
-                    currency_code = get_currency_for_country(country_code)
-                    geo_details["currency"] = currency_code
-
-                except AddressNotFoundError:
-                    logger.warning(f"City information not found for IP: {ip_address}")
-                    geo_details.update(
-                        {
-                            "code": None,
-                            "country": None,
-                            "continent": None,
-                            "continent_code": None,
-                            "city": None,
-                            "lat": None,
-                            "lon": None,
-                            "tz": None,
-                            "currency": None,
-                        }
-                    )
-
-            # Get ASN information
-            with geoip2.database.Reader(self.asn_db_path) as asn_reader:
-                try:
-                    asn_response = asn_reader.asn(ip_address)
-                    geo_details.update(
-                        {
-                            "isp": asn_response.autonomous_system_organization,
-                            "asn": asn_response.autonomous_system_number,
-                        }
-                    )
-                except AddressNotFoundError:
-                    logger.warning(f"ASN information not found for IP: {ip_address}")
-                    geo_details.update({"isp": None, "asn": None})
+            city_offset, asn_offset, _ = self._find_offsets(address)
+            key = (city_offset, asn_offset)
+            fragment = self._json_records.get(key) or self._json_kept.get(key)
+            if fragment is None:
+                if not serialize:
+                    return None
+                fragment = self._json_for(city_offset, asn_offset)
+                kept = self._json_kept
+                if len(kept) < self._json_kept_limit:
+                    kept[key] = fragment
+            return splice_ip(fragment, address.text)
+        except Exception as e:
+            logger.error(f"Error looking up IP {address.text}: {e}")
+            raise LookupError(f"Error looking up IP {address.text}: {e}") from e
 
+    def _lookup_address(self, address: ParsedIP) -> Tuple[GeoResult, int]:
+        """
+        Look up a parsed address, applying any override.
+
+        Returns:
+            Tuple of (GeoResult, prefix length of the network it applies to)
+        """
+        overrides = self._overrides
+        if overrides is None:
+            return self._search(address)
+
+        # The overrides are checked along with the databases, and the result
+        # applies to the smaller of the networks found in each
+        override, override_prefix = overrides.find(address)
+        result, prefix_len = self._search(address)
+        if override is not None:
+            result = self._overridden(result, override.fields)
+        return result, max(prefix_len, override_prefix)
+
+    def _search(self, address: ParsedIP) -> Tuple[GeoResult, int]:
+        """
+        Search both trees for a parsed address.
+
+        Returns:
+            Tuple of (GeoResult, prefix length of the network it applies to)
+        """
+        if self.special_ranges:
+            special = special_range(address)
+            if special is not None:
+                logger.debug(f"{address.text} is in {special.name} {special.network}")
+                return SPECIAL_RESULTS[special.kind], special.prefix_len
+
+        ip_address = address.text
+        try:
+            city_offset, asn_offset, prefix_len = self._find_offsets(address)
+            result = self._result_for(city_offset, asn_offset)
             logger.info(f"Lookup successful for IP: {ip_address}")
-            return geo_details
+            return result, prefix_len
 
         except Exception as e:
             logger.error(f"Error looking up IP {ip_address}: {e}")
             raise LookupError(f"Error looking up IP {ip_address}: {e}") from e
+
+    def _find_offsets(self, address: ParsedIP) -> Tuple[int, int, int]:
+        """
+        Find the records of a parsed address in both trees.
+
+        Returns:
+            Tuple of (City record offset, ASN record offset, prefix length of
+            the network the joined result applies to)
+        """
+        ip_address = address.text
+        logger.info(f"Looking up IP address: {ip_address}")
+        if self._city_tree is None or self._asn_tree is None:
+            self.load()
+        assert self._city_tree is not None and self._asn_tree is not None
+
+        city_offset, city_prefix = self._city_tree.find(address.value, address.version)
+        asn_offset, asn_prefix = self._asn_tree.find(address.value, address.version)
+        if not city_offset:
+            logger.warning(f"City information not found for IP: {ip_address}")
+        if not asn_offset:
+            logger.warning(f"ASN information not found for IP: {ip_address}")
+
+        # The joined result applies to the more specific of both networks
+        return city_offset, asn_offset, max(city_prefix, asn_prefix)
+
+    def _build_result(self, city_offset: int, asn_offset: int) -> GeoResult:
+        """Join the city and ASN parts of the records at the given offsets."""
+        return make_result(
+            {**self._city_part(city_offset), **self._asn_part(asn_offset)}
+        )
+
+    def _build_json(self, city_offset: int, asn_offset: int) -> bytes:
+        """Serialize the joined result of the records at the given offsets."""
+        return self._result_for(city_offset, asn_offset).to_json()
+
+    def _build_overridden(
+        self, result: GeoResult, fields: Tuple[Tuple[str, Any], ...]
+    ) -> GeoResult:
+        """Replace the fields of a result with those of an override."""
+        return make_result({**result._asdict(), **dict(fields)})
+
+    def _build_overridden_json(
+        self, result: GeoResult, fields: Tuple[Tuple[str, Any], ...]
+    ) -> bytes:
+        """Serialize a result with the fields of an override."""
+        return self._overridden(result, fields).to_json()
+
+    def _materialize_json(
+        self, city_tree: SearchTree, asn_tree: SearchTree
+    ) -> Dict[Tuple[int, int], bytes]:
+        """Serialize the joined result of every network in both trees."""
+        logger.info("Materializing JSON results")
+        start = time.perf_counter()
+        records: Dict[Tuple[int, int], bytes] = {}
+        for _, (city_offset, asn_offset) in walk_networks([city_tree, asn_tree]):
+            key = (city_offset, asn_offset)
+            if key not in records:
+                result = self._build_result(city_offset, asn_offset)
+                records[key] = result.to_json()
+        # Addresses found in neither database
+        records[(0, 0)] = self._build_result(0, 0).to_json()
+        logger.info(
+            f"Materialized {len(records)} JSON results "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+        return records
+
+    def _build_city_part(self, offset: int) -> Dict[str, Any]:
+        """Decode and post-process the City record at an offset."""
+        if not offset:
+            return EMPTY_CITY_FIELDS
+        assert self._city_tree is not None
+        return city_fields(self._city_tree.decode(offset))
+
+    def _build_asn_part(self, offset: int) -> Dict[str, Any]:
+        """Decode and post-process the ASN record at an offset."""
+        if not offset:
+            return EMPTY_ASN_FIELDS
+        assert self._asn_tree is not None
+        return asn_fields(self._asn_tree.decode(offset))
+
+    def _clear_caches(self) -> None:
+        self._result_for.cache_clear()
+        self._json_for.cache_clear()
+        self._city_part.cache_clear()
+        self._asn_part.cache_clear()
+        self._overridden.cache_clear()
+        self._overridden_json.cache_clear()
+
+    def networks_for_asn(self, asn: int) -> Iterator[str]:
+        """
+        List all networks announced by an autonomous system.
+
+        The reverse index is built on first use and kept until the databases
+        are closed, so subsequent queries only iterate over the result.
+        Overrides of the ASN are applied to the indexed networks as they are
+        listed.
+
+        Args:
+            asn: Autonomous system number
+
+        Returns:
+            Iterator over the networks in CIDR notation, in address order
+        """
+        prefixes = self.reverse_index.networks_for_asn(asn)
+        networks = self._overridden_networks(prefixes or (), "asn", asn)
+        return (str(network) for network in networks)
+
+    def networks_for_country(self, country_code: str) -> Iterator[str]:
+        """
+        List all networks located in a country.
+
+        Args:
+            country_code: ISO 3166-1 alpha-2 country code
+
+        Returns:
+            Iterator over the networks in CIDR notation, in address order
+        """
+        code = country_code.upper()
+        prefixes = self.reverse_index.networks_for_country(code)
+        networks = self._overridden_networks(prefixes or (), "code", code)
+        return (str(network) for network in networks)
+
+    def lookup_network(self, cidr: str) -> Iterator[Dict[str, Any]]:
+        """
+        Look up every distinct database network inside a CIDR block.
+
+        The City and ASN trees are walked together from the node covering the
+        block, so each network is visited once and the cost grows with the
+        number of networks rather than the number of addresses. Networks are
+        split where an override starts or ends, and overridden the same way as
+        single lookups. Networks with no data in either database and no
+        override are skipped.
+
+        Args:
+            cidr: Network in CIDR notation, e.g. "10.0.0.0/8" or "2001:db8::/32"
+
+        Returns:
+            Iterator over result dictionaries in address order, each with a
+            "network" key in addition to the usual lookup fields
+
+        Raises:
+            InvalidIPError: If the CIDR block is invalid
+        """
+        try:
+            network = ipaddress.ip_network(cidr, strict=False)
+        except ValueError as e:
+            logger.warning(f"Invalid network: {cidr}")
+            raise InvalidIPError(f"Invalid network: {cidr}") from e
+
+        self.load()
+        assert self._city_tree is not None and self._asn_tree is not None
+        return self._iter_network(self._city_tree, self._asn_tree, network)
+
+    def diff(self, previous: "GeoIPLookup") -> DatabaseDiff:
+        """
+        Find the networks whose result changed since a previous build.
+
+        Both builds are walked together once, so this takes time in the order
+        of materializing every result, but only keeps the changed networks.
+        Overrides are ignored, as they are not part of either build; see
+        override_changes for the networks whose override changed.
+
+        Args:
+            previous: Lookup over the previous build of the databases
+
+        Returns:
+            The changed networks, from the previous build to this one
+        """
+        self.load()
+        previous.load()
+        assert self._city_tree is not None and self._asn_tree is not None
+        assert previous._city_tree is not None and previous._asn_tree is not None
+
+        old_epoch, new_epoch = previous.database_epoch, self.database_epoch
+        logger.info(f"Comparing databases {old_epoch} and {new_epoch}")
+        changed, stats = diff_trees(
+            (previous._city_tree, previous._asn_tree),
+            (self._city_tree, self._asn_tree),
+            previous._result_for,
+            self._result_for,
+            special_ranges=self.special_ranges,
+        )
+        return DatabaseDiff(old_epoch, new_epoch, changed, stats)
+
+    def _iter_network(
+        self, city_tree: SearchTree, asn_tree: SearchTree, network: IPNetwork
+    ) -> Iterator[Dict[str, Any]]:
+        logger.info(f"Looking up network: {network}")
+        overrides = self._overrides
+        cursor = int(network.network_address)
+        for subnet, (city_offset, asn_offset) in walk_networks(
+            [city_tree, asn_tree], network
+        ):
+            result = self._result_for(city_offset, asn_offset)
+            if overrides is None:
+                yield {"network": str(subnet), **result._asdict()}
+                continue
+            # Overrides also cover addresses found in neither database
+            first, last = int(subnet.network_address), int(subnet.broadcast_address)
+            yield from self._iter_overridden(
+                overrides, network.version, cursor, first - 1, None
+            )
+            yield from self._iter_overridden(
+                overrides, subnet.version, first, last, result
+            )
+            cursor = last + 1
+        if overrides is not None:
+            yield from self._iter_overridden(
+                overrides,
+                network.version,
+                cursor,
+                int(network.broadcast_address),
+                None,
+            )
+
+    def _iter_overridden(
+        self,
+        overrides: OverrideTable,
+        version: int,
+        first: int,
+        last: int,
+        result: Optional[GeoResult],
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Apply the overrides to a range of addresses of a walked network.
+
+        Args:
+            overrides: Overrides to apply
+            version: IP version of the range
+            first: First address of the range as an integer
+            last: Last address of the range as an integer
+            result: Database result of the range, or None if neither database
+                has a record there, in which case only overridden addresses
+                are yielded
+        """
+        if version == 6 and first < 1 << 32:
+            # IPv6 trees hold the IPv4 addresses under ::/96
+            yield from self._iter_overridden(
+                overrides, 4, first, min(last, (1 << 32) - 1), result
+            )
+            first = 1 << 32
+        empty = self._result_for(0, 0)
+        for start, end, override in overrides.split(version, first, last):
+            if override is None and result is None:
+                continue
+            piece = result if result is not None else empty
+            if override is not None:
+                piece = self._overridden(piece, override.fields)
+            for subnet in range_networks(version, start, end):
+                yield {"network": str(subnet), **piece._asdict()}
+
+    def _overridden_networks(
+        self, networks: Iterable[IPNetwork], field: str, key: Any
+    ) -> Iterator[IPNetwork]:
+        """
+        Apply the overrides to the networks of a reverse index entry.
+
+        Overrides that set the indexed field take their addresses out of the
+        database networks, and add them back if they set it to the key.
+
+        Args:
+            networks: Networks of the key in the databases, in address order
+            field: Result field of the key, "asn" or "code"
+            key: Indexed value of the field
+        """
+        overrides = self._overrides
+        if overrides is None:
+            return iter(networks)
+
+        def matches(fields: Tuple[Tuple[str, Any], ...]) -> Optional[bool]:
+            # None if the override leaves the field to the databases
+            values = dict(fields)
+            if field not in values:
+                return None
+            value = values[field]
+            if field == "code" and isinstance(value, str):
+                value = value.upper()
+            return value == key
+
+        def kept() -> Iterator[IPNetwork]:
+            for network in networks:
+                first = int(network.network_address)
+                last = int(network.broadcast_address)
+                pieces = list(overrides.split(network.version, first, last))
+                if all(o is None or matches(o.fields) is None for *_, o in pieces):
+                    yield network
+                    continue
+                for start, end, override in pieces:
+                    if override is None or matches(override.fields) is None:
+                        yield from range_networks(network.version, start, end)
+
+        def added() -> Iterator[IPNetwork]:
+            for version, bits in ((4, 32), (6, 128)):
+                for start, end, override in overrides.split(version, 0, 2**bits - 1):
+                    if override is not None and matches(override.fields):
+                        yield from range_networks(version, start, end)
+
+        return heapq.merge(
+            kept(),
+            added(),
+            key=lambda n: (n.version, int(n.network_address)),
+        )
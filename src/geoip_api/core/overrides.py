@@ -0,0 +1,293 @@
+"""
+Local overrides of lookup results.
+
+An override file maps networks to the result fields that replace the ones
+found in the databases, for corrections such as internal ranges or
+mis-geolocated blocks:
+
+    {
+        "10.0.0.0/8": {"country": "Internal", "special": null},
+        "203.0.113.0/24": {"code": "AU", "country": "Australia", "city": "Brisbane"}
+    }
+
+The file is compiled into sorted, non-overlapping address ranges per IP
+version, each holding the most specific override covering it, so the longest
+prefix match of an address is a single bisection: logarithmic in the number of
+overrides, and never more steps than prefix bits. Nested overrides inherit the
+fields of the networks enclosing them, and an override of the country code also
+sets the currency unless it is given.
+"""
+
+import hashlib
+import ipaddress
+import json
+import os
+from bisect import bisect_right
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from geoip_api.core.address import NetworkSet, ParsedIP, range_networks
+from geoip_api.core.result import GeoResult
+from geoip_api.utils.currency import get_currency_for_country
+
+# Field types accepted in override files, besides None
+_FIELD_TYPES: Dict[str, Tuple[type, ...]] = {
+    name: (
+        (int, float) if name in ("lat", "lon") else (int,) if name == "asn" else (str,)
+    )
+    for name in GeoResult._fields
+}
+
+_BITS = {4: 32, 6: 128}
+
+
+class Override(NamedTuple):
+    """The fields an override replaces, including the ones it inherits."""
+
+    network: str
+    fields: Tuple[Tuple[str, Any], ...]
+
+
+class OverrideChanges(NamedTuple):
+    """The networks whose override differs between two sets of overrides."""
+
+    old_digest: str
+    new_digest: str
+    changed: NetworkSet
+
+
+class OverrideTable:
+    """
+    Overrides compiled for longest-prefix matching.
+
+    Attributes:
+        path: File the overrides were read from, if any
+        digest: Hash of the overrides, which changes with their content
+        stamp: Modification time and size of the file when it was read
+    """
+
+    def __init__(
+        self,
+        rules: Mapping[str, Mapping[str, Any]],
+        path: Optional[str] = None,
+        stamp: Optional[Tuple[int, int]] = None,
+    ):
+        """
+        Compile a set of overrides.
+
+        Args:
+            rules: Result fields to replace, by network in CIDR notation;
+                plain addresses are single hosts
+            path: File the overrides were read from
+            stamp: Modification time and size of that file
+
+        Raises:
+            ValueError: If a network, field or value is invalid
+        """
+        self.path = path
+        self.stamp = stamp
+
+        canonical: Dict[Any, Dict[str, Any]] = {}
+        for cidr, fields in rules.items():
+            try:
+                network = ipaddress.ip_network(cidr.strip(), strict=False)
+            except ValueError as e:
+                raise ValueError(f"Invalid override network: {cidr}") from e
+            canonical[network] = _check_fields(cidr, fields)
+        self.digest = hashlib.sha256(
+            json.dumps(
+                {str(n): f for n, f in canonical.items()}, sort_keys=True
+            ).encode()
+        ).hexdigest()[:12]
+
+        by_version: Dict[int, List[Any]] = {4: [], 6: []}
+        for network in canonical:
+            by_version[network.version].append(network)
+        self._count = len(canonical)
+        # First address and override of every range, covering all addresses
+        self._firsts: Dict[int, List[int]] = {}
+        self._overrides: Dict[int, List[Optional[Override]]] = {}
+        for version, networks in by_version.items():
+            self._firsts[version], self._overrides[version] = _flatten(
+                networks, canonical, _BITS[version]
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "OverrideTable":
+        """
+        Read and compile an override file.
+
+        Raises:
+            OSError: If the file cannot be read
+            ValueError: If the file is not a valid override file
+        """
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            try:
+                rules = json.load(f)
+            except ValueError as e:
+                raise ValueError(f"Invalid override file {path}: {e}") from e
+        if not isinstance(rules, dict):
+            raise ValueError(f"Invalid override file {path}: expected an object")
+        return cls(rules, path, (stat.st_mtime_ns, stat.st_size))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def find(self, address: ParsedIP) -> Tuple[Optional[Override], int]:
+        """
+        Find the most specific override of an address.
+
+        Args:
+            address: Parsed IP address
+
+        Returns:
+            Tuple of (override, or None, prefix length of the largest network
+            around the address that all has the same override)
+        """
+        firsts = self._firsts[address.version]
+        value = address.value
+        i = bisect_right(firsts, value) - 1
+        # The network must exclude the addresses either side of the range
+        bits = _BITS[address.version]
+        prefix_len = 0
+        if i:
+            prefix_len = bits + 1 - (value ^ (firsts[i] - 1)).bit_length()
+        if i + 1 < len(firsts):
+            after = bits + 1 - (value ^ firsts[i + 1]).bit_length()
+            prefix_len = max(prefix_len, after)
+        return self._overrides[address.version][i], prefix_len
+
+    def split(
+        self, version: int, first: int, last: int
+    ) -> Iterator[Tuple[int, int, Optional[Override]]]:
+        """
+        Split a range of addresses wherever its override changes.
+
+        Args:
+            version: IP version of the range
+            first: First address of the range as an integer
+            last: Last address of the range as an integer
+
+        Yields:
+            Tuples of (first address, last address, override or None) of
+            consecutive ranges covering the given one
+        """
+        firsts, overrides = self._firsts[version], self._overrides[version]
+        i = bisect_right(firsts, first) - 1
+        while first <= last:
+            end = last
+            if i + 1 < len(firsts):
+                end = min(end, firsts[i + 1] - 1)
+            yield first, end, overrides[i]
+            first = end + 1
+            i += 1
+
+    def changes_since(self, previous: Optional["OverrideTable"]) -> OverrideChanges:
+        """
+        Compare these overrides with the ones they replace.
+
+        Args:
+            previous: The replaced overrides, or None if there were none
+
+        Returns:
+            The networks whose override was added, removed or changed
+        """
+        changed: List[str] = []
+        for version, bits in _BITS.items():
+            new_firsts, new_overrides = self._firsts[version], self._overrides[version]
+            old_firsts: List[int] = [0]
+            old_overrides: List[Optional[Override]] = [None]
+            if previous is not None:
+                old_firsts = previous._firsts[version]
+                old_overrides = previous._overrides[version]
+
+            # Every boundary of either set starts a range where both are uniform
+            boundaries = sorted(set(old_firsts) | set(new_firsts))
+            for i, first in enumerate(boundaries):
+                old = old_overrides[bisect_right(old_firsts, first) - 1]
+                new = new_overrides[bisect_right(new_firsts, first) - 1]
+                if _fields_of(old) == _fields_of(new):
+                    continue
+                last = boundaries[i + 1] - 1 if i + 1 < len(boundaries) else 2**bits - 1
+                changed += map(str, range_networks(version, first, last))
+        return OverrideChanges(
+            previous.digest if previous is not None else "",
+            self.digest,
+            NetworkSet(changed),
+        )
+
+
+def _fields_of(override: Optional[Override]) -> Optional[Dict[str, Any]]:
+    return None if override is None else dict(override.fields)
+
+
+def _flatten(
+    networks: List[Any], fields: Dict[Any, Dict[str, Any]], bits: int
+) -> Tuple[List[int], List[Optional[Override]]]:
+    """
+    Resolve nested networks into ranges with their most specific override.
+
+    Networks are either nested or disjoint, so a sweep in address order, with
+    enclosing networks first, keeps the networks around the current address on
+    a stack.
+
+    Returns:
+        Tuple of (first address of each range, override of each range)
+    """
+    firsts: List[int] = []
+    overrides: List[Optional[Override]] = []
+
+    def emit(first: int, override: Optional[Override]) -> None:
+        # Neighbouring ranges with the same override are merged
+        if not overrides or overrides[-1] is not override:
+            firsts.append(first)
+            overrides.append(override)
+
+    # (last address, override) of the networks enclosing the current address
+    stack: List[Tuple[int, Override]] = []
+    cursor = 0
+    for network in sorted(networks, key=lambda n: (int(n[0]), n.prefixlen)):
+        first, last = int(network[0]), int(network[-1])
+        while stack and stack[-1][0] < first:
+            end, override = stack.pop()
+            if cursor <= end:
+                emit(cursor, override)
+                cursor = end + 1
+        if cursor < first:
+            emit(cursor, stack[-1][1] if stack else None)
+        cursor = first
+
+        inherited = dict(stack[-1][1].fields) if stack else {}
+        override = Override(
+            str(network), tuple({**inherited, **fields[network]}.items())
+        )
+        stack.append((last, override))
+
+    while stack:
+        end, override = stack.pop()
+        if cursor <= end:
+            emit(cursor, override)
+            cursor = end + 1
+    if cursor < 1 << bits:
+        emit(cursor, None)
+    return firsts, overrides
+
+
+def _check_fields(cidr: str, fields: Any) -> Dict[str, Any]:
+    """Validate the fields of one override."""
+    if not isinstance(fields, dict):
+        raise ValueError(f"Override {cidr} must be an object of result fields")
+    for name, value in fields.items():
+        if name not in _FIELD_TYPES:
+            raise ValueError(f"Override {cidr} has an unknown field: {name}")
+        valid = isinstance(value, _FIELD_TYPES[name]) and not isinstance(value, bool)
+        if value is not None and not valid:
+            raise ValueError(f"Override {cidr} has an invalid {name}: {value!r}")
+    checked: Dict[str, Any] = {
+        name: float(value) if name in ("lat", "lon") and value is not None else value
+        for name, value in fields.items()
+    }
+    # The currency follows the country, as it does for database records
+    if "code" in checked and "currency" not in checked:
+        checked["currency"] = get_currency_for_country(checked["code"])
+    return checked
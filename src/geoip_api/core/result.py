@@ -0,0 +1,102 @@
+"""
+Typed lookup results.
+"""
+
+import json
+import sys
+from typing import Any, Dict, NamedTuple, Optional
+
+
+class GeoResult(NamedTuple):
+    """
+    Geolocation information for an IP address.
+
+    Results are immutable tuples without a per-instance ``__dict__``, and their
+    text fields are interned, so holding many of them costs little more than
+    the references they contain. Results do not include the IP address, which
+    lets every address of a network share one result.
+    """
+
+    code: Optional[str] = None
+    country: Optional[str] = None
+    continent: Optional[str] = None
+    continent_code: Optional[str] = None
+    city: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    tz: Optional[str] = None
+    currency: Optional[str] = None
+    isp: Optional[str] = None
+    asn: Optional[int] = None
+    # "private" or "reserved" for special-purpose addresses, None otherwise
+    special: Optional[str] = None
+
+    def to_dict(self, ip: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Convert the result to the dictionary returned by the dict API.
+
+        Args:
+            ip: IP address to include under the "ip" key, if any
+
+        Returns:
+            Dictionary of all result fields
+        """
+        if ip is None:
+            return self._asdict()
+        return {"ip": ip, **self._asdict()}
+
+    def to_json(self) -> bytes:
+        """
+        Serialize the result as a JSON object, byte for byte as the API does.
+
+        The "ip" key can be added to the serialized object with splice_ip.
+        """
+        return json.dumps(
+            self._asdict(), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode()
+
+
+EMPTY_RESULT = GeoResult()
+
+_TEXT_FIELDS = frozenset(
+    name for name, type_ in GeoResult.__annotations__.items() if type_ is Optional[str]
+)
+
+
+def make_result(fields: Dict[str, Any]) -> GeoResult:
+    """
+    Build a result from a field dictionary, interning its text values.
+
+    Country, continent, time zone and ISP names repeat across millions of
+    results, so interning makes them all share one string object per value.
+
+    Args:
+        fields: Result fields, missing fields default to None
+
+    Returns:
+        The typed result
+    """
+    values: Dict[str, Any] = {
+        name: sys.intern(value) if name in _TEXT_FIELDS and value else value
+        for name, value in fields.items()
+    }
+    return GeoResult(**values)
+
+
+def splice_ip(fragment: bytes, ip: str) -> bytes:
+    """
+    Add the "ip" key in front of a result serialized by GeoResult.to_json.
+
+    Args:
+        fragment: The serialized result
+        ip: A validated IP address
+
+    Returns:
+        The JSON object of GeoResult.to_dict(ip)
+    """
+    # Validated addresses need no escaping, except for an IPv6 scope ID
+    if "%" in ip:
+        quoted = json.dumps(ip, ensure_ascii=False).encode()
+    else:
+        quoted = b'"' + ip.encode() + b'"'
+    return b'{"ip":' + quoted + b"," + fragment[1:]
@@ -0,0 +1,125 @@
+"""
+IANA special-purpose address ranges.
+
+Addresses in these ranges are not globally reachable, so the databases hold no
+location for them. They are answered from this table without searching the
+databases at all.
+"""
+
+import ipaddress
+from bisect import bisect_right
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from geoip_api.core.address import ParsedIP
+
+PRIVATE = "private"
+RESERVED = "reserved"
+
+# First address of ::ffff:0:0/96, which embeds IPv4 addresses in IPv6
+IPV4_MAPPED = 0xFFFF << 32
+
+# (network, registry name, kind), from the IANA IPv4 and IPv6 Special-Purpose
+# Address Registries. Only ranges that are not globally reachable are listed,
+# and nested registry entries are covered by their enclosing range. The IPv4
+# ranges also apply to their IPv4-mapped IPv6 addresses, ::ffff:0:0/96.
+SPECIAL_RANGES: List[Tuple[str, str, str]] = [
+    ("0.0.0.0/8", "This network", RESERVED),
+    ("10.0.0.0/8", "Private-Use", PRIVATE),
+    ("100.64.0.0/10", "Shared Address Space", PRIVATE),
+    ("127.0.0.0/8", "Loopback", PRIVATE),
+    ("169.254.0.0/16", "Link Local", PRIVATE),
+    ("172.16.0.0/12", "Private-Use", PRIVATE),
+    ("192.0.0.0/29", "IPv4 Service Continuity Prefix", RESERVED),
+    ("192.0.0.170/31", "NAT64/DNS64 Discovery", RESERVED),
+    ("192.0.2.0/24", "Documentation (TEST-NET-1)", RESERVED),
+    ("192.168.0.0/16", "Private-Use", PRIVATE),
+    ("198.18.0.0/15", "Benchmarking", RESERVED),
+    ("198.51.100.0/24", "Documentation (TEST-NET-2)", RESERVED),
+    ("203.0.113.0/24", "Documentation (TEST-NET-3)", RESERVED),
+    ("224.0.0.0/4", "Multicast", RESERVED),
+    ("240.0.0.0/4", "Reserved", RESERVED),
+    ("::/128", "Unspecified Address", RESERVED),
+    ("::1/128", "Loopback Address", PRIVATE),
+    ("64:ff9b:1::/48", "IPv4-IPv6 Translation", PRIVATE),
+    ("100::/64", "Discard-Only Address Block", RESERVED),
+    ("2001:2::/48", "Benchmarking", RESERVED),
+    ("2001:db8::/32", "Documentation", RESERVED),
+    ("3fff::/20", "Documentation", RESERVED),
+    ("5f00::/16", "Segment Routing (SRv6) SIDs", RESERVED),
+    ("fc00::/7", "Unique-Local", PRIVATE),
+    ("fe80::/10", "Link-Local Unicast", PRIVATE),
+    ("ff00::/8", "Multicast", RESERVED),
+]
+
+
+class SpecialRange(NamedTuple):
+    """A special-purpose address range."""
+
+    network: str
+    name: str
+    kind: str
+    prefix_len: int
+
+
+class _RangeTable:
+    """Sorted, non-overlapping ranges of one IP version, searched by bisection."""
+
+    def __init__(self, ranges: List[Tuple[int, int, SpecialRange]]):
+        ranges.sort()
+        for (_, last, _), (first, _, _) in zip(ranges, ranges[1:]):
+            if first <= last:
+                raise ValueError("Special-purpose ranges must not overlap")
+        self.firsts = [first for first, _, _ in ranges]
+        self.lasts = [last for _, last, _ in ranges]
+        self.ranges = [special for _, _, special in ranges]
+
+    def find(self, value: int) -> Optional[SpecialRange]:
+        i = bisect_right(self.firsts, value) - 1
+        if i >= 0 and value <= self.lasts[i]:
+            return self.ranges[i]
+        return None
+
+
+def _build_tables() -> Dict[int, _RangeTable]:
+    ranges: Dict[int, List[Tuple[int, int, SpecialRange]]] = {4: [], 6: []}
+    for cidr, name, kind in SPECIAL_RANGES:
+        network = ipaddress.ip_network(cidr)
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        ranges[network.version].append(
+            (first, last, SpecialRange(cidr, name, kind, network.prefixlen))
+        )
+        if network.version == 4:
+            mapped = ipaddress.IPv6Network(
+                (IPV4_MAPPED | first, network.prefixlen + 96)
+            )
+            ranges[6].append(
+                (
+                    IPV4_MAPPED | first,
+                    IPV4_MAPPED | last,
+                    SpecialRange(str(mapped), name, kind, mapped.prefixlen),
+                )
+            )
+    return {version: _RangeTable(table) for version, table in ranges.items()}
+
+
+_TABLES = _build_tables()
+
+
+def special_range(address: ParsedIP) -> Optional[SpecialRange]:
+    """
+    Find the special-purpose range containing an address.
+
+    Args:
+        address: Parsed IP address
+
+    Returns:
+        The range, or None if the address is globally reachable
+    """
+    return _TABLES[address.version].find(address.value)
+
+
+def is_private(address: ParsedIP) -> bool:
+    """Whether an address belongs to a private, loopback or link-local range."""
+    special = _TABLES[address.version].find(address.value)
+    return special is not None and special.kind == PRIVATE
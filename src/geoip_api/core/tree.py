@@ -0,0 +1,327 @@
+"""
+Direct access to the search tree of a MaxMind DB file.
+
+The geoip2 readers only answer point queries. Reverse indexes, range queries
+and database comparisons need to walk the tree itself, so this module maps the
+database file and exposes its nodes and data section directly.
+"""
+
+import ipaddress
+import logging
+import mmap
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from maxminddb.decoder import Decoder
+
+from geoip_api.exceptions import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+METADATA_START_MARKER = b"\xab\xcd\xefMaxMind.com"
+DATA_SECTION_SEPARATOR_SIZE = 16
+
+
+class SearchTree:
+    """
+    A memory-mapped MaxMind DB search tree.
+
+    Records are addressed by their absolute offset in the database file. Every
+    network that points at the same record shares the same offset, which makes
+    offsets a cheap identity for decoded records.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Open and map a MaxMind DB file.
+
+        Args:
+            db_path: Path to the .mmdb file
+
+        Raises:
+            DatabaseError: If the file cannot be opened or is not a MaxMind DB
+        """
+        self.db_path = db_path
+        try:
+            with open(db_path, "rb") as f:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise DatabaseError(f"Failed to open database {db_path}: {e}") from e
+
+        size = len(self._buffer)
+        metadata_start = self._buffer.rfind(
+            METADATA_START_MARKER, max(0, size - 128 * 1024)
+        )
+        if metadata_start == -1:
+            self.close()
+            raise DatabaseError(f"Invalid MaxMind DB file: {db_path}")
+
+        metadata_start += len(METADATA_START_MARKER)
+        metadata: Dict[str, Any]
+        metadata, _ = Decoder(  # type: ignore[assignment]
+            self._buffer, metadata_start
+        ).decode(metadata_start)
+        self.metadata = metadata
+        self.node_count: int = metadata["node_count"]
+        self.record_size: int = metadata["record_size"]
+        self.ip_version: int = metadata["ip_version"]
+        self.build_epoch: int = metadata["build_epoch"]
+        self.database_type: str = metadata["database_type"]
+
+        self._node_byte_size = self.record_size // 4
+        self.search_tree_size = self.node_count * self._node_byte_size
+        self._decoder = Decoder(
+            self._buffer, self.search_tree_size + DATA_SECTION_SEPARATOR_SIZE
+        )
+
+        if self.record_size == 24:
+            self.read_node = self._read_node_24
+        elif self.record_size == 28:
+            self.read_node = self._read_node_28
+        elif self.record_size == 32:
+            self.read_node = self._read_node_32
+        else:
+            self.close()
+            raise DatabaseError(f"Unsupported record size: {self.record_size}")
+
+        # IPv4 addresses live under ::/96 in IPv6 trees
+        node = 0
+        if self.ip_version == 6:
+            for _ in range(96):
+                if node >= self.node_count:
+                    break
+                node = self.read_node(node, 0)
+        self.ipv4_start = node
+
+    def _read_node_24(self, node: int, bit: int) -> int:
+        offset = node * 6 + bit * 3
+        return int.from_bytes(self._buffer[offset : offset + 3], "big")
+
+    def _read_node_28(self, node: int, bit: int) -> int:
+        offset = node * 7
+        middle = self._buffer[offset + 3]
+        if bit:
+            return ((middle & 0x0F) << 24) | int.from_bytes(
+                self._buffer[offset + 4 : offset + 7], "big"
+            )
+        return ((middle & 0xF0) << 20) | int.from_bytes(
+            self._buffer[offset : offset + 3], "big"
+        )
+
+    def _read_node_32(self, node: int, bit: int) -> int:
+        offset = node * 8 + bit * 4
+        return int.from_bytes(self._buffer[offset : offset + 4], "big")
+
+    def start_node(self, version: int) -> int:
+        """Return the node at which addresses of the given IP version start."""
+        if version == 4:
+            return self.ipv4_start
+        if self.ip_version == 4:
+            # IPv6 addresses are never present in an IPv4-only tree
+            return self.node_count
+        return 0
+
+    def child(self, value: int, bit: int) -> int:
+        """
+        Follow one bit down from a tree value.
+
+        Leaves and empty records cover all of their sub-networks, so they are
+        returned unchanged.
+        """
+        if value < self.node_count:
+            return self.read_node(value, bit)
+        return value
+
+    def record_offset(self, value: int) -> int:
+        """
+        Convert a tree value into the absolute file offset of its record.
+
+        Returns 0 for empty records and for values that are still inner nodes.
+        """
+        if value <= self.node_count:
+            return 0
+        return value - self.node_count + self.search_tree_size
+
+    def find(self, address: int, version: int) -> Tuple[int, int]:
+        """
+        Find the record for an integer IP address.
+
+        Args:
+            address: The address as an integer
+            version: 4 or 6
+
+        Returns:
+            Tuple of (record offset or 0 if not found, prefix length)
+        """
+        bit_count = 32 if version == 4 else 128
+        node = self.start_node(version)
+        node_count = self.node_count
+        buf = self._buffer
+        depth = 0
+        # Node reads are inlined per record size as this loop runs for every
+        # bit of every lookup
+        if self.record_size == 24:
+            while depth < bit_count and node < node_count:
+                offset = node * 6
+                if (address >> (bit_count - 1 - depth)) & 1:
+                    offset += 3
+                node = (buf[offset] << 16) | (buf[offset + 1] << 8) | buf[offset + 2]
+                depth += 1
+        elif self.record_size == 28:
+            while depth < bit_count and node < node_count:
+                offset = node * 7
+                if (address >> (bit_count - 1 - depth)) & 1:
+                    node = (
+                        ((buf[offset + 3] & 0x0F) << 24)
+                        | (buf[offset + 4] << 16)
+                        | (buf[offset + 5] << 8)
+                        | buf[offset + 6]
+                    )
+                else:
+                    node = (
+                        ((buf[offset + 3] & 0xF0) << 20)
+                        | (buf[offset] << 16)
+                        | (buf[offset + 1] << 8)
+                        | buf[offset + 2]
+                    )
+                depth += 1
+        else:
+            read_node = self.read_node
+            while depth < bit_count and node < node_count:
+                node = read_node(node, (address >> (bit_count - 1 - depth)) & 1)
+                depth += 1
+        return self.record_offset(node), depth
+
+    def decode(self, offset: int) -> Any:
+        """Decode the record stored at an absolute file offset."""
+        record, _ = self._decoder.decode(offset)
+        return record
+
+    def prefetch(self, mode: str = "madvise") -> int:
+        """
+        Pull the database file into the page cache.
+
+        Args:
+            mode: "madvise" asks the kernel to read the file ahead in the
+                background, "read" reads it sequentially before returning.
+                "madvise" falls back to "read" where it is not supported.
+
+        Returns:
+            Number of bytes prefetched
+        """
+        size = len(self._buffer)
+        if mode == "madvise" and hasattr(mmap, "MADV_WILLNEED"):
+            self._buffer.madvise(mmap.MADV_WILLNEED)
+            return size
+        if mode not in ("madvise", "read"):
+            raise ValueError(f"Invalid prefetch mode: {mode}")
+
+        chunk_size = 1024 * 1024
+        for offset in range(0, size, chunk_size):
+            self._buffer[offset : offset + chunk_size]
+        return size
+
+    def networks(
+        self, network: Optional[IPNetwork] = None
+    ) -> Iterator[Tuple[IPNetwork, int]]:
+        """
+        Iterate over the networks of this tree that have a record.
+
+        Args:
+            network: Restrict iteration to this network (whole tree if None)
+
+        Yields:
+            Tuples of (network, record offset)
+        """
+        for net, offsets in walk_networks([self], network):
+            yield net, offsets[0]
+
+    def close(self) -> None:
+        """Unmap the database file."""
+        try:
+            self._buffer.close()
+        except (AttributeError, BufferError):
+            pass
+
+
+def walk_networks(
+    trees: Sequence[SearchTree], network: Optional[IPNetwork] = None
+) -> Iterator[Tuple[IPNetwork, Tuple[int, ...]]]:
+    """
+    Walk several search trees in lockstep below a covering network.
+
+    The trees are descended together until every one of them has reached a
+    leaf, so each yielded network maps to exactly one record per tree. The cost
+    grows with the number of distinct networks, not with the number of
+    addresses they contain.
+
+    Args:
+        trees: The trees to walk
+        network: Network to enumerate. Defaults to the whole address space of
+            the widest tree.
+
+    Yields:
+        Tuples of (network, record offsets), one offset per tree in the order
+        given, 0 where a tree has no record. Networks with no record in any
+        tree are skipped.
+    """
+    if network is None:
+        version = 6 if any(t.ip_version == 6 for t in trees) else 4
+        network = ipaddress.ip_network("::/0" if version == 6 else "0.0.0.0/0")
+
+    version = network.version
+    bit_count = 32 if version == 4 else 128
+    base = int(network.network_address)
+    prefix_len = network.prefixlen
+
+    # Descend to the node(s) covering the requested network
+    cursors = [t.start_node(version) for t in trees]
+    for depth in range(prefix_len):
+        bit = (base >> (bit_count - 1 - depth)) & 1
+        cursors = [t.child(c, bit) for t, c in zip(trees, cursors)]
+
+    # IPv6 trees alias ::ffff:0:0/96 and 2002::/16 onto the IPv4 subtree, which
+    # is walked once, under ::/96, when the requested network contains them.
+    # An alias is only skipped where every tree is at its alias or has no
+    # record, as trees built differently can hold their own data there.
+    # A request inside an alias starts below it, so is walked as usual.
+    aliases = [
+        t.ipv4_start if t.ip_version == 6 and t.ipv4_start < t.node_count else -1
+        for t in trees
+    ]
+    check_aliases = version == 6 and any(a >= 0 for a in aliases)
+
+    stack: List[Tuple[int, int, List[int]]] = [(base, prefix_len, cursors)]
+    while stack:
+        net, depth, cursors = stack.pop()
+
+        if check_aliases and depth > prefix_len and not (net == 0 and depth == 96):
+            at_alias = [c == a for c, a in zip(cursors, aliases)]
+            if any(at_alias) and all(
+                aliased or c == t.node_count
+                for t, c, aliased in zip(trees, cursors, at_alias)
+            ):
+                continue
+
+        if depth == bit_count or all(c >= t.node_count for t, c in zip(trees, cursors)):
+            offsets = tuple(t.record_offset(c) for t, c in zip(trees, cursors))
+            if any(offsets):
+                yield _make_network(net, depth, version), offsets
+            continue
+
+        # Push the right branch first so networks come out in ascending order
+        right = net | (1 << (bit_count - 1 - depth))
+        stack.append(
+            (right, depth + 1, [t.child(c, 1) for t, c in zip(trees, cursors)])
+        )
+        stack.append((net, depth + 1, [t.child(c, 0) for t, c in zip(trees, cursors)]))
+
+
+def _make_network(net: int, depth: int, version: int) -> IPNetwork:
+    """Build a network object, mapping ::/96 of IPv6 trees back to IPv4."""
+    if version == 6 and depth >= 96 and net >> 32 == 0:
+        return ipaddress.IPv4Network((net, depth - 96))
+    if version == 4:
+        return ipaddress.IPv4Network((net, depth))
+    return ipaddress.IPv6Network((net, depth))
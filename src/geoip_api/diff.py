@@ -0,0 +1,62 @@
+"""
+Compare two builds of the databases.
+
+Prints or saves the networks whose lookup result changed, for invalidating
+caches after a database update.
+
+Usage:
+    python -m geoip_api.diff OLD_CITY OLD_ASN NEW_CITY NEW_ASN \\
+        [--output diff.json] [--networks]
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from geoip_api.core.lookup import GeoIPLookup
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="List the networks whose lookup result differs between "
+        "two builds of the databases"
+    )
+    parser.add_argument("old_city", help="City database of the old build")
+    parser.add_argument("old_asn", help="ASN database of the old build")
+    parser.add_argument("new_city", help="City database of the new build")
+    parser.add_argument("new_asn", help="ASN database of the new build")
+    parser.add_argument("--output", help="Write the diff as JSON to this file")
+    parser.add_argument(
+        "--networks",
+        action="store_true",
+        help="Print the changed networks, one per line, instead of JSON",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    old = GeoIPLookup(city_db_path=args.old_city, asn_db_path=args.old_asn)
+    new = GeoIPLookup(city_db_path=args.new_city, asn_db_path=args.new_asn)
+    diff = new.diff(old)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(diff.to_dict(), f)
+    if args.networks:
+        for network in diff.changed:
+            print(network)
+    elif not args.output:
+        json.dump(diff.to_dict(), sys.stdout)
+        print()
+
+    stats = diff.stats
+    print(
+        f"{stats['networks_changed']} of {stats['networks_compared']} networks "
+        f"changed ({len(diff.changed)} after merging) "
+        f"in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
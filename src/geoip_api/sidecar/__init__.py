@@ -0,0 +1,13 @@
+"""
+Sidecar server answering lookups over a Unix socket.
+
+Co-located processes can look up addresses through the sidecar with a compact
+binary protocol instead of HTTP and JSON. Start it with:
+
+    python -m geoip_api.sidecar --socket /run/geoip.sock
+"""
+
+from geoip_api.sidecar.client import SidecarClient
+from geoip_api.sidecar.server import SidecarServer
+
+__all__ = ["SidecarClient", "SidecarServer"]
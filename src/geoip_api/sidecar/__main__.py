@@ -0,0 +1,56 @@
+"""
+Run the sidecar server.
+
+Usage:
+    python -m geoip_api.sidecar [--socket PATH] [--city PATH] [--asn PATH]
+                                [--overrides PATH]
+
+The override file is reloaded on SIGHUP.
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+
+from geoip_api.config import SIDECAR_SOCKET_PATH
+from geoip_api.core.lookup import GeoIPLookup
+from geoip_api.sidecar.server import SidecarServer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="GeoIP lookup sidecar server")
+    parser.add_argument("--socket", default=SIDECAR_SOCKET_PATH, help="Socket path")
+    parser.add_argument("--city", help="Path to the City database")
+    parser.add_argument("--asn", help="Path to the ASN database")
+    parser.add_argument("--overrides", help="Path to an override file")
+    parser.add_argument("--log-level", default="WARNING", help="Logging level")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    lookup = GeoIPLookup(
+        city_db_path=args.city,
+        asn_db_path=args.asn,
+        download_if_missing=True,
+        overrides_path=args.overrides,
+    )
+    asyncio.run(serve(SidecarServer(lookup, args.socket)))
+
+
+async def serve(server: SidecarServer) -> None:
+    """Serve until SIGINT or SIGTERM, then remove the socket."""
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    assert task is not None
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    if server.geoip_lookup.overrides_path:
+        loop.add_signal_handler(signal.SIGHUP, server.geoip_lookup.reload_overrides)
+    try:
+        await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+
+
+if __name__ == "__main__":
+    main()
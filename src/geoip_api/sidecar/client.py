@@ -0,0 +1,182 @@
+"""
+Client for the sidecar lookup server.
+"""
+
+import itertools
+import socket
+from collections import deque
+from typing import BinaryIO, Deque, Iterable, List, Optional, Tuple
+
+from geoip_api.config import SIDECAR_SOCKET_PATH
+from geoip_api.core.address import ParsedIP, parse_ip
+from geoip_api.core.result import GeoResult
+from geoip_api.exceptions import InvalidIPError, LookupError
+from geoip_api.sidecar.protocol import (
+    FRAME_HEADER,
+    MAX_BATCH_SIZE,
+    ProtocolError,
+    decode_response,
+    encode_request,
+)
+
+
+class SidecarClient:
+    """
+    Looks up IP addresses through a sidecar server.
+
+    Addresses are parsed and validated by the client, so the server only ever
+    receives packed addresses. Batches larger than one request are split and
+    pipelined over the connection. After any failure the connection is closed,
+    failing every request still in flight, as their responses could no longer
+    be told apart; the next request reconnects. A client is not safe to share
+    between threads; use one per thread.
+    """
+
+    def __init__(self, path: str = SIDECAR_SOCKET_PATH, timeout: float = 5.0):
+        """
+        Connect to a sidecar server.
+
+        Args:
+            path: Path of the server's Unix socket
+            timeout: Socket timeout in seconds
+        """
+        self.path = path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._reader: Optional[BinaryIO] = None
+        self._ids = itertools.count(1)
+        self._connect()
+
+    def _connect(self) -> Tuple[socket.socket, BinaryIO]:
+        if self._sock is None or self._reader is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._sock, self._reader = sock, sock.makefile("rb")
+        return self._sock, self._reader
+
+    def lookup(self, ip_address: str) -> GeoResult:
+        """
+        Look up geolocation information for an IP address.
+
+        Raises:
+            InvalidIPError: If the IP address is invalid
+            LookupError: If the server fails to answer
+        """
+        try:
+            address = parse_ip(ip_address)
+        except ValueError as e:
+            raise InvalidIPError(f"Invalid IP address: {ip_address}") from e
+        try:
+            results = self._receive(self._send([address]))
+        except LookupError:
+            self.close()
+            raise
+        if results[0] is None:
+            raise InvalidIPError(f"Invalid IP address: {ip_address}")
+        return results[0]
+
+    def lookup_many(
+        self,
+        ip_addresses: Iterable[str],
+        batch_size: int = 1024,
+        max_in_flight: int = 8,
+    ) -> List[Optional[GeoResult]]:
+        """
+        Look up many IP addresses, pipelining requests of up to batch_size.
+
+        Args:
+            ip_addresses: IP addresses to look up
+            batch_size: Most addresses per request
+            max_in_flight: Most requests sent before reading a response. The
+                server stops reading while its responses go unread, so an
+                unbounded pipeline would stall both sides.
+
+        Returns:
+            One result per address, in input order, None where the address
+            is invalid
+
+        Raises:
+            LookupError: If the server fails to answer
+        """
+        batch_size = min(batch_size, MAX_BATCH_SIZE)
+        results: List[Optional[GeoResult]] = []
+        # Request IDs with the positions of their addresses within results
+        in_flight: Deque[Tuple[int, List[int]]] = deque()
+
+        def receive_oldest() -> None:
+            request_id, positions = in_flight.popleft()
+            for position, result in zip(positions, self._receive(request_id)):
+                results[position] = result
+
+        batch: List[ParsedIP] = []
+        positions: List[int] = []
+        try:
+            for ip_address in itertools.chain(ip_addresses, [None]):
+                if ip_address is not None:
+                    try:
+                        batch.append(parse_ip(ip_address))
+                        positions.append(len(results))
+                    except ValueError:
+                        pass
+                    results.append(None)
+                    if len(batch) < batch_size:
+                        continue
+                if not batch:
+                    continue
+                if len(in_flight) >= max_in_flight:
+                    receive_oldest()
+                in_flight.append((self._send(batch), positions))
+                batch, positions = [], []
+
+            while in_flight:
+                receive_oldest()
+        except LookupError:
+            # Unread responses would be taken for the answers to later requests
+            self.close()
+            raise
+        return results
+
+    def _send(self, addresses: List[ParsedIP]) -> int:
+        request_id = next(self._ids) & 0xFFFFFFFF
+        try:
+            sock, _ = self._connect()
+            sock.sendall(encode_request(request_id, addresses))
+        except OSError as e:
+            raise LookupError(f"Sidecar request failed: {e}") from e
+        return request_id
+
+    def _receive(self, request_id: int) -> List[Optional[GeoResult]]:
+        try:
+            _, reader = self._connect()
+            header = reader.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                raise LookupError("Sidecar closed the connection")
+            (length,) = FRAME_HEADER.unpack(header)
+            response_id, results, error = decode_response(reader.read(length))
+        except (OSError, ProtocolError) as e:
+            raise LookupError(f"Sidecar request failed: {e}") from e
+        if response_id != request_id:
+            raise LookupError(f"Expected response {request_id}, got {response_id}")
+        if results is None:
+            raise LookupError(error)
+        return results
+
+    def close(self) -> None:
+        """Close the connection. The next request opens a new one."""
+        sock, reader = self._sock, self._reader
+        self._sock = self._reader = None
+        if reader is not None:
+            reader.close()
+        if sock is not None:
+            sock.close()
+
+    def __enter__(self) -> "SidecarClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,218 @@
+"""
+Binary protocol of the sidecar server.
+
+Every message is a frame: a 4-byte big-endian body length followed by the
+body. All integers are big-endian.
+
+Request body:
+    u32 request ID, u8 opcode (1 = lookup), u16 address count, then per
+    address a u8 IP version (4 or 6) and the 4 or 16 packed address bytes
+
+Response body:
+    u32 request ID, u8 status (0 = ok, 1 = error), u16 item count, then per
+    item a u8 item status (0 = result, 1 = invalid address) and, for results,
+    the encoded result. Error responses carry a UTF-8 message instead of
+    items, with an item count of 0.
+
+Encoded result:
+    u16 bitmap of the GeoResult fields that are not None, then the value of
+    each of those fields in field order: text as a u16 length and UTF-8
+    bytes, floats as f64, integers as u64
+
+Requests on one connection are answered in order, and clients may send any
+number of requests before reading the responses.
+"""
+
+import socket
+import struct
+from typing import List, Optional, Sequence, Tuple
+
+from geoip_api.core.address import ParsedIP
+from geoip_api.core.result import GeoResult
+
+FRAME_HEADER = struct.Struct(">I")
+MESSAGE_HEADER = struct.Struct(">IBH")
+MAX_FRAME_SIZE = 1 << 20
+MAX_BATCH_SIZE = 0xFFFF
+
+OP_LOOKUP = 1
+STATUS_OK = 0
+STATUS_ERROR = 1
+ITEM_INVALID = 1
+
+_U16 = struct.Struct(">H")
+_F64 = struct.Struct(">d")
+_U64 = struct.Struct(">Q")
+
+# Kind of each GeoResult field: "s" text, "f" float, "i" integer
+_FIELD_KINDS = [
+    {float: "f", int: "i"}.get(type_.__args__[0], "s")
+    for type_ in GeoResult.__annotations__.values()
+]
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends a malformed message."""
+
+
+def frame(body: bytes) -> bytes:
+    """Prefix a message body with its length."""
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def encode_request(request_id: int, addresses: Sequence[ParsedIP]) -> bytes:
+    """Encode a lookup request, including its frame header."""
+    if len(addresses) > MAX_BATCH_SIZE:
+        raise ValueError(f"Batches are limited to {MAX_BATCH_SIZE} addresses")
+    parts = [MESSAGE_HEADER.pack(request_id, OP_LOOKUP, len(addresses))]
+    for address in addresses:
+        parts.append(b"\x04" if address.version == 4 else b"\x06")
+        parts.append(address.packed)
+    return frame(b"".join(parts))
+
+
+def decode_request(body: bytes) -> Tuple[int, int, List[ParsedIP]]:
+    """
+    Decode a request body.
+
+    Returns:
+        Tuple of (request ID, opcode, addresses)
+
+    Raises:
+        ProtocolError: If the body is malformed
+    """
+    try:
+        request_id, opcode, count = MESSAGE_HEADER.unpack_from(body)
+    except struct.error as e:
+        raise ProtocolError("Truncated request header") from e
+
+    addresses: List[ParsedIP] = []
+    offset = MESSAGE_HEADER.size
+    for _ in range(count):
+        version = body[offset] if offset < len(body) else 0
+        if version == 4:
+            packed = body[offset + 1 : offset + 5]
+            family = socket.AF_INET
+        elif version == 6:
+            packed = body[offset + 1 : offset + 17]
+            family = socket.AF_INET6
+        else:
+            raise ProtocolError(f"Invalid address at offset {offset}")
+        if len(packed) != (4 if version == 4 else 16):
+            raise ProtocolError("Truncated address")
+        offset += 1 + len(packed)
+        addresses.append(
+            ParsedIP(
+                socket.inet_ntop(family, packed),
+                version,
+                packed,
+                int.from_bytes(packed, "big"),
+            )
+        )
+    return request_id, opcode, addresses
+
+
+def encode_result(result: GeoResult) -> bytes:
+    """
+    Encode a result for a response item.
+
+    Raises:
+        ValueError: If a text field is longer than 65535 bytes
+    """
+    bitmap = 0
+    parts = [b""]
+    for i, (kind, value) in enumerate(zip(_FIELD_KINDS, result)):
+        if value is None:
+            continue
+        bitmap |= 1 << i
+        if kind == "s":
+            data = str(value).encode()
+            if len(data) > 0xFFFF:
+                raise ValueError(f"Field {i} is too long to encode")
+            parts.append(_U16.pack(len(data)) + data)
+        elif kind == "f":
+            parts.append(_F64.pack(value))
+        else:
+            parts.append(_U64.pack(value))
+    parts[0] = _U16.pack(bitmap)
+    return b"".join(parts)
+
+
+def encode_response(
+    request_id: int, encoded_results: Sequence[Optional[bytes]]
+) -> bytes:
+    """
+    Encode a successful response, including its frame header.
+
+    Args:
+        request_id: ID of the request answered
+        encoded_results: Results encoded by encode_result, None for invalid
+            addresses
+    """
+    parts = [MESSAGE_HEADER.pack(request_id, STATUS_OK, len(encoded_results))]
+    for encoded in encoded_results:
+        if encoded is None:
+            parts.append(b"\x01")
+        else:
+            parts.append(b"\x00")
+            parts.append(encoded)
+    return frame(b"".join(parts))
+
+
+def encode_error(request_id: int, message: str) -> bytes:
+    """Encode an error response, including its frame header."""
+    return frame(MESSAGE_HEADER.pack(request_id, STATUS_ERROR, 0) + message.encode())
+
+
+def decode_response(
+    body: bytes,
+) -> Tuple[int, Optional[List[Optional[GeoResult]]], str]:
+    """
+    Decode a response body.
+
+    Returns:
+        Tuple of (request ID, results or None for error responses, error
+        message). Results are None for invalid addresses.
+
+    Raises:
+        ProtocolError: If the body is malformed
+    """
+    try:
+        request_id, status, count = MESSAGE_HEADER.unpack_from(body)
+        if status == STATUS_ERROR:
+            return request_id, None, body[MESSAGE_HEADER.size :].decode()
+
+        results: List[Optional[GeoResult]] = []
+        offset = MESSAGE_HEADER.size
+        for _ in range(count):
+            item_status = body[offset]
+            offset += 1
+            if item_status == ITEM_INVALID:
+                results.append(None)
+                continue
+            result, offset = _decode_result(body, offset)
+            results.append(result)
+        return request_id, results, ""
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ProtocolError(f"Malformed response: {e}") from e
+
+
+def _decode_result(body: bytes, offset: int) -> Tuple[GeoResult, int]:
+    (bitmap,) = _U16.unpack_from(body, offset)
+    offset += 2
+    values: List[object] = []
+    for i, kind in enumerate(_FIELD_KINDS):
+        if not bitmap & (1 << i):
+            values.append(None)
+        elif kind == "s":
+            (length,) = _U16.unpack_from(body, offset)
+            offset += 2
+            values.append(body[offset : offset + length].decode())
+            offset += length
+        elif kind == "f":
+            values.append(_F64.unpack_from(body, offset)[0])
+            offset += 8
+        else:
+            values.append(_U64.unpack_from(body, offset)[0])
+            offset += 8
+    return GeoResult._make(values), offset
@@ -0,0 +1,125 @@
+"""
+Sidecar lookup server listening on a Unix socket.
+"""
+
+import asyncio
+import logging
+import os
+from functools import lru_cache
+from typing import Optional
+
+from geoip_api.core.lookup import GeoIPLookup
+from geoip_api.core.result import GeoResult
+from geoip_api.sidecar.protocol import (
+    FRAME_HEADER,
+    MAX_FRAME_SIZE,
+    OP_LOOKUP,
+    ProtocolError,
+    decode_request,
+    encode_error,
+    encode_response,
+    encode_result,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SidecarServer:
+    """
+    Serves lookups to co-located processes over a Unix socket.
+
+    Lookups run directly on the event loop: they take microseconds, far less
+    than handing them to a thread would.
+    """
+
+    def __init__(self, geoip_lookup: GeoIPLookup, path: str):
+        """
+        Initialize the server.
+
+        Args:
+            geoip_lookup: Lookup service answering the requests
+            path: Path of the Unix socket to listen on
+        """
+        self.geoip_lookup = geoip_lookup
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Results are shared per network, so most responses reuse an encoding
+        self._encode = lru_cache(maxsize=65536)(encode_result)
+
+    async def start(self) -> None:
+        """Load the databases and start listening."""
+        self.geoip_lookup.load()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+        logger.info(f"Sidecar listening on {self.path}")
+
+    async def serve_forever(self) -> None:
+        """Start listening and serve until cancelled."""
+        if self._server is None:
+            await self.start()
+        assert self._server is not None
+        try:
+            await self._server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop listening and remove the socket file."""
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                (length,) = FRAME_HEADER.unpack(header)
+                if length > MAX_FRAME_SIZE:
+                    logger.warning(f"Closing connection sending a {length} byte frame")
+                    break
+                body = await reader.readexactly(length)
+                writer.write(self.handle(body))
+                # Only waits when the client stops reading responses
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ProtocolError as e:
+            logger.warning(f"Closing connection after protocol error: {e}")
+        finally:
+            writer.close()
+
+    def handle(self, body: bytes) -> bytes:
+        """
+        Answer one request body.
+
+        Returns:
+            The framed response
+
+        Raises:
+            ProtocolError: If the request is malformed
+        """
+        request_id, opcode, addresses = decode_request(body)
+        if opcode != OP_LOOKUP:
+            return encode_error(request_id, f"Unknown opcode: {opcode}")
+        try:
+            results = self.geoip_lookup.lookup_many(addresses, as_dict=False)
+        except Exception as e:
+            logger.error(f"Lookup error: {e}")
+            return encode_error(request_id, "Failed to look up IP address information")
+        try:
+            encoded = [self._encoded(r) for r in results]
+        except ValueError as e:
+            logger.error(f"Encoding error: {e}")
+            return encode_error(request_id, "Result too large to encode")
+        return encode_response(request_id, encoded)
+
+    def _encoded(self, result: Optional[GeoResult]) -> Optional[bytes]:
+        return None if result is None else self._encode(result)
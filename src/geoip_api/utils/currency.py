@@ -2,21 +2,27 @@
 Currency mapping utilities for GeoIP API using pycountry.
 """
 
+import importlib.util
 import logging
+from functools import lru_cache
 from typing import Any, Optional
 
-try:
-    import pycountry
-
-    _pycountry: Optional[Any] = pycountry
-    PYCOUNTRY_AVAILABLE = True
-except ImportError:
-    _pycountry = None
-    PYCOUNTRY_AVAILABLE = False
+# pycountry is imported on first use to keep package import cheap
+PYCOUNTRY_AVAILABLE = importlib.util.find_spec("pycountry") is not None
+if not PYCOUNTRY_AVAILABLE:
     logging.warning("pycountry not installed. Currency lookups will be limited.")
 
 logger = logging.getLogger(__name__)
 
+
+@lru_cache()
+def _load_pycountry() -> Any:
+    """Import pycountry on first use."""
+    import pycountry
+
+    return pycountry
+
+
 # Minimal mapping for most common countries only
 # This covers ~90% of global internet traffic
 COMMON_COUNTRY_CURRENCY_MAP = {
@@ -102,7 +108,7 @@ def get_currency_for_country(country_code: Optional[str]) -> Optional[str]:
     # Validate country code exists using pycountry if available
     if PYCOUNTRY_AVAILABLE:
         try:
-            country = pycountry.countries.get(alpha_2=country_code)
+            country = _load_pycountry().countries.get(alpha_2=country_code)
             if not country:
                 logger.debug(
                     f"Country code {country_code} not found in pycountry database"
@@ -117,7 +123,7 @@ def get_currency_for_country(country_code: Optional[str]) -> Optional[str]:
     if currency_code and PYCOUNTRY_AVAILABLE:
         # Validate that the currency exists in pycountry
         try:
-            currency = pycountry.currencies.get(alpha_3=currency_code)
+            currency = _load_pycountry().currencies.get(alpha_3=currency_code)
             if currency:
                 logger.debug(
                     f"Found currency {currency_code} for country {country_code}"
@@ -153,7 +159,7 @@ def get_currency_info(currency_code: Optional[str]) -> Optional[dict]:
         return None
 
     try:
-        currency = pycountry.currencies.get(alpha_3=currency_code.upper())
+        currency = _load_pycountry().currencies.get(alpha_3=currency_code.upper())
         if currency:
             return {
                 "code": currency.alpha_3,
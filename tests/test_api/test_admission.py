@@ -0,0 +1,87 @@
+"""
+Tests for admission control.
+"""
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.admission import AdmissionMiddleware, ConcurrencyLimiter
+
+
+def _client(limiter):
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, limiter=limiter, retry_after=2)
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/lookup")
+    async def lookup():
+        return {"ok": True}
+
+    @app.get("/api/v1/geoip/asn/{asn}/networks")
+    async def networks(asn: int):
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def test_fixed_limit():
+    """Test that requests over a fixed limit are rejected."""
+    limiter = ConcurrencyLimiter(mode="fixed", initial_limit=2)
+
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release(0.5)
+    assert limiter.try_acquire()
+    assert limiter.limit == 2
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_adaptive_limit_follows_latency():
+    """Test that the adaptive limit grows when fast and shrinks when slow."""
+    limiter = ConcurrencyLimiter(initial_limit=16, min_limit=4, max_limit=64)
+    limiter.in_flight = 16
+
+    for _ in range(50):
+        limiter.in_flight += 1
+        limiter.release(0.001)
+    grown = limiter.limit
+    assert grown > 16
+
+    for _ in range(50):
+        limiter.in_flight += 1
+        limiter.release(0.1)
+    assert limiter.min_limit <= limiter.limit < grown
+
+
+def test_middleware_sheds_load():
+    """Test 503 with Retry-After when saturated, and the health lane."""
+    limiter = ConcurrencyLimiter(mode="fixed", initial_limit=1)
+    client = _client(limiter)
+
+    assert client.get("/lookup").status_code == 200
+    assert limiter.in_flight == 0
+
+    limiter.in_flight = 1
+    response = client.get("/lookup")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+    assert client.get("/healthz").status_code == 200
+
+
+def test_middleware_skips_timing_slow_paths():
+    """Test that streams and POST requests do not steer the adaptive limit."""
+    limiter = ConcurrencyLimiter(initial_limit=8)
+    client = _client(limiter)
+
+    assert client.get("/api/v1/geoip/asn/1/networks").status_code == 200
+    assert client.post("/lookup").status_code == 405
+    assert limiter.in_flight == 0
+    assert limiter.stats()["admitted"] == 2
+    assert limiter.stats()["short_rtt_ms"] is None
+
+    client.get("/lookup")
+    assert limiter.stats()["short_rtt_ms"] is not None
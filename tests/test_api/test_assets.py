@@ -0,0 +1,96 @@
+"""
+Tests for the precompressed static assets.
+"""
+
+import asyncio
+import gzip
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.assets import (
+    IMMUTABLE,
+    StaticAssets,
+    accepted_encodings,
+    build_assets,
+    read_bundle,
+    write_bundle,
+)
+from api.main import app
+
+client = TestClient(app)
+
+
+def _hashed_stylesheet():
+    page = client.get("/").text
+    match = re.search(r'href="(/static/css/styles\.[0-9a-f]{10}\.css)"', page)
+    assert match is not None
+    return match.group(1)
+
+
+def test_index_links_hashed_assets():
+    """Test that the index page is cached by validation and links hashed URLs."""
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.headers["content-encoding"] == "gzip"
+    assert 'src="/static/js/demo.js"' not in response.text
+
+    revalidated = client.get("/", headers={"If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+
+def test_hashed_asset_immutable():
+    """Test that hashed URLs are immutable and served precompressed."""
+    response = client.get(_hashed_stylesheet(), headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == IMMUTABLE
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+
+    original = client.get(
+        "/static/css/styles.css", headers={"Accept-Encoding": "identity"}
+    )
+    assert "immutable" not in original.headers["cache-control"]
+    assert "content-encoding" not in original.headers
+    assert original.content == response.content
+
+    assert client.get("/static/css/missing.css").status_code == 404
+    assert client.post("/static/css/styles.css").status_code == 405
+
+
+def test_bundle_round_trip(tmp_path):
+    """Test that a written bundle reads back identically."""
+    bundle = build_assets(brotli_quality=-1)
+    write_bundle(bundle, tmp_path)
+
+    loaded = read_bundle(tmp_path)
+    assert loaded == bundle
+    page = loaded.page.bodies["gzip"]
+    assert gzip.decompress(page) == bundle.page.bodies["identity"]
+
+
+@pytest.mark.parametrize(
+    "header,accepted",
+    [
+        ("gzip, br", {"gzip", "br"}),
+        ("gzip;q=0.0, br; q=0.000", set()),
+        ("br;q=0, gzip;q=0.5", {"gzip"}),
+        ("GZIP ; Q=1", {"gzip"}),
+        ("gzip;q=high", set()),
+    ],
+)
+def test_accepted_encodings(header, accepted):
+    """Test that codings with a zero q-value, in any notation, are refused."""
+    assert accepted_encodings(header) == accepted
+
+
+def test_prepare_off_event_loop(tmp_path):
+    """Test preparing the assets from an event loop without a build."""
+    assets = StaticAssets(tmp_path)
+    bundle = asyncio.run(assets.prepare())
+
+    assert bundle is assets.bundle
+    assert bundle.page.bodies["identity"]
@@ -0,0 +1,289 @@
+"""
+Tests for the shared result cache.
+"""
+
+import asyncio
+import ipaddress
+import json
+import socket
+import socketserver
+import threading
+import uuid
+
+import pytest
+
+from api.cache import (
+    KeyValueCacheBackend,
+    LocalCacheBackend,
+    ResultCache,
+    SharedMemoryCacheBackend,
+    _encode_entry,
+)
+from api.dependencies import lookup_result_async
+from geoip_api import GeoIPLookup, GeoResult, parse_ip
+from geoip_api.core.diff import DatabaseDiff
+from tests.conftest import TEST_IP_CLOUDFLARE, TEST_IP_GOOGLE_DNS
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    """Serves GET and SET from a dict, speaking the Redis protocol."""
+
+    def handle(self):
+        store = self.server.store  # type: ignore[attr-defined]
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+
+            command = args[0].upper()
+            if command == b"GET":
+                value = store.get(args[1])
+                if value is None:
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            elif command == b"SET":
+                store[args[1]] = args[2]
+                self.wfile.write(b"+OK\r\n")
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def kv_server():
+    """Run an in-process stand-in for a Redis server."""
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _StandInHandler)
+    server.daemon_threads = True
+    server.store = {}  # type: ignore[attr-defined]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def shm_name():
+    """A unique shared-memory segment name, removed after the test."""
+    name = f"geoip_test_{uuid.uuid4().hex[:8]}"
+    yield name
+    from multiprocessing import shared_memory
+
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+        segment.close()
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def test_local_backend_evicts_oldest():
+    """Test the in-process LRU backend."""
+    backend = LocalCacheBackend(max_entries=2)
+    backend.set("a", b"1")
+    backend.set("b", b"2")
+    backend.get("a")
+    backend.set("c", b"3")
+
+    assert backend.get("a") == b"1"
+    assert backend.get("b") is None
+    assert backend.get("c") == b"3"
+
+
+def test_shared_memory_backend_shared_between_instances(shm_name):
+    """Test that a second worker attaching to the segment sees the entries."""
+    first = SharedMemoryCacheBackend(shm_name, slots=64)
+    first.set("key", b"value")
+
+    second = SharedMemoryCacheBackend(shm_name, slots=64)
+    assert second.get("key") == b"value"
+    assert second.get("other") is None
+
+    first.close()
+    second.close()
+
+
+def test_shared_memory_backend_skips_oversized_values(shm_name):
+    """Test that values larger than a slot are not stored."""
+    backend = SharedMemoryCacheBackend(shm_name, slots=4, slot_size=32)
+    backend.set("key", b"x" * 64)
+
+    assert backend.get("key") is None
+    backend.close()
+
+
+def test_key_value_backend(kv_server):
+    """Test the Redis protocol backend against the stand-in server."""
+    host, port = kv_server.server_address
+    backend = KeyValueCacheBackend(f"redis://{host}:{port}/0")
+    backend.set("key", b"value")
+
+    assert backend.get("key") == b"value"
+    assert backend.get("missing") is None
+    backend.close()
+
+
+def test_key_value_backend_unavailable():
+    """Test that an unreachable server is treated as a miss."""
+    backend = KeyValueCacheBackend("redis://127.0.0.1:1/0", timeout=0.05)
+    backend.set("key", b"value")
+
+    assert backend.get("key") is None
+
+
+def test_key_value_backend_backoff(monkeypatch):
+    """Test that an unreachable server is not contacted again during backoff."""
+    backend = KeyValueCacheBackend("redis://127.0.0.1:1/0", timeout=0.05, backoff=60)
+    attempts = []
+    connect = socket.create_connection
+
+    def create_connection(*args, **kwargs):
+        attempts.append(args)
+        return connect(*args, **kwargs)
+
+    monkeypatch.setattr(socket, "create_connection", create_connection)
+    assert backend.get("key") is None
+    assert backend.get("key") is None
+    backend.set("key", b"value")
+    assert len(attempts) == 1
+
+
+def test_result_cache_hit(geoip_lookup, kv_server):
+    """Test that a cached result matches a direct lookup."""
+    host, port = kv_server.server_address
+    cache = ResultCache(KeyValueCacheBackend(f"{host}:{port}"))
+
+    first = cache.lookup(geoip_lookup, TEST_IP_GOOGLE_DNS)
+    second = cache.lookup(geoip_lookup, TEST_IP_GOOGLE_DNS)
+
+    assert first == second == geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+    assert cache.stats()["hits"] == 1
+    assert all(key.startswith(b"geoip:") for key in kv_server.store)
+
+
+@pytest.mark.parametrize("entry", [b"1-1\n[1, 2", b"1-1\n{}", b"\xff\n[]", b"1-1\n[7]"])
+def test_result_cache_invalid_entry(geoip_lookup, entry):
+    """Test that an unreadable entry is a miss and gets replaced."""
+    backend = LocalCacheBackend()
+    cache = ResultCache(backend)
+    key = f"geoip:{cache.cache_network(parse_ip(TEST_IP_GOOGLE_DNS))[0]}"
+    backend.set(key, entry)
+
+    expected = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+    assert cache.lookup(geoip_lookup, TEST_IP_GOOGLE_DNS) == expected
+    assert cache.stats()["misses"] == 1
+    assert cache.lookup(geoip_lookup, TEST_IP_GOOGLE_DNS) == expected
+    assert cache.stats()["hits"] == 1
+
+
+def test_result_cache_special_ranges(geoip_lookup):
+    """Test that special ranges smaller than a block bypass its entry."""
+    cache = ResultCache(LocalCacheBackend())
+
+    # 192.0.0.0/29 is reserved, the rest of 192.0.0.0/24 is not
+    neighbour = cache.lookup(geoip_lookup, "192.0.0.9")
+    assert neighbour.special is None
+    assert cache.lookup(geoip_lookup, "192.0.0.1").special == "reserved"
+    assert cache.lookup(geoip_lookup, "192.0.0.10") == neighbour
+
+
+def test_networked_cache_off_event_loop(geoip_lookup, monkeypatch):
+    """Test that lookups through a networked cache leave the event loop."""
+    threads = []
+
+    class RecordingBackend(LocalCacheBackend):
+        blocking = True
+
+        def get(self, key):
+            threads.append(threading.current_thread())
+            return super().get(key)
+
+    cache = ResultCache(RecordingBackend())
+    monkeypatch.setattr("api.dependencies.get_result_cache", lambda: cache)
+    monkeypatch.setattr("api.dependencies.get_coalescer", lambda: None)
+
+    address = parse_ip(TEST_IP_GOOGLE_DNS)
+    result = asyncio.run(lookup_result_async(geoip_lookup, address))
+
+    assert result == geoip_lookup.lookup(address, as_dict=False)
+    assert threads and threading.main_thread() not in threads
+
+
+def test_result_cache_keeps_unchanged_blocks(geoip_lookup):
+    """Test that a diff keeps entries of the previous build outside changes."""
+    backend = LocalCacheBackend()
+    stale = GeoResult(city="Cached")
+    for ip in (TEST_IP_GOOGLE_DNS, TEST_IP_CLOUDFLARE):
+        block, _ = ResultCache.cache_network(parse_ip(ip))
+        backend.set(f"geoip:{block}", _encode_entry("previous", stale))
+
+    changed = [ipaddress.ip_network(f"{TEST_IP_CLOUDFLARE}/32")]
+    diff = DatabaseDiff("previous", geoip_lookup.epoch, changed, {})
+    cache = ResultCache(backend, diff)
+
+    assert cache.lookup(geoip_lookup, TEST_IP_GOOGLE_DNS) == stale
+    assert cache.lookup(geoip_lookup, TEST_IP_CLOUDFLARE) == geoip_lookup.lookup(
+        TEST_IP_CLOUDFLARE, as_dict=False
+    )
+    assert cache.stats()["carried_over"] == 1
+
+    # Without the diff, entries of another build are never served
+    cache = ResultCache(backend)
+    block, _ = ResultCache.cache_network(parse_ip(TEST_IP_GOOGLE_DNS))
+    backend.set(f"geoip:{block}", _encode_entry("previous", stale))
+    assert cache.lookup(geoip_lookup, TEST_IP_GOOGLE_DNS) != stale
+
+
+def test_result_cache_with_overrides(real_db_paths, tmp_path):
+    """Test that overrides keep database diffs and unchanged blocks working."""
+    overrides = tmp_path / "overrides.json"
+    overrides.write_text(json.dumps({"10.0.0.0/8": {"country": "Internal"}}))
+    old = GeoIPLookup(
+        city_db_path=real_db_paths["city"],
+        asn_db_path=real_db_paths["asn"],
+        overrides_path=str(overrides),
+    )
+
+    # A new build renaming the city of one network
+    city = old.lookup(TEST_IP_GOOGLE_DNS)["city"].encode()
+    renamed = tmp_path / "GeoLite2-City.mmdb"
+    with open(real_db_paths["city"], "rb") as f:
+        renamed.write_bytes(f.read().replace(city, city[:-1] + b"_"))
+    new = GeoIPLookup(
+        city_db_path=str(renamed),
+        asn_db_path=real_db_paths["asn"],
+        overrides_path=str(overrides),
+    )
+    # The patched file keeps the build epoch of the original
+    new.load()
+    assert new._city_tree is not None
+    new._city_tree.build_epoch += 1
+
+    backend = LocalCacheBackend()
+    for ip in (TEST_IP_GOOGLE_DNS, TEST_IP_CLOUDFLARE):
+        ResultCache(backend).lookup(old, ip)
+
+    cache = ResultCache(backend, new.diff(old))
+    assert cache.lookup(new, TEST_IP_CLOUDFLARE) == old.lookup(
+        TEST_IP_CLOUDFLARE, as_dict=False
+    )
+    assert cache.lookup(new, TEST_IP_GOOGLE_DNS).city == city[:-1].decode() + "_"
+    assert cache.stats()["carried_over"] == 1
+
+    # Reloading the overrides only drops the blocks of the changed networks
+    overrides.write_text(
+        json.dumps(
+            {
+                "10.0.0.0/8": {"country": "Internal"},
+                TEST_IP_GOOGLE_DNS: {"city": "Anycast"},
+            }
+        )
+    )
+    assert new.reload_overrides()
+    assert cache.lookup(new, TEST_IP_CLOUDFLARE).city is not None
+    assert cache.lookup(new, TEST_IP_GOOGLE_DNS).city == "Anycast"
+    assert cache.stats()["carried_over"] == 2
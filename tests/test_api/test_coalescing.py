@@ -0,0 +1,109 @@
+"""
+Tests for coalescing of concurrent lookups.
+"""
+
+import asyncio
+from typing import List
+
+import pytest
+
+from api.coalescing import LookupCoalescer
+from geoip_api import GeoResult, ParsedIP, parse_ip
+from geoip_api.exceptions import InvalidIPError
+
+# Address the stand-in lookup treats as invalid
+REJECTED_IP = "192.0.2.1"
+
+
+def _recording_lookup(calls):
+    def lookup_batch(addresses):
+        calls.append([address.text for address in addresses])
+        return [
+            None if address.text == REJECTED_IP else GeoResult(city=address.text)
+            for address in addresses
+        ]
+
+    return lookup_batch
+
+
+@pytest.mark.parametrize("batching", [False, True])
+def test_identical_lookups_share_one_call(batching):
+    """Test that concurrent lookups of one address run a single lookup."""
+    calls: List[List[str]] = []
+    coalescer = LookupCoalescer(batching=batching)
+    address = parse_ip("8.8.8.8")
+
+    async def run():
+        lookup_batch = _recording_lookup(calls)
+        return await asyncio.gather(
+            *(coalescer.lookup(lookup_batch, address) for _ in range(5))
+        )
+
+    results = asyncio.run(run())
+
+    assert calls == [["8.8.8.8"]]
+    assert all(result.city == "8.8.8.8" for result in results)
+    assert coalescer.stats()["coalesced"] == 4
+    assert coalescer.stats()["in_flight"] == 0
+
+
+def test_batching_merges_addresses():
+    """Test that different addresses in one tick are looked up together."""
+    calls: List[List[str]] = []
+    coalescer = LookupCoalescer(batching=True)
+
+    async def run():
+        lookup_batch = _recording_lookup(calls)
+        return await asyncio.gather(
+            coalescer.lookup(lookup_batch, parse_ip("8.8.8.8")),
+            coalescer.lookup(lookup_batch, parse_ip("1.1.1.1")),
+        )
+
+    results = asyncio.run(run())
+
+    assert calls == [["8.8.8.8", "1.1.1.1"]]
+    assert [result.city for result in results] == ["8.8.8.8", "1.1.1.1"]
+
+
+def test_rejected_address_raises():
+    """Test that a rejected address fails only its own lookups."""
+    coalescer = LookupCoalescer(batching=True)
+
+    async def run():
+        lookup_batch = _recording_lookup([])
+        addresses: List[ParsedIP] = [parse_ip(REJECTED_IP), parse_ip("8.8.8.8")]
+        return await asyncio.gather(
+            *(coalescer.lookup(lookup_batch, address) for address in addresses),
+            return_exceptions=True,
+        )
+
+    rejected, valid = asyncio.run(run())
+
+    assert isinstance(rejected, InvalidIPError)
+    assert valid.city == "8.8.8.8"
+
+
+def test_failed_batch_fails_only_its_culprit():
+    """Test that a failing address does not fail the rest of its batch."""
+    calls: List[List[str]] = []
+    coalescer = LookupCoalescer(batching=True)
+    recording_lookup = _recording_lookup(calls)
+
+    def lookup_batch(addresses):
+        if any(address.text == "10.0.0.1" for address in addresses):
+            raise RuntimeError("lookup failed")
+        return recording_lookup(addresses)
+
+    async def run():
+        addresses = [parse_ip("8.8.8.8"), parse_ip("10.0.0.1"), parse_ip("1.1.1.1")]
+        return await asyncio.gather(
+            *(coalescer.lookup(lookup_batch, address) for address in addresses),
+            return_exceptions=True,
+        )
+
+    first, failed, last = asyncio.run(run())
+
+    assert isinstance(failed, RuntimeError)
+    assert [first.city, last.city] == ["8.8.8.8", "1.1.1.1"]
+    assert calls == [["8.8.8.8"], ["1.1.1.1"]]
+    assert coalescer.stats()["in_flight"] == 0
@@ -0,0 +1,75 @@
+"""
+Tests for client address resolution behind proxies.
+"""
+
+import pytest
+
+from api.proxies import compile_trusted_proxies, forwarded_hops, resolve_client
+from geoip_api import parse_ip
+
+TRUSTED = compile_trusted_proxies(["private", "203.0.113.0/24"])
+
+
+def test_trusted_proxies():
+    """Test membership in the trusted proxy networks."""
+    assert parse_ip("10.1.2.3") in TRUSTED
+    assert parse_ip("::1") in TRUSTED
+    assert parse_ip("203.0.113.9") in TRUSTED
+    assert parse_ip("8.8.8.8") not in TRUSTED
+    # Carrier-grade NAT hosts are not proxies
+    assert parse_ip("100.64.0.1") not in TRUSTED
+
+    loopback = compile_trusted_proxies(["loopback"])
+    assert parse_ip("127.0.0.1") in loopback
+    assert parse_ip("::1") in loopback
+    assert parse_ip("10.1.2.3") not in loopback
+
+
+def test_forwarded_hops():
+    """Test collecting hops from both header formats."""
+    assert forwarded_hops([], ["1.2.3.4, 10.0.0.1", "10.0.0.2"]) == [
+        "1.2.3.4",
+        " 10.0.0.1",
+        "10.0.0.2",
+    ]
+    assert forwarded_hops(
+        ['for=192.0.2.60;proto=http, For="[2001:db8:cafe::17]:4711"'], []
+    ) == ["192.0.2.60", '"[2001:db8:cafe::17]:4711"']
+
+
+def test_forwarded_hops_header():
+    """Test that only the header written by the proxies is read."""
+    # A client's own Forwarded header, passed on by a proxy appending XFF
+    spoofed, appended = ["for=1.1.1.1"], ["8.8.8.8"]
+    assert forwarded_hops(spoofed, appended) == ["8.8.8.8"]
+    assert forwarded_hops(spoofed, appended, "x-forwarded-for") == ["8.8.8.8"]
+    assert forwarded_hops(spoofed, [], "x-forwarded-for") == []
+    # And the reverse, behind a proxy writing Forwarded
+    assert forwarded_hops(["for=8.8.8.8"], ["1.1.1.1"], "forwarded") == ["8.8.8.8"]
+    assert forwarded_hops([], ["1.1.1.1"], "forwarded") == []
+
+    with pytest.raises(ValueError):
+        forwarded_hops([], [], "x-real-ip")
+
+
+@pytest.mark.parametrize(
+    "peer,hops,client",
+    [
+        # Untrusted peers are the client, whatever they send
+        ("8.8.4.4", ["1.1.1.1"], "8.8.4.4"),
+        # Trusted proxies are skipped from the right
+        ("10.0.0.1", ["1.1.1.1", "8.8.8.8", "203.0.113.5"], "8.8.8.8"),
+        ("10.0.0.1", ["1.1.1.1:5678"], "1.1.1.1"),
+        ("10.0.0.1", ['"[2001:db8:cafe::17]:4711"'], "2001:db8:cafe::17"),
+        # Only trusted proxies: the first one is the client
+        ("10.0.0.1", ["192.168.1.1", "10.0.0.2"], "192.168.1.1"),
+        (None, ["1.1.1.1"], "1.1.1.1"),
+        # No client known
+        ("10.0.0.1", [], None),
+        ("10.0.0.1", ["unknown"], None),
+    ],
+)
+def test_resolve_client(peer, hops, client):
+    """Test right-to-left resolution of the client address."""
+    resolved = resolve_client(parse_ip(peer) if peer else None, hops, TRUSTED)
+    assert (resolved.text if resolved else None) == client
@@ -2,9 +2,17 @@
 Tests for the FastAPI routes.
 """
 
+import ipaddress
+import json
+import threading
+import time
+
+import pytest
 from fastapi.testclient import TestClient
 
+from api.dependencies import get_geoip_lookup
 from api.main import app
+from geoip_api import GeoIPLookup
 from tests.conftest import TEST_IP_GOOGLE_DNS, TEST_IP_INVALID
 
 client = TestClient(app)
@@ -38,6 +46,40 @@ def test_lookup_endpoint_invalid_ip():
     assert response.status_code == 400
 
 
+def test_lookup_endpoint_private_ip():
+    """Test the lookup endpoint with a private IP."""
+    response = client.get("/10.0.0.1")
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["special"] == "private"
+    assert data["country"] is None
+
+
+def test_lookup_materialized_json(monkeypatch):
+    """Test that pre-serialized responses match the regular ones."""
+    expected = client.get(f"/{TEST_IP_GOOGLE_DNS}").content
+
+    monkeypatch.setattr("api.main.MATERIALIZED_JSON", "lazy")
+    response = client.get(f"/{TEST_IP_GOOGLE_DNS}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == expected
+
+
+def test_self_lookup_behind_proxy():
+    """Test that a request from a proxy looks up the forwarded client."""
+    response = client.get("/", headers={"X-Forwarded-For": TEST_IP_GOOGLE_DNS})
+    assert response.status_code == 200
+    assert response.json()["ip"] == TEST_IP_GOOGLE_DNS
+
+    response = client.get(
+        "/", headers={"X-Forwarded-For": f"{TEST_IP_GOOGLE_DNS}, 127.0.0.1"}
+    )
+    assert response.status_code == 200
+    assert response.json()["ip"] == TEST_IP_GOOGLE_DNS
+
+
 def test_lookup_query_endpoint_valid_ip():
     """Test the lookup query endpoint with a valid IP."""
     response = client.get(f"/api/v1/geoip/lookup?ip={TEST_IP_GOOGLE_DNS}")
@@ -53,3 +95,196 @@ def test_lookup_query_endpoint_missing_param():
     """Test the lookup query endpoint with a missing IP parameter."""
     response = client.get("/api/v1/geoip/lookup")
     assert response.status_code == 422  # Validation error
+
+
+def test_lookup_batch_endpoint(monkeypatch):
+    """Test batch lookups, which keep order and report invalid addresses."""
+    response = client.post(
+        "/api/v1/geoip/lookup", json={"ips": [TEST_IP_INVALID, TEST_IP_GOOGLE_DNS]}
+    )
+    assert response.status_code == 200
+
+    invalid, valid = response.json()["results"]
+    assert invalid == {
+        "ip": TEST_IP_INVALID,
+        "error": f"Invalid IP address: {TEST_IP_INVALID}",
+    }
+    assert valid["ip"] == TEST_IP_GOOGLE_DNS
+    assert "country" in valid
+
+    monkeypatch.setattr("api.routes.geoip.LOOKUP_BATCH_MAX", 1)
+    response = client.post(
+        "/api/v1/geoip/lookup", json={"ips": [TEST_IP_GOOGLE_DNS] * 2}
+    )
+    assert response.status_code == 400
+
+
+def test_aggregate_endpoint():
+    """Test aggregation of JSON and newline-delimited address lists."""
+    ips = [TEST_IP_GOOGLE_DNS, TEST_IP_GOOGLE_DNS, TEST_IP_INVALID]
+    response = client.post(
+        "/api/v1/geoip/aggregate?group_by=code,asn&distinct=ip", json={"ips": ips}
+    )
+    assert response.status_code == 200
+
+    summary = response.json()
+    assert summary["total"] == 3
+    assert summary["invalid"] == 1
+    assert summary["groups"][0]["count"] == 2
+    assert summary["distinct"] == {"ip": 1}
+
+    streamed = client.post(
+        "/api/v1/geoip/aggregate?group_by=code&group_by=asn&distinct=ip",
+        content="\n".join(ips) + "\n",
+        headers={"Content-Type": "text/plain"},
+    )
+    assert streamed.json() == summary
+
+
+def test_aggregate_endpoint_unknown_field():
+    """Test that unknown group-by fields are rejected."""
+    response = client.post("/api/v1/geoip/aggregate?group_by=network", json={"ips": []})
+    assert response.status_code == 400
+
+
+def test_asn_networks_endpoint():
+    """Test streaming the networks of an ASN."""
+    response = client.get("/api/v1/geoip/asn/15169/networks")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    networks = [ipaddress.ip_network(line) for line in response.text.splitlines()]
+    assert any(ipaddress.ip_address(TEST_IP_GOOGLE_DNS) in n for n in networks)
+
+
+def test_asn_networks_endpoint_unknown_asn():
+    """Test streaming the networks of an ASN that has none."""
+    response = client.get("/api/v1/geoip/asn/0/networks")
+    assert response.status_code == 404
+
+
+def test_country_networks_endpoint():
+    """Test streaming the networks of a country."""
+    response = client.get("/api/v1/geoip/country/US/networks")
+    assert response.status_code == 200
+
+    networks = [ipaddress.ip_network(line) for line in response.text.splitlines()]
+    assert any(ipaddress.ip_address(TEST_IP_GOOGLE_DNS) in n for n in networks)
+
+
+def test_network_endpoint():
+    """Test streaming the networks inside a CIDR block."""
+    response = client.get("/api/v1/geoip/network/8.8.8.0/24")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert results
+    assert all("network" in r and "country" in r for r in results)
+
+
+def test_network_endpoint_invalid():
+    """Test streaming the networks of an invalid CIDR block."""
+    response = client.get("/api/v1/geoip/network/8.8.8.0/33")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "cidr", ["8.0.0.0/7", "2001::/16", "::/64", "::ffff:0:0/100", "2002::/20"]
+)
+def test_network_endpoint_too_large(cidr):
+    """Test that blocks wider than the configured prefix limits are refused."""
+    response = client.get(f"/api/v1/geoip/network/{cidr}")
+    assert response.status_code == 400
+    assert "too large" in response.json()["detail"]
+
+
+def test_network_endpoint_prefix_limit(monkeypatch):
+    """Test that the prefix limits can be lowered."""
+    monkeypatch.setattr("api.routes.geoip.NETWORK_MIN_PREFIX_V4", 24)
+    assert client.get("/api/v1/geoip/network/8.8.0.0/16").status_code == 400
+    assert client.get("/api/v1/geoip/network/::ffff:8.8.8.0/120").status_code == 200
+
+    monkeypatch.setattr("api.routes.geoip.NETWORK_MIN_PREFIX_V4", 7)
+    assert client.get("/api/v1/geoip/network/8.0.0.0/7").status_code == 200
+
+
+def test_network_endpoint_overrides(real_db_paths, tmp_path):
+    """Test that the network endpoint agrees with lookups inside overrides."""
+    overrides = tmp_path / "overrides.json"
+    overrides.write_text(
+        json.dumps({"8.8.8.0/25": {"city": "Anycast"}, "11.0.0.0/8": {"code": "AU"}})
+    )
+    lookup = GeoIPLookup(
+        city_db_path=real_db_paths["city"],
+        asn_db_path=real_db_paths["asn"],
+        overrides_path=str(overrides),
+    )
+    app.dependency_overrides[get_geoip_lookup] = lambda: lookup
+    try:
+        for cidr in ("8.8.8.0/24", "11.0.0.0/8"):
+            response = client.get(f"/api/v1/geoip/network/{cidr}")
+            results = [json.loads(line) for line in response.text.splitlines()]
+            assert results
+            for result in results:
+                network = ipaddress.ip_network(result.pop("network"))
+                for address in (network[0], network[-1]):
+                    expected = client.get(f"/api/v1/geoip/lookup/{address}").json()
+                    assert {"ip": str(address), **result} == expected
+        # Found in neither database, but overridden
+        assert network == ipaddress.ip_network("11.0.0.0/8")
+        assert results == [lookup.lookup("11.0.0.1")]
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_lookup_endpoint_while_starting(monkeypatch):
+    """Test that fast startup mode answers 503 until the databases are ready."""
+    monkeypatch.setattr("api.dependencies.STARTUP_MODE", "fast")
+    monkeypatch.setattr("api.dependencies.databases_ready", threading.Event())
+
+    response = client.get(f"/api/v1/geoip/lookup/{TEST_IP_GOOGLE_DNS}")
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_healthz():
+    """Test the liveness probe."""
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_readyz(monkeypatch):
+    """Test that the readiness probe turns ready without any lookup."""
+    monkeypatch.setattr("api.dependencies.databases_ready", threading.Event())
+
+    # Entering the client runs the startup, which prepares the databases
+    with TestClient(app) as startup_client:
+        deadline = time.monotonic() + 10
+        response = startup_client.get("/readyz")
+        while response.status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.05)
+            response = startup_client.get("/readyz")
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["status"] == "ready"
+    assert data["databases"]["city"]["loaded"]
+    assert data["databases"]["asn"]["loaded"]
+    assert "path" not in data["databases"]["city"]
+    assert "path" not in data["overrides"]
+
+
+def test_readyz_invalid_overrides(monkeypatch):
+    """Test that a lookup failing to load makes the probe report an error."""
+
+    def get_shared_lookup():
+        raise ValueError("Invalid override file overrides.json: expected an object")
+
+    monkeypatch.setattr("api.routes.health.get_shared_lookup", get_shared_lookup)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["status"] == "error"
+    assert "override" in response.json()["error"]
+    assert "overrides.json" not in response.text
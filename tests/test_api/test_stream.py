@@ -0,0 +1,66 @@
+"""
+Tests for the WebSocket lookup endpoint.
+"""
+
+import asyncio
+from typing import List
+
+from fastapi.testclient import TestClient
+
+from api.main import app
+from api.routes import stream
+from tests.conftest import TEST_IP_CLOUDFLARE, TEST_IP_GOOGLE_DNS, TEST_IP_INVALID
+
+client = TestClient(app)
+
+
+def test_stream_lookups():
+    """Test single and batch lookups with correlation IDs."""
+    with client.websocket_connect("/api/v1/ws") as websocket:
+        # Pipelined: both requests are sent before reading any answer
+        websocket.send_json({"id": "a", "ip": TEST_IP_GOOGLE_DNS})
+        websocket.send_json({"id": 7, "ips": [TEST_IP_CLOUDFLARE, TEST_IP_INVALID]})
+
+        single = websocket.receive_json()
+        assert single["id"] == "a"
+        assert single["result"]["ip"] == TEST_IP_GOOGLE_DNS
+        assert "country" in single["result"]
+
+        batch = websocket.receive_json()
+        assert batch["id"] == 7
+        assert batch["results"][0]["ip"] == TEST_IP_CLOUDFLARE
+        assert "error" in batch["results"][1]
+
+
+def test_stream_errors():
+    """Test that bad requests are answered without closing the connection."""
+    with client.websocket_connect("/api/v1/ws") as websocket:
+        websocket.send_text("not json")
+        assert "error" in websocket.receive_json()
+
+        websocket.send_json({"id": 1, "ip": TEST_IP_INVALID})
+        assert websocket.receive_json() == {
+            "id": 1,
+            "error": f"Invalid IP address: {TEST_IP_INVALID}",
+        }
+
+        websocket.send_json({"id": 2})
+        assert websocket.receive_json()["id"] == 2
+
+
+def test_stream_prepares_off_event_loop(monkeypatch):
+    """Test that waiting for the databases does not block the event loop."""
+    loops: List[object] = []
+
+    def require_databases():
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            loops.append(None)
+        return True
+
+    monkeypatch.setattr(stream, "require_databases", require_databases)
+    with client.websocket_connect("/api/v1/ws") as websocket:
+        websocket.send_json({"id": 1, "ip": TEST_IP_GOOGLE_DNS})
+        assert websocket.receive_json()["id"] == 1
+    assert loops == [None]
@@ -0,0 +1,101 @@
+"""
+Tests for the HTTP clients.
+"""
+
+import asyncio
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import uvicorn
+
+from api.main import app
+from geoip_api.client import AsyncGeoIPClient, GeoIPClient
+from geoip_api.exceptions import InvalidIPError, LookupError
+from tests.conftest import TEST_IP_CLOUDFLARE, TEST_IP_GOOGLE_DNS, TEST_IP_INVALID
+
+
+@pytest.fixture(scope="module")
+def api_url():
+    """Serve the API on a free local port in a background thread."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, args=([sock],), daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            pytest.skip("API server failed to start")
+        threading.Event().wait(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join()
+
+
+def test_client_lookup(api_url, geoip_lookup):
+    """Test that the client mirrors GeoIPLookup.lookup and lookup_many."""
+    with GeoIPClient(api_url) as client:
+        assert client.batch_window == 0
+        expected = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS)
+        assert client.lookup(TEST_IP_GOOGLE_DNS) == expected
+        assert client.lookup(TEST_IP_GOOGLE_DNS, as_dict=False) == (
+            geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+        )
+        with pytest.raises(InvalidIPError):
+            client.lookup(TEST_IP_INVALID)
+
+        ips = [TEST_IP_GOOGLE_DNS, TEST_IP_INVALID, TEST_IP_CLOUDFLARE, "2001:db8::1"]
+        assert client.lookup_many(ips) == geoip_lookup.lookup_many(ips)
+
+
+def test_client_micro_batching(api_url, real_db_paths):
+    """Test that concurrent single lookups share one batch request."""
+    ips = [TEST_IP_GOOGLE_DNS, TEST_IP_CLOUDFLARE, "2001:db8::1", "2001:db8::2"]
+    with GeoIPClient(api_url, batch_window=0.5, cache_size=16) as client:
+        requests_log = []
+        client._transport.session.hooks["response"].append(
+            lambda response, **kwargs: requests_log.append(response.request.method)
+        )
+        with ThreadPoolExecutor(len(ips)) as pool:
+            results = list(pool.map(client.lookup, ips))
+        assert requests_log == ["POST"]
+        assert [result["code"] for result in results[:2]] == ["US", "AU"]
+
+        # Cached results are answered without a request
+        assert client.lookup(TEST_IP_GOOGLE_DNS) == results[0]
+        assert requests_log == ["POST"]
+
+
+def test_async_client(api_url, geoip_lookup):
+    """Test async lookups, merged into one batch when made concurrently."""
+
+    async def lookups():
+        async with AsyncGeoIPClient(
+            api_url, batch_window=0.01, max_batch_size=2
+        ) as client:
+            single = await asyncio.gather(
+                client.lookup(TEST_IP_GOOGLE_DNS),
+                client.lookup(TEST_IP_CLOUDFLARE),
+                client.lookup(TEST_IP_GOOGLE_DNS),
+            )
+            many = await client.lookup_many([TEST_IP_INVALID, TEST_IP_CLOUDFLARE])
+            return single, many
+
+    single, many = asyncio.run(lookups())
+    google = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS)
+    cloudflare = geoip_lookup.lookup(TEST_IP_CLOUDFLARE)
+    assert single == [google, cloudflare, google]
+    assert many == [None, cloudflare]
+
+
+def test_client_unreachable():
+    """Test that connection failures are retried, then raised as LookupError."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    sock.close()
+    with GeoIPClient(url, retries=2, backoff=0.01, batch_window=0) as client:
+        with pytest.raises(LookupError):
+            client.lookup(TEST_IP_GOOGLE_DNS)
@@ -2,9 +2,16 @@
 Tests for the GeoIP lookup functionality.
 """
 
+import ipaddress
+import json
+
 import pytest
 
-from geoip_api import GeoIPLookup
+from geoip_api import GeoIPLookup, GeoResult, parse_ip
+from geoip_api.core.aggregate import HyperLogLog
+from geoip_api.core.overrides import OverrideTable
+from geoip_api.core.special import special_range
+from geoip_api.core.tree import walk_networks
 from geoip_api.exceptions import InvalidIPError
 from tests.conftest import TEST_IP_GOOGLE_DNS, TEST_IP_INVALID
 
@@ -40,3 +47,402 @@ def test_lookup_invalid_ip(geoip_lookup):
     """Test lookup with an invalid IP."""
     with pytest.raises(InvalidIPError):
         geoip_lookup.lookup(TEST_IP_INVALID)
+
+
+def test_networks_for_asn(geoip_lookup):
+    """Test the ASN reverse index."""
+    networks = [ipaddress.ip_network(n) for n in geoip_lookup.networks_for_asn(15169)]
+
+    assert networks
+    assert any(ipaddress.ip_address(TEST_IP_GOOGLE_DNS) in n for n in networks)
+
+
+def test_networks_for_unknown_asn(geoip_lookup):
+    """Test the ASN reverse index with an ASN that has no networks."""
+    assert list(geoip_lookup.networks_for_asn(0)) == []
+
+
+def test_networks_for_country(geoip_lookup):
+    """Test the country reverse index, including case-insensitive codes."""
+    networks = [
+        ipaddress.ip_network(n) for n in geoip_lookup.networks_for_country("us")
+    ]
+
+    assert any(ipaddress.ip_address(TEST_IP_GOOGLE_DNS) in n for n in networks)
+
+
+def test_lookup_network(geoip_lookup):
+    """Test enumerating the networks inside a CIDR block."""
+    results = list(geoip_lookup.lookup_network("8.8.8.0/24"))
+
+    assert results
+    networks = [ipaddress.ip_network(r["network"]) for r in results]
+    block = ipaddress.IPv4Network("8.8.8.0/24")
+    assert all(n.subnet_of(block) for n in networks)  # type: ignore[arg-type]
+    assert networks == sorted(networks)
+    assert any(ipaddress.ip_address(TEST_IP_GOOGLE_DNS) in n for n in networks)
+    assert all(r["asn"] == 15169 for r in results)
+
+
+def test_lookup_network_matches_lookup(geoip_lookup):
+    """Test that a network result agrees with a single-address lookup."""
+    (result,) = [
+        r
+        for r in geoip_lookup.lookup_network("8.8.8.0/24")
+        if ipaddress.ip_address(TEST_IP_GOOGLE_DNS)
+        in ipaddress.ip_network(r["network"])
+    ]
+    expected = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS)
+
+    assert {k: v for k, v in result.items() if k != "network"} == expected
+
+
+@pytest.mark.parametrize(
+    "cidr,alias",
+    [("::ffff:0:0/96", "::ffff:8.8.8.0/120"), ("2002::/16", "2002:808:800::/40")],
+)
+def test_lookup_network_ipv4_alias(geoip_lookup, cidr, alias):
+    """Test enumerating the IPv4-mapped and 6to4 aliases of IPv4 networks."""
+    first = next(iter(geoip_lookup.lookup_network(cidr)))
+    assert ipaddress.ip_network(first["network"]).subnet_of(
+        ipaddress.ip_network(cidr)  # type: ignore[arg-type]
+    )
+
+    results = list(geoip_lookup.lookup_network(alias))
+    assert results
+    assert all(r["asn"] == 15169 for r in results)
+
+
+class _FakeTree:
+    """Search tree over a list of (left, right) nodes, records after them."""
+
+    def __init__(self, nodes, ipv4_start=0):
+        self.nodes = nodes
+        self.node_count = len(nodes)
+        self.ip_version = 6
+        self.ipv4_start = ipv4_start
+
+    def start_node(self, version):
+        return self.ipv4_start if version == 4 else 0
+
+    def child(self, value, bit):
+        return self.nodes[value][bit] if value < self.node_count else value
+
+    def record_offset(self, value):
+        return 0 if value <= self.node_count else value - self.node_count
+
+
+def test_walk_networks_alias_with_own_data():
+    """Test that an alias is walked when another tree has data there."""
+    # ::/96 leads to the IPv4 subtree at node 96, which 8000::/1 also aliases
+    empty = 97
+    nodes = [(i + 1, empty) for i in range(96)] + [(empty + 1, empty + 2)]
+    nodes[0] = (1, 96)
+    aliasing = _FakeTree(nodes, ipv4_start=96)
+    # A tree with a record of its own for 8000::/1
+    own = _FakeTree([(1, 1 + 5)])
+
+    networks = list(walk_networks([aliasing], None))  # type: ignore[list-item]
+    assert [str(n) for n, _ in networks] == ["0.0.0.0/1", "128.0.0.0/1"]
+
+    networks = list(walk_networks([aliasing, own], None))  # type: ignore[list-item]
+    assert [(str(n), offsets) for n, offsets in networks] == [
+        ("0.0.0.0/1", (1, 0)),
+        ("128.0.0.0/1", (2, 0)),
+        ("8000::/2", (1, 5)),
+        ("c000::/2", (2, 5)),
+    ]
+
+
+def test_lookup_network_invalid(geoip_lookup):
+    """Test enumerating an invalid CIDR block."""
+    with pytest.raises(InvalidIPError):
+        geoip_lookup.lookup_network("8.8.8.0/33")
+
+
+def test_warm_up(geoip_lookup):
+    """Test prefetching the databases and replaying sample lookups."""
+    stats = geoip_lookup.warm_up("read", [TEST_IP_GOOGLE_DNS, TEST_IP_INVALID])
+
+    assert stats["bytes_prefetched"] > 0
+    assert stats["lookups_replayed"] == 1
+    assert geoip_lookup.status()["databases"]["city"]["loaded"]
+
+
+def test_lookup_typed_result(geoip_lookup):
+    """Test that the typed result matches the dict API."""
+    result = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+
+    assert isinstance(result, GeoResult)
+    assert result.to_dict() == geoip_lookup.lookup(TEST_IP_GOOGLE_DNS)
+    assert result.to_dict(TEST_IP_GOOGLE_DNS)["ip"] == TEST_IP_GOOGLE_DNS
+
+
+def test_lookup_typed_result_interned(geoip_lookup):
+    """Test that repeated text fields share one string object."""
+    first = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+    second = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+
+    assert first.country is not None
+    assert first.country is second.country
+    assert first.isp is second.isp
+
+
+def test_lookup_decode_cache(geoip_lookup):
+    """Test that repeated lookups are served from the decoded record cache."""
+    geoip_lookup.lookup(TEST_IP_GOOGLE_DNS)
+    first = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+    second = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+
+    assert first is second
+    assert geoip_lookup.status()["caches"]["results"]["hits"] >= 2
+
+
+def test_lookup_many(geoip_lookup):
+    """Test batch lookups with duplicate and invalid addresses."""
+    results = geoip_lookup.lookup_many(
+        [TEST_IP_GOOGLE_DNS, TEST_IP_INVALID, TEST_IP_GOOGLE_DNS], as_dict=False
+    )
+
+    assert results[0] == geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+    assert results[1] is None
+    assert results[2] is results[0]
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["8.8.8.8", "0.0.0.0", "255.255.255.255", "2001:4860:4860::8888", "::ffff:1.2.3.4"],
+)
+def test_parse_ip(text):
+    """Test that parsed addresses match the ipaddress module."""
+    address = ipaddress.ip_address(text)
+    parsed = parse_ip(text)
+
+    assert parsed == (text, address.version, address.packed, int(address))
+
+
+@pytest.mark.parametrize(
+    "text", ["256.1.1.1", "1.2.3", "1.2.3.4.5", "01.2.3.4", "1..2.3", "١.2.3.4", ""]
+)
+def test_parse_ip_invalid(text):
+    """Test that the IPv4 fast path rejects what the ipaddress module rejects."""
+    with pytest.raises(ValueError):
+        parse_ip(text)
+
+
+def test_lookup_parsed_ip(geoip_lookup):
+    """Test lookups with a pre-parsed address."""
+    result = geoip_lookup.lookup(parse_ip(TEST_IP_GOOGLE_DNS), as_dict=False)
+
+    assert result == geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+
+
+@pytest.mark.parametrize(
+    "text,kind",
+    [
+        ("10.1.2.3", "private"),
+        ("172.31.255.255", "private"),
+        ("100.64.0.1", "private"),
+        ("127.0.0.1", "private"),
+        ("fe80::1", "private"),
+        ("192.0.2.10", "reserved"),
+        ("2001:db8::1", "reserved"),
+        ("::ffff:10.1.2.3", "private"),
+        ("::ffff:192.0.2.10", "reserved"),
+        ("::ffff:8.8.8.8", None),
+        ("255.255.255.255", "reserved"),
+        ("172.32.0.1", None),
+        ("8.8.8.8", None),
+        ("2001:4860:4860::8888", None),
+    ],
+)
+def test_special_range(text, kind):
+    """Test classification of special-purpose addresses."""
+    special = special_range(parse_ip(text))
+    assert (special.kind if special else None) == kind
+
+
+def test_lookup_special_range(geoip_lookup):
+    """Test that special-purpose addresses are answered without a search."""
+    result, network = geoip_lookup.lookup_with_network("192.168.1.1")
+
+    assert result == GeoResult(special="private")
+    assert network == ipaddress.ip_network("192.168.0.0/16")
+    assert geoip_lookup.lookup(TEST_IP_GOOGLE_DNS)["special"] is None
+
+    result, network = geoip_lookup.lookup_with_network("::ffff:192.168.1.1")
+    assert result == GeoResult(special="private")
+    assert network == ipaddress.ip_network("::ffff:192.168.0.0/112")
+
+
+@pytest.mark.parametrize("materialize_json", [False, True])
+def test_lookup_json(real_db_paths, materialize_json):
+    """Test that JSON lookups match serializing the dict result."""
+    lookup = GeoIPLookup(
+        city_db_path=real_db_paths["city"],
+        asn_db_path=real_db_paths["asn"],
+        materialize_json=materialize_json,
+    )
+
+    for ip in (TEST_IP_GOOGLE_DNS, "10.0.0.1", "2001:4860:4860::8888", "0.0.0.1"):
+        expected = lookup.lookup(ip, as_dict=False).to_dict(ip)
+        assert json.loads(lookup.lookup_json(ip)) == expected
+    assert (lookup.status()["materialized_json"] > 0) == materialize_json
+
+
+def test_diff(real_db_paths, tmp_path):
+    """Test that a diff lists exactly the networks whose result changed."""
+    old = GeoIPLookup(
+        city_db_path=real_db_paths["city"], asn_db_path=real_db_paths["asn"]
+    )
+    assert old.diff(old).changed == []
+
+    # Rename a city in place, which keeps every record offset
+    city = old.lookup(TEST_IP_GOOGLE_DNS)["city"].encode()
+    renamed = tmp_path / "GeoLite2-City.mmdb"
+    with open(real_db_paths["city"], "rb") as f:
+        renamed.write_bytes(f.read().replace(city, city[:-1] + b"_"))
+    new = GeoIPLookup(city_db_path=str(renamed), asn_db_path=real_db_paths["asn"])
+
+    diff = new.diff(old)
+    assert diff.old_epoch == old.epoch and diff.new_epoch == new.epoch
+    assert parse_ip(TEST_IP_GOOGLE_DNS) in diff.changed_set
+    assert diff.stats["fields_changed"] == {"city": diff.stats["networks_changed"]}
+    for network in diff.changed:
+        assert old.lookup(str(network[0]))["city"] == city.decode()
+
+
+def test_aggregate(geoip_lookup):
+    """Test counting results by field, with top-N and distinct counts."""
+    ips = [TEST_IP_GOOGLE_DNS] * 3 + ["8.8.4.4", "1.1.1.1", TEST_IP_INVALID]
+    summary = geoip_lookup.aggregate(
+        ips, group_by=["code", "asn"], top=1, distinct=["ip", "code"]
+    )
+    google = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS)
+
+    assert summary["total"] == 6
+    assert summary["invalid"] == 1
+    assert summary["groups"] == [
+        {"code": google["code"], "asn": google["asn"], "count": 4}
+    ]
+    assert summary["other"] == 1
+    assert summary["distinct"]["ip"] == 3
+
+    with pytest.raises(ValueError):
+        geoip_lookup.aggregate(ips, group_by=["network"])
+
+
+def test_hyperloglog_estimate():
+    """Test that distinct estimates stay close to the true count."""
+    counter = HyperLogLog()
+    for i in range(50000):
+        counter.add(i.to_bytes(4, "big"))
+        counter.add(i.to_bytes(4, "big"))
+    assert abs(counter.count() - 50000) < 50000 * 0.03
+
+
+def test_override_table():
+    """Test longest-prefix matching of nested overrides."""
+    table = OverrideTable(
+        {
+            "10.0.0.0/8": {"country": "Internal"},
+            "10.1.0.0/16": {"city": "Office"},
+            "10.1.2.3": {"city": "Gateway"},
+            "2001:db8::/32": {"code": "AU"},
+        }
+    )
+    assert len(table) == 4
+
+    override, prefix_len = table.find(parse_ip("10.1.2.3"))
+    assert override is not None
+    assert dict(override.fields) == {"country": "Internal", "city": "Gateway"}
+    assert prefix_len == 32
+
+    override, prefix_len = table.find(parse_ip("10.1.2.4"))
+    assert override is not None
+    assert dict(override.fields) == {"country": "Internal", "city": "Office"}
+    # The largest network around 10.1.2.4 that excludes 10.1.2.3
+    assert prefix_len == 30
+
+    override, prefix_len = table.find(parse_ip("10.2.0.1"))
+    assert override is not None
+    assert override.network == "10.0.0.0/8"
+    assert prefix_len == 15
+
+    assert table.find(parse_ip("11.0.0.1")) == (None, 8)
+    override, _ = table.find(parse_ip("2001:db8::1"))
+    assert override is not None
+    assert dict(override.fields)["currency"] == "AUD"
+
+    with pytest.raises(ValueError):
+        OverrideTable({"10.0.0.0/8": {"network": "10.0.0.0/8"}})
+    with pytest.raises(ValueError):
+        OverrideTable({"10.0.0.0/8": {"asn": "AS1"}})
+
+
+def test_lookup_overrides(real_db_paths, tmp_path):
+    """Test that overrides apply to every lookup method and reload on change."""
+    overrides = tmp_path / "overrides.json"
+    overrides.write_text(
+        json.dumps({TEST_IP_GOOGLE_DNS: {"city": "Anycast"}, "10.0.0.0/8": {}})
+    )
+    plain = GeoIPLookup(
+        city_db_path=real_db_paths["city"], asn_db_path=real_db_paths["asn"]
+    )
+    lookup = GeoIPLookup(
+        city_db_path=real_db_paths["city"],
+        asn_db_path=real_db_paths["asn"],
+        overrides_path=str(overrides),
+    )
+
+    expected = {**plain.lookup(TEST_IP_GOOGLE_DNS), "city": "Anycast"}
+    assert lookup.lookup(TEST_IP_GOOGLE_DNS) == expected
+    assert lookup.lookup_many([TEST_IP_GOOGLE_DNS]) == [expected]
+    assert json.loads(lookup.lookup_json(TEST_IP_GOOGLE_DNS)) == {
+        "ip": TEST_IP_GOOGLE_DNS,
+        **expected,
+    }
+    result, network = lookup.lookup_with_network(TEST_IP_GOOGLE_DNS)
+    assert network.prefixlen == 32
+    assert lookup.lookup("10.0.0.1") == plain.lookup("10.0.0.1")
+    assert lookup.epoch != plain.epoch
+
+    assert not lookup.reload_overrides()
+    overrides.write_text(json.dumps({TEST_IP_GOOGLE_DNS: {"city": "Edge"}}))
+    assert lookup.reload_overrides()
+    assert lookup.lookup(TEST_IP_GOOGLE_DNS)["city"] == "Edge"
+
+    # An invalid file keeps the overrides in place
+    overrides.write_text("{not json")
+    assert not lookup.reload_overrides()
+    assert lookup.lookup(TEST_IP_GOOGLE_DNS)["city"] == "Edge"
+
+
+def test_reverse_index_overrides(real_db_paths, tmp_path):
+    """Test that overrides of the ASN and country apply to the reverse index."""
+    overrides = tmp_path / "overrides.json"
+    overrides.write_text(
+        json.dumps({TEST_IP_GOOGLE_DNS: {"asn": 64500}, "11.0.0.0/8": {"code": "au"}})
+    )
+    lookup = GeoIPLookup(
+        city_db_path=real_db_paths["city"],
+        asn_db_path=real_db_paths["asn"],
+        overrides_path=str(overrides),
+    )
+
+    google = ipaddress.ip_address(TEST_IP_GOOGLE_DNS)
+    networks = [ipaddress.ip_network(n) for n in lookup.networks_for_asn(15169)]
+    assert not any(google in n for n in networks)
+    assert any(ipaddress.ip_address("8.8.8.9") in n for n in networks)
+    assert list(lookup.networks_for_asn(64500)) == [f"{TEST_IP_GOOGLE_DNS}/32"]
+    assert "11.0.0.0/8" in lookup.networks_for_country("AU")
+
+
+def test_cached_json(geoip_lookup):
+    """Test that cached_json only returns results already serialized."""
+    geoip_lookup.close()
+    assert geoip_lookup.cached_json(TEST_IP_GOOGLE_DNS) is None
+
+    body = geoip_lookup.lookup_json(TEST_IP_GOOGLE_DNS)
+    assert geoip_lookup.cached_json(TEST_IP_GOOGLE_DNS) == body
+    assert geoip_lookup.cached_json("10.0.0.1") == geoip_lookup.lookup_json("10.0.0.1")
@@ -0,0 +1,94 @@
+"""
+Tests for the sidecar server and client.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from geoip_api import GeoResult, parse_ip
+from geoip_api.exceptions import InvalidIPError, LookupError
+from geoip_api.sidecar import SidecarClient, SidecarServer
+from geoip_api.sidecar.protocol import (
+    decode_request,
+    decode_response,
+    encode_request,
+    encode_response,
+    encode_result,
+)
+from tests.conftest import TEST_IP_CLOUDFLARE, TEST_IP_GOOGLE_DNS, TEST_IP_INVALID
+
+
+@pytest.fixture
+def sidecar(geoip_lookup, tmp_path):
+    """Run a sidecar server in a background thread."""
+    server = SidecarServer(geoip_lookup, str(tmp_path / "geoip.sock"))
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.close()
+
+
+def test_protocol_round_trip():
+    """Test encoding and decoding of requests and responses."""
+    addresses = [parse_ip(TEST_IP_GOOGLE_DNS), parse_ip("2001:db8::1")]
+    request_id, _, decoded = decode_request(encode_request(7, addresses)[4:])
+    assert request_id == 7
+    assert decoded == addresses
+
+    result = GeoResult(code="DE", city="Köln", lat=50.9, lon=-6.9, asn=3320)
+    response = encode_response(7, [encode_result(result), None])
+    assert decode_response(response[4:]) == (7, [result, None], "")
+
+
+def test_sidecar_lookup(sidecar, geoip_lookup):
+    """Test single and pipelined batch lookups through the sidecar."""
+    with SidecarClient(sidecar.path) as client:
+        expected = geoip_lookup.lookup(TEST_IP_GOOGLE_DNS, as_dict=False)
+        assert client.lookup(TEST_IP_GOOGLE_DNS) == expected
+
+        with pytest.raises(InvalidIPError):
+            client.lookup(TEST_IP_INVALID)
+
+        ips = [TEST_IP_GOOGLE_DNS, TEST_IP_INVALID, TEST_IP_CLOUDFLARE] * 10
+        results = client.lookup_many(ips, batch_size=4, max_in_flight=2)
+        assert results == geoip_lookup.lookup_many(ips, as_dict=False)
+
+
+def test_sidecar_rejects_long_field(sidecar, monkeypatch):
+    """Test that an unencodable result is answered with an error frame."""
+    result = GeoResult(code="DE", city="x" * 70000)
+    monkeypatch.setattr(
+        sidecar.geoip_lookup,
+        "lookup_many",
+        lambda addresses, as_dict: [result] * len(addresses),
+    )
+    with SidecarClient(sidecar.path) as client:
+        with pytest.raises(LookupError, match="too large"):
+            client.lookup(TEST_IP_GOOGLE_DNS)
+
+
+def test_sidecar_client_reconnects_after_error(sidecar, geoip_lookup, monkeypatch):
+    """Test that a failed pipelined batch does not leave stale responses behind."""
+    calls = []
+    original = geoip_lookup.lookup_many
+
+    def lookup_many(addresses, as_dict):
+        calls.append(addresses)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return original(addresses, as_dict=as_dict)
+
+    monkeypatch.setattr(sidecar.geoip_lookup, "lookup_many", lookup_many)
+    ips = [TEST_IP_GOOGLE_DNS, TEST_IP_CLOUDFLARE] * 4
+    with SidecarClient(sidecar.path) as client:
+        with pytest.raises(LookupError):
+            client.lookup_many(ips, batch_size=2, max_in_flight=4)
+        expected = geoip_lookup.lookup(TEST_IP_CLOUDFLARE, as_dict=False)
+        assert client.lookup(TEST_IP_CLOUDFLARE) == expected